@@ -0,0 +1,197 @@
+import fitz  # PyMuPDF
+import os
+import sys
+import json
+from multiprocessing import Pool, cpu_count
+from image_extraction import collect_pdf_paths, EXTRACTION_STATS_PATH
+from zotero_source import collect_zotero_attachments, load_sync_state, SYNC_STATE_PATH
+
+# JPEG streams are written out unchanged; everything else is converted to
+# PNG, whose size is estimated from the stream length by filter (unfiltered
+# streams hold raw pixels, which PNG roughly halves). JPX images are not
+# kept by extraction at all.
+PASSTHROUGH_FILTERS = ("DCTDecode",)
+SKIPPED_FILTERS = ("JPXDecode",)
+PNG_SIZE_FACTORS = {"": 0.5, "CCITTFaxDecode": 2.0, "JBIG2Decode": 2.0}
+COLORSPACE_COMPONENTS = {"DeviceGray": 1, "CalGray": 1, "DeviceRGB": 3, "CalRGB": 3, "Lab": 3,
+                         "DeviceCMYK": 4, "Indexed": 1}
+
+# Rough cost of extraction per PDF, per image and per MB of image data, in
+# seconds of one worker. They are scaled by the timing of the last real
+# run when there is one.
+SECONDS_PER_PDF = 0.05
+SECONDS_PER_IMAGE = 0.03
+SECONDS_PER_MB = 0.04
+
+def _stream_length(doc, xref):
+    kind, value = doc.xref_get_key(xref, "Length")
+    if kind == "int":
+        return int(value)
+    if kind == "xref":
+        return int(doc.xref_object(int(value.split()[0])).strip())
+    return 0
+
+def estimate_output_size(stream_length, width, height, bpc, colorspace, image_filter):
+    """Estimate the bytes extraction would write for an image, or None if it would be skipped."""
+    if image_filter in SKIPPED_FILTERS:
+        return None
+    if image_filter in PASSTHROUGH_FILTERS:
+        return stream_length
+    raw_size = width * height * COLORSPACE_COMPONENTS.get(colorspace, 3) * max(bpc, 1) // 8
+    estimate = int(stream_length * PNG_SIZE_FACTORS.get(image_filter, 1.0))
+    # PNG never grows much beyond the raw pixels
+    return min(estimate, raw_size + raw_size // 100) if raw_size else estimate
+
+def inspect_pdf(args):
+    """
+    Work out what extracting one PDF would produce, from page counts and image
+    xref metadata alone; nothing is decoded or written.
+    """
+    pdf_path, size_limit, page_limit = args
+    result = {"pdf_path": pdf_path, "pages": 0, "skipped": False, "error": False,
+              "images_seen": 0, "images": 0, "bytes": 0}
+    try:
+        doc = fitz.open(pdf_path)
+        result["pages"] = len(doc)
+        if len(doc) > page_limit:
+            result["skipped"] = True
+            doc.close()
+            return result
+
+        lengths = {}
+        for page in doc:
+            # Same order and entries as process_pdf, so repeated images count repeatedly
+            for img in page.get_images(full=True):
+                xref, width, height, bpc, colorspace, image_filter = img[0], img[2], img[3], img[4], img[5], img[8]
+                result["images_seen"] += 1
+                if xref not in lengths:
+                    lengths[xref] = _stream_length(doc, xref)
+                size = estimate_output_size(lengths[xref], width, height, bpc, colorspace, image_filter)
+                if size is None or size < size_limit:
+                    continue
+                result["images"] += 1
+                result["bytes"] += size
+        doc.close()
+    except Exception as e:
+        print(f"Error inspecting {pdf_path}: {str(e)}")
+        result["error"] = True
+    return result
+
+def load_extraction_stats(stats_path=EXTRACTION_STATS_PATH):
+    """Load the timing of the last complete extraction, or None."""
+    if os.path.exists(stats_path):
+        try:
+            with open(stats_path, "r") as stats_file:
+                return json.load(stats_file)
+        except Exception as e:
+            print(f"Error loading extraction stats: {str(e)}")
+    return None
+
+def model_seconds(pdfs, images, size_bytes, processes):
+    """Wall-clock seconds the cost model predicts for an extraction."""
+    work = pdfs * SECONDS_PER_PDF + images * SECONDS_PER_IMAGE + size_bytes / (1024 * 1024) * SECONDS_PER_MB
+    return work / max(processes, 1)
+
+def time_calibration(stats):
+    """How much slower (or faster) the last real run was than the model predicted."""
+    if not stats or not stats.get("seconds"):
+        return 1.0
+    predicted = model_seconds(stats["pdfs"], stats["images"], stats["bytes"], stats["processes"])
+    if predicted <= 0:
+        return 1.0
+    return min(max(stats["seconds"] / predicted, 0.1), 10.0)
+
+def plan_sources(roots, size_limit, page_limit, progress_callback=None, stats_path=EXTRACTION_STATS_PATH):
+    """
+    Estimate an extraction without running it.
+
+    roots is a list of (root, pdf_paths) pairs. Returns one summary dict per
+    root followed by a "Total" summary, each with the number of PDFs, those
+    skipped by the page limit or unreadable, the projected image count and
+    bytes, and the estimated extraction time in seconds. A PDF under several
+    roots is inspected once and counted under each of them.
+    """
+    processes = min(cpu_count(), 4)  # as in extract_images_from_pdfs
+    calibration = time_calibration(load_extraction_stats(stats_path))
+
+    roots_of = {}
+    summaries = {}
+    for root, pdf_paths in roots:
+        summaries[root] = {"root": root, "pdfs": 0, "skipped_pdfs": 0, "unreadable_pdfs": 0,
+                           "images": 0, "bytes": 0, "estimated_seconds": 0.0}
+        for pdf_path in pdf_paths:
+            roots_of.setdefault(pdf_path, []).append(root)
+
+    # Inspection is much lighter than extraction, so every core is used
+    inspected = 0
+    with Pool(cpu_count()) as pool:
+        args = [(pdf_path, size_limit, page_limit) for pdf_path in roots_of]
+        for result in pool.imap_unordered(inspect_pdf, args, chunksize=16):
+            for root in roots_of[result["pdf_path"]]:
+                summary = summaries[root]
+                summary["pdfs"] += 1
+                summary["skipped_pdfs"] += result["skipped"]
+                summary["unreadable_pdfs"] += result["error"]
+                summary["images"] += result["images"]
+                summary["bytes"] += result["bytes"]
+            inspected += 1
+            if progress_callback and inspected % 100 == 0:
+                progress_callback(inspected)
+
+    total = {"root": "Total", "pdfs": 0, "skipped_pdfs": 0, "unreadable_pdfs": 0,
+             "images": 0, "bytes": 0, "estimated_seconds": 0.0}
+    for summary in summaries.values():
+        summary["estimated_seconds"] = calibration * model_seconds(
+            summary["pdfs"] - summary["skipped_pdfs"], summary["images"], summary["bytes"], processes)
+        for key in ("pdfs", "skipped_pdfs", "unreadable_pdfs", "images", "bytes", "estimated_seconds"):
+            total[key] += summary[key]
+    return list(summaries.values()) + [total]
+
+def plan_directories(directories, size_limit, page_limit, progress_callback=None):
+    """Estimate extracting all PDFs under each of the given directories."""
+    return plan_sources([(directory, collect_pdf_paths(directory)) for directory in directories],
+                        size_limit, page_limit, progress_callback)
+
+def plan_zotero(zotero_dir, size_limit, page_limit, state_path=SYNC_STATE_PATH, base_dir=None,
+                progress_callback=None):
+    """Estimate extracting the Zotero attachments changed since the last run; the sync state is not touched."""
+    # Attachments whose file is not on disk yet are already left out
+    attachments, _ = collect_zotero_attachments(zotero_dir, load_sync_state(state_path), base_dir)
+    pdf_paths = [attachment["pdf_path"] for attachment in attachments]
+    return plan_sources([(zotero_dir, pdf_paths)], size_limit, page_limit, progress_callback)
+
+def format_duration(seconds):
+    if seconds < 60:
+        return f"{seconds:.0f} s"
+    if seconds < 3600:
+        return f"{seconds / 60:.0f} min"
+    return f"{seconds / 3600:.1f} h"
+
+def format_plan(summaries):
+    """Render plan summaries as readable text, one block per root."""
+    lines = []
+    for summary in summaries:
+        lines.append(f"{summary['root']}:")
+        lines.append(f"  PDFs: {summary['pdfs']} ({summary['skipped_pdfs']} over the page limit, "
+                     f"{summary['unreadable_pdfs']} unreadable)")
+        lines.append(f"  Images: {summary['images']}")
+        lines.append(f"  Disk usage: {summary['bytes'] / (1024 * 1024):.1f} MB")
+        lines.append(f"  Estimated time: {format_duration(summary['estimated_seconds'])}")
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python extraction_plan.py <directory>... [--size-kb N] [--page-limit N]")
+        sys.exit(1)
+    arguments = sys.argv[1:]
+    size_kb, page_limit = 1000, 50
+    for option in ("--size-kb", "--page-limit"):
+        if option in arguments:
+            position = arguments.index(option)
+            value = int(arguments[position + 1])
+            del arguments[position:position + 2]
+            if option == "--size-kb":
+                size_kb = value
+            else:
+                page_limit = value
+    print(format_plan(plan_directories(arguments, size_kb * 1024, page_limit)))
@@ -0,0 +1,174 @@
+import os
+import json
+import time
+import errno
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from image_pack import split_member_path, locate_member, read_member
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+EXPORT_MANIFEST_NAME = "export_manifest.json"
+EXPORT_WORKERS = 8
+
+# Linux ioctl that makes the destination share the source's blocks
+# (copy-on-write) on filesystems such as Btrfs and XFS.
+FICLONE = 0x40049409
+
+# Export methods, cheapest first. A method that fails because the
+# filesystem does not support it is not tried again for the rest of an export.
+METHODS = ("reflink", "hardlink", "copy_file_range", "copy")
+UNSUPPORTED_ERRORS = (errno.EXDEV, errno.EPERM, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP,
+                      errno.ENOTTY, errno.EMLINK)
+
+def _reflink(source, destination):
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, "reflinks are not supported on this platform")
+    with open(source, "rb") as source_file, open(destination, "wb") as destination_file:
+        try:
+            fcntl.ioctl(destination_file.fileno(), FICLONE, source_file.fileno())
+        except OSError:
+            destination_file.close()
+            os.remove(destination)
+            raise
+
+def _copy_range(source_fd, destination, offset, length):
+    # The kernel copies the bytes, or shares them where the filesystem can
+    if not hasattr(os, "copy_file_range"):
+        raise OSError(errno.ENOSYS, "copy_file_range is not available")
+    with open(destination, "wb") as destination_file:
+        copied = 0
+        while copied < length:
+            count = os.copy_file_range(source_fd, destination_file.fileno(), length - copied,
+                                       offset + copied)
+            if count == 0:
+                raise OSError(errno.EIO, "source ended early")
+            copied += count
+
+class ImageExporter:
+    """
+    Copies image files and pack members into a folder as cheaply as the
+    filesystem allows: reflink, then hardlink, then copy_file_range, then an
+    ordinary copy. Images inside packs are copied from their byte range in
+    the pack, so they are never extracted to a temporary file.
+    """
+    def __init__(self, target_folder):
+        self.target_folder = target_folder
+        self.unsupported = set()
+        self.lock = threading.Lock()
+
+    def _methods(self):
+        return [method for method in METHODS if method not in self.unsupported]
+
+    def _mark_unsupported(self, method, error):
+        if error.errno in UNSUPPORTED_ERRORS:
+            with self.lock:
+                self.unsupported.add(method)
+
+    def export_file(self, source, destination):
+        for method in self._methods():
+            try:
+                if method == "reflink":
+                    _reflink(source, destination)
+                elif method == "hardlink":
+                    os.link(source, destination)
+                elif method == "copy_file_range":
+                    with open(source, "rb") as source_file:
+                        _copy_range(source_file.fileno(), destination, 0, os.fstat(source_file.fileno()).st_size)
+                else:
+                    shutil.copyfile(source, destination)
+                return method
+            except OSError as e:
+                if method == "copy":
+                    raise
+                self._mark_unsupported(method, e)
+                if os.path.exists(destination):
+                    os.remove(destination)
+        raise OSError(errno.EIO, f"Could not export {source}")
+
+    def export_member(self, source, destination):
+        pack_path, _ = split_member_path(source)
+        location = locate_member(source)
+        if location is None:
+            raise OSError(errno.ENOENT, f"{source} is not in its pack")
+        offset, length = location
+        if "copy_file_range" not in self.unsupported:
+            try:
+                with open(pack_path, "rb") as pack_file:
+                    _copy_range(pack_file.fileno(), destination, offset, length)
+                return "copy_file_range"
+            except OSError as e:
+                self._mark_unsupported("copy_file_range", e)
+        # Straight from the memory-mapped pack
+        with open(destination, "wb") as destination_file:
+            destination_file.write(read_member(source))
+        return "copy"
+
+    def export(self, image_id, record):
+        """Export one image; returns (image_id, file name, method), with method None on failure."""
+        source = record.get("path", "")
+        file_name = f"{image_id}{os.path.splitext(source)[1]}"
+        destination = os.path.join(self.target_folder, file_name)
+        try:
+            # Exporting again into the same folder replaces earlier exports
+            if os.path.lexists(destination):
+                os.remove(destination)
+            if split_member_path(source):
+                return image_id, file_name, self.export_member(source, destination)
+            return image_id, file_name, self.export_file(source, destination)
+        except OSError as e:
+            print(f"Error exporting {source}: {str(e)}")
+            return image_id, file_name, None
+
+def export_images(records, target_folder, progress_callback=None, max_workers=EXPORT_WORKERS):
+    """
+    Export images into target_folder along with a metadata manifest.
+
+    records maps image_id -> metadata record. Files are named <image_id>.<ext>
+    and the manifest (export_manifest.json) keeps the full record of each
+    one, merged with any manifest already in the folder. The copies run on
+    a thread pool, since they spend their time in system calls.
+
+    Returns a dict counting the images exported by each method, plus "failed".
+    """
+    os.makedirs(target_folder, exist_ok=True)
+    exporter = ImageExporter(target_folder)
+    counts = {method: 0 for method in METHODS}
+    counts["failed"] = 0
+
+    manifest_path = os.path.join(target_folder, EXPORT_MANIFEST_NAME)
+    manifest = {"images": {}}
+    if os.path.exists(manifest_path):
+        try:
+            with open(manifest_path, "r") as manifest_file:
+                manifest = json.load(manifest_file)
+        except Exception as e:
+            print(f"Error loading export manifest: {str(e)}")
+
+    exported = 0
+    with ThreadPoolExecutor(max_workers) as executor:
+        for image_id, file_name, method in executor.map(lambda item: exporter.export(*item),
+                                                        records.items()):
+            if method is None:
+                counts["failed"] += 1
+                continue
+            counts[method] += 1
+            entry = dict(records[image_id])
+            entry["source_path"] = entry.pop("path", None)
+            entry["file"] = file_name
+            manifest["images"][image_id] = entry
+            exported += 1
+            if progress_callback and exported % 1000 == 0:
+                progress_callback(exported)
+
+    manifest["exported"] = time.strftime("%Y-%m-%d %H:%M:%S")
+    try:
+        with open(manifest_path, "w") as manifest_file:
+            json.dump(manifest, manifest_file, indent=4)
+    except Exception as e:
+        print(f"Error saving export manifest: {str(e)}")
+    return counts
@@ -5,8 +5,40 @@ import uuid
 import time
 from multiprocessing import Pool, cpu_count, Manager
 from functools import partial
+from itertools import chain
 import threading
 import queue
+import asyncio
+from contextlib import contextmanager, ExitStack
+from image_index import ImageIndex
+from image_store import shard_path, resolve_image_path, image_exists, read_image_bytes, remove_image
+from image_pack import PackWriter
+from page_context import get_text_blocks, capture_caption, capture_page_text
+from perceptual_hash import (compute_phash, compute_phash_from_pdf, group_near_duplicates, DUPLICATE_MAX_DISTANCE,
+                             HASH_MAX_PIXELS)
+from zotero_source import collect_zotero_attachments, load_sync_state, save_sync_state, SYNC_STATE_PATH
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+METADATA_FILE_PATH = "images_metadata.json"
+NEAR_DUPLICATE_REPORT_PATH = "near_duplicates_report.json"
+EXTRACTION_STATS_PATH = "extraction_stats.json"
+
+# Streamed records reach the index in batches of STREAM_BATCH_SIZE, or after
+# STREAM_FLUSH_INTERVAL seconds, whichever comes first.
+STREAM_BATCH_SIZE = 200
+STREAM_FLUSH_INTERVAL = 0.5
+
+# How long closing the stream early waits for workers to finish the image
+# they are writing before they are killed
+STOP_TIMEOUT = 30
+
+# Held by every running extraction and by pack compaction; see extraction_lock
+EXTRACTION_LOCK_PATH = "extraction.lock"
 
 # Global progress tracking
 extraction_progress = {
@@ -16,6 +48,18 @@ extraction_progress = {
     'extracted_images': 0
 }
 
+# Each worker process appends to a pack of its own, so writers never share a file
+_pack_writer = None
+
+def get_pack_writer(output_folder):
+    """Return this process's pack writer for an output folder."""
+    global _pack_writer
+    if _pack_writer is None or _pack_writer.output_folder != output_folder:
+        if _pack_writer is not None:
+            _pack_writer.close()
+        _pack_writer = PackWriter(output_folder)
+    return _pack_writer
+
 def identify_image_type(image_bytes):
     """Identify the type of image from its bytes."""
     if image_bytes.startswith(b'\x89PNG\r\n\x1a\n'):
@@ -35,8 +79,9 @@ def save_image(image_bytes, image_output_path):
         print(f"Error saving image: {str(e)}")
         return False
 
-def process_image(doc, xref, output_folder, pdf_page_num, image_index, size_limit, full_pdf_path):
-    """Process a single image from a PDF document."""
+def process_image(doc, xref, output_folder, pdf_page_num, image_index, size_limit, full_pdf_path,
+                  extra_metadata=None, pack_writer=None):
+    """Process a single image from a PDF document, writing it to its shard or to a pack."""
     try:
         base_image = doc.extract_image(xref)
         image_bytes = base_image["image"]
@@ -49,57 +94,99 @@ def process_image(doc, xref, output_folder, pdf_page_num, image_index, size_limi
         if image_type == 'Unknown format':
             return None
         
-        # Create unique ID for the image
+        # Create unique ID for the image and place it in its shard or pack
         unique_id = str(uuid.uuid4())
-        image_name = f"{unique_id}.{image_type.lower()}"
-        image_output_path = os.path.join(output_folder, image_name)
-        
-        if save_image(image_bytes, image_output_path):
-            return {
-                unique_id: {
-                    "pdf_path": full_pdf_path,  # Store full path to PDF
-                    "file_name": os.path.basename(doc.name),  # Keep filename too for display purposes
-                    "page_number": pdf_page_num,
-                    "image_index": image_index,
-                    "image_type": image_type,
-                    "size_bytes": len(image_bytes),
-                    "path": image_output_path,
-                    "extraction_date": time.strftime("%Y-%m-%d %H:%M:%S")
-                }
+        if pack_writer is not None:
+            image_output_path = pack_writer.write(f"{unique_id}.{image_type.lower()}", image_bytes)
+            saved = True
+        else:
+            image_output_path = shard_path(output_folder, unique_id, image_type.lower(), create=True)
+            saved = save_image(image_bytes, image_output_path)
+        
+        if saved:
+            width, height = base_image.get("width"), base_image.get("height")
+            # Large images are hashed later by backfill_perceptual_hashes
+            too_large = (width or 0) * (height or 0) > HASH_MAX_PIXELS
+            record = {
+                "pdf_path": full_pdf_path,  # Store full path to PDF
+                "file_name": os.path.basename(doc.name),  # Keep filename too for display purposes
+                "page_number": pdf_page_num,
+                "image_index": image_index,
+                "image_type": image_type,
+                "size_bytes": len(image_bytes),
+                "width": width,
+                "height": height,
+                "phash": None if too_large else compute_phash(image_bytes),
+                "path": image_output_path,
+                "extraction_date": time.strftime("%Y-%m-%d %H:%M:%S")
             }
+            if extra_metadata:
+                record.update(extra_metadata)
+            return {unique_id: record}
         return None
     except Exception as e:
         print(f"Error processing image: {str(e)}")
         return None
 
 def process_pdf(args):
-    """Process a single PDF file to extract images."""
-    pdf_path, output_folder, size_limit, page_limit, lock = args
+    """
+    Process a single PDF file to extract images.
+
+    Without a results queue the records are returned together. With one,
+    each record is put on it as ("image", image_id, record) as soon as the
+    image is written, followed by ("done", pdf_path, None) for the PDF.
+    The text of a page is put on it once, as ("page", (pdf_path,
+    page_number), page_text), before the first image of the page. Once the
+    stop event is set, the PDF is given up after the image in hand.
+    """
+    pdf_path, output_folder, size_limit, page_limit, lock, extra_metadata, use_packs, results, stop = args
     
     metadata = {}
+    pack_writer = get_pack_writer(output_folder) if use_packs else None
     try:
         # Update progress information
         with lock:
             extraction_progress['current_file'] = pdf_path  # Store full path in progress
         
         doc = fitz.open(pdf_path)
-        if len(doc) > page_limit:
+        if len(doc) > page_limit or (stop is not None and stop.is_set()):
             doc.close()
+            if results is not None:
+                results.put(("done", pdf_path, None))
             return metadata
         
         # Get absolute path to ensure consistency
         full_pdf_path = os.path.abspath(pdf_path)
         
         for page_num, page in enumerate(doc, start=1):
+            if stop is not None and stop.is_set():
+                break
             image_list = page.get_images(full=True)
+            blocks = None
             for image_index, img in enumerate(image_list, start=1):
+                if stop is not None and stop.is_set():
+                    break
                 xref = img[0]
                 image_metadata = process_image(doc, xref, output_folder, page_num, image_index, 
-                                              size_limit, full_pdf_path)
+                                              size_limit, full_pdf_path, extra_metadata, pack_writer)
                 if image_metadata:
-                    metadata.update(image_metadata)
+                    # Page text is only read once a page has yielded an image
+                    if blocks is None:
+                        blocks = get_text_blocks(page)
+                        if results is not None:
+                            results.put(("page", (full_pdf_path, page_num), capture_page_text(blocks)))
+                    for record in image_metadata.values():
+                        record["caption"] = capture_caption(page, img, blocks)
                     with lock:
                         extraction_progress['extracted_images'] += 1
+                    if results is None:
+                        metadata.update(image_metadata)
+                        continue
+                    # A record is only handed on once its image can be read back
+                    if pack_writer is not None:
+                        pack_writer.flush()
+                    for image_id, record in image_metadata.items():
+                        results.put(("image", image_id, record))
         
         doc.close()
         
@@ -111,66 +198,586 @@ def process_pdf(args):
         print(f"Error processing {pdf_path}: {str(e)}")
         with lock:
             extraction_progress['processed_files'] += 1
+    
+    # Records are only returned for images that have reached the pack file
+    if pack_writer is not None:
+        pack_writer.flush()
+    if results is not None:
+        results.put(("done", pdf_path, None))
             
     return metadata
 
-def extract_images_from_directory(directory_path, output_folder, size_limit, page_limit):
-    """Extract images from all PDFs in a directory."""
-    if not os.path.exists(output_folder):
-        os.makedirs(output_folder)
-    
-    # Load existing metadata
-    metadata_file_path = "images_metadata.json"
-    existing_metadata = {}
+def load_metadata(metadata_file_path=METADATA_FILE_PATH):
+    """Load the image metadata store, or an empty dict if there is none."""
     if os.path.exists(metadata_file_path):
         try:
             with open(metadata_file_path, "r") as json_file:
-                existing_metadata = json.load(json_file)
+                return json.load(json_file)
         except Exception as e:
             print(f"Error loading metadata: {str(e)}")
-    
-    # Collect all PDF files recursively from directory and subdirectories
+    return {}
+
+def save_metadata(metadata, metadata_file_path=METADATA_FILE_PATH):
+    """Save the image metadata store."""
+    try:
+        # Written aside and renamed, so a reader never sees half a file
+        temporary_path = metadata_file_path + ".tmp"
+        with open(temporary_path, "w") as json_file:
+            json.dump(metadata, json_file, indent=4)
+        os.replace(temporary_path, metadata_file_path)
+    except Exception as e:
+        print(f"Error saving metadata: {str(e)}")
+
+def metadata_mtime(metadata_file_path=METADATA_FILE_PATH):
+    """Modification time of the metadata file, or None if there is none."""
+    return os.path.getmtime(metadata_file_path) if os.path.exists(metadata_file_path) else None
+
+@contextmanager
+def file_lock(lock_path, blocking=True, shared=False):
+    """
+    Hold a lock on lock_path for the duration of the block.
+
+    Without blocking, raises BlockingIOError at once if someone else holds
+    it. Shared locks only exclude exclusive ones, except on Windows, where
+    every lock is exclusive. The operating system drops the lock when its
+    holder exits, so a crash never leaves it stuck.
+    """
+    lock_file = open(lock_path, "a+b")
+    try:
+        if fcntl is not None:
+            mode = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+            fcntl.flock(lock_file.fileno(), mode | (0 if blocking else fcntl.LOCK_NB))
+        else:
+            lock_file.seek(0)
+            try:
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+            except OSError as e:
+                raise BlockingIOError(str(e))
+        try:
+            yield
+        finally:
+            if fcntl is None:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+    finally:
+        lock_file.close()
+
+@contextmanager
+def extraction_lock(compaction=False):
+    """
+    Held while an extraction or a pack compaction runs.
+
+    Compaction deletes packs without images in the metadata file, which is
+    what the packs of a running extraction look like until its records are
+    saved, so the two must never overlap. Extractions share the lock and
+    compaction takes it alone; whichever comes second raises RuntimeError.
+    """
+    with ExitStack() as stack:
+        try:
+            stack.enter_context(file_lock(EXTRACTION_LOCK_PATH, blocking=False, shared=not compaction))
+        except BlockingIOError:
+            if compaction:
+                raise RuntimeError("An extraction is running; compact the packs once it has finished") from None
+            raise RuntimeError("Pack compaction is running; extract again once it has finished") from None
+        yield
+
+def update_metadata(updates, metadata_file_path=METADATA_FILE_PATH, index=None, since=None,
+                    add_new=False, removed=()):
+    """
+    Merge changes into the metadata file as it is now and save it.
+
+    updates maps image_id -> {field: value}. Extraction and the background
+    passes run for a long time on a copy of the metadata loaded when they
+    started; saving that copy back would drop whatever another run saved
+    meanwhile, so only their own changes are written, into a fresh load of
+    the file. Records no longer in the file are left out unless add_new is
+    set, as it is for newly extracted images, and the ids in `removed` are
+    deleted.
+
+    With an index, it is marked as matching the saved file, or rebuilt if
+    the file changed since `since` (a metadata_mtime taken when the caller
+    last synced it) because someone else saved in between.
+
+    Returns the metadata as saved.
+    """
+    with file_lock(metadata_file_path + ".lock"):
+        changed = metadata_mtime(metadata_file_path) != since
+        metadata = load_metadata(metadata_file_path)
+        for image_id in removed:
+            metadata.pop(image_id, None)
+        for image_id, fields in updates.items():
+            if image_id in metadata:
+                metadata[image_id].update(fields)
+            elif add_new:
+                metadata[image_id] = dict(fields)
+        save_metadata(metadata, metadata_file_path)
+    if index is not None:
+        if changed:
+            index.rebuild(metadata)
+        index.mark_synced(metadata_file_path)
+    return metadata
+
+def save_extraction_stats(stats, stats_path=EXTRACTION_STATS_PATH):
+    """Save the size and duration of the last complete extraction."""
+    try:
+        with open(stats_path, "w") as stats_file:
+            json.dump(stats, stats_file, indent=4)
+    except Exception as e:
+        print(f"Error saving extraction stats: {str(e)}")
+
+def collect_pdf_paths(directory_path):
+    """Collect all PDF files recursively from a directory and its subdirectories."""
     pdf_paths = []
     for root, _, files in os.walk(directory_path):
         for file in files:
             if file.lower().endswith('.pdf'):
                 pdf_paths.append(os.path.join(root, file))
+    return pdf_paths
+
+def iter_extracted_images(pdf_sources, output_folder, size_limit, page_limit, existing_metadata=None,
+                          use_packs=False, batch_size=STREAM_BATCH_SIZE):
+    """
+    Extract images from a list of PDFs, yielding (image_id, record) as each image is written.
+
+    pdf_sources is a list of (pdf_path, extra_metadata) pairs; extra_metadata
+    (or None) is merged into the record of every image taken from that PDF.
+    With use_packs the images are appended to pack files instead of being
+    written one file each.
+
+    The index is updated in batches while images arrive, so a viewer can
+    show them before extraction ends; the new records are merged into the
+    metadata file once the stream is exhausted. Closing the generator early
+    stops the workers and keeps what was extracted so far. Raises
+    RuntimeError while pack compaction is running.
+    """
+    if not os.path.exists(output_folder):
+        os.makedirs(output_folder)
     
-    # Print summary of found files
-    print(f"Found {len(pdf_paths)} PDF files in {directory_path} and its subdirectories")
+    # Load existing metadata
+    if existing_metadata is None:
+        existing_metadata = load_metadata()
     
     # Reset progress tracking
     extraction_progress['processed_files'] = 0
-    extraction_progress['total_files'] = len(pdf_paths)
+    extraction_progress['total_files'] = len(pdf_sources)
     extraction_progress['current_file'] = ''
     extraction_progress['extracted_images'] = 0
+    start_time = time.time()
     
     # Create a manager for multiprocessing shared objects
     manager = Manager()
     lock = manager.Lock()
+    results = manager.Queue()
+    stop = manager.Event()
     
     # Configure multiprocessing
     num_processes = min(cpu_count(), 4)  # Limit max processes to avoid excessive resource usage
-    process_args = [(pdf_path, output_folder, size_limit, page_limit, lock) for pdf_path in pdf_paths]
+    process_args = [(pdf_path, output_folder, size_limit, page_limit, lock, extra_metadata, use_packs, results,
+                     stop)
+                    for pdf_path, extra_metadata in pdf_sources]
     
-    # Process PDFs in parallel
-    results = []
-    with Pool(num_processes) as pool:
-        results = pool.map(process_pdf, process_args)
+    extracted_metadata = {}
+    batch = {}
+    page_entries = []
+    text_entries = []
+    with extraction_lock(), ImageIndex() as index:
+        index.sync_from_metadata(METADATA_FILE_PATH, existing_metadata)
+        synced_mtime = metadata_mtime()
+        # Until the metadata file is saved the index runs ahead of it; if the
+        # stream dies before then, the next sync rebuilds the index from the file.
+        index.mark_unsynced()
+        
+        def flush_batch():
+            index.add_records(batch)
+            index.add_page_text(page_entries)
+            index.add_text(text_entries)
+            batch.clear()
+            page_entries.clear()
+            text_entries.clear()
+        
+        def receive(kind, key, record):
+            if kind == "done":
+                extraction_progress['processed_files'] += 1
+                extraction_progress['current_file'] = key
+            elif kind == "page":
+                # Page text goes to the full-text index only, not the JSON
+                page_entries.append((*key, record))
+            elif kind == "image":
+                text_entries.append((key, record.get("caption", ""), record["pdf_path"], record["page_number"]))
+                batch[key] = record
+                extracted_metadata[key] = record
+                extraction_progress['extracted_images'] += 1
+        
+        try:
+            with Pool(num_processes) as pool:
+                pending = pool.map_async(process_pdf, process_args)
+                try:
+                    last_flush = time.time()
+                    while extraction_progress['processed_files'] < len(process_args):
+                        try:
+                            kind, key, record = results.get(timeout=STREAM_FLUSH_INTERVAL)
+                        except queue.Empty:
+                            # A worker that died takes its "done" message with it
+                            if pending.ready() and results.empty():
+                                break
+                            kind = None
+                        receive(kind, key, record)
+                        
+                        if len(batch) >= batch_size or (batch and time.time() - last_flush >= STREAM_FLUSH_INTERVAL):
+                            flush_batch()
+                            last_flush = time.time()
+                        if kind == "image":
+                            yield key, record
+                finally:
+                    # Killing the workers could leave an image written but not
+                    # recorded, so they are asked to stop after the one in hand
+                    stop.set()
+                    pending.wait(STOP_TIMEOUT)
+        finally:
+            # Records of images written after the stream stopped reading
+            while True:
+                try:
+                    receive(*results.get_nowait())
+                except queue.Empty:
+                    break
+            flush_batch()
+            update_metadata(extracted_metadata, index=index, since=synced_mtime, add_new=True)
+            
+            # Complete runs calibrate the time estimates of extraction_plan
+            if process_args and extraction_progress['processed_files'] == len(process_args):
+                save_extraction_stats({
+                    "pdfs": len(process_args),
+                    "images": len(extracted_metadata),
+                    "bytes": sum(record.get("size_bytes", 0) for record in extracted_metadata.values()),
+                    "seconds": time.time() - start_time,
+                    "processes": num_processes,
+                })
+
+def extract_images_from_pdfs(pdf_sources, output_folder, size_limit, page_limit, existing_metadata=None,
+                             use_packs=False):
+    """Extract images from a list of PDFs; see iter_extracted_images."""
+    for _ in iter_extracted_images(pdf_sources, output_folder, size_limit, page_limit, existing_metadata,
+                                   use_packs):
+        pass
+    return extraction_progress['extracted_images']
+
+def iter_images_from_directory(directory_path, output_folder, size_limit, page_limit, use_packs=False):
+    """Extract images from all PDFs in a directory, yielding (image_id, record) as they are written."""
+    pdf_paths = collect_pdf_paths(directory_path)
     
-    # Merge results
-    new_metadata = existing_metadata.copy()
-    for result in results:
-        new_metadata.update(result)
+    # Print summary of found files
+    print(f"Found {len(pdf_paths)} PDF files in {directory_path} and its subdirectories")
     
-    # Save updated metadata
+    yield from iter_extracted_images([(pdf_path, None) for pdf_path in pdf_paths],
+                                     output_folder, size_limit, page_limit, use_packs=use_packs)
+
+def extract_images_from_directory(directory_path, output_folder, size_limit, page_limit, use_packs=False):
+    """Extract images from all PDFs in a directory."""
+    for _ in iter_images_from_directory(directory_path, output_folder, size_limit, page_limit, use_packs):
+        pass
+    return extraction_progress['extracted_images']
+
+def iter_images_from_zotero(zotero_dir, output_folder, size_limit, page_limit,
+                            state_path=SYNC_STATE_PATH, base_dir=None, use_packs=False):
+    """
+    Extract images from the PDF attachments of a Zotero library, yielding
+    (image_id, record) as they are written.
+
+    The attachment list is read from a copy of zotero.sqlite instead of walking
+    the storage folder, and only attachments modified since the previous run
+    are processed. Images of a re-processed attachment replace its old ones.
+    Attachments whose file has not been synced yet are retried on later runs.
+    The sync state only advances once the stream has been read to the end.
+    """
+    state = load_sync_state(state_path)
+    attachments, state_entry = collect_zotero_attachments(zotero_dir, state, base_dir)
+    
+    pdf_sources = []
+    for attachment in attachments:
+        pdf_sources.append((attachment["pdf_path"], {
+            "zotero_item_key": attachment["item_key"],
+            "zotero_attachment_key": attachment["attachment_key"],
+            "zotero_title": attachment["title"],
+        }))
+    
+    print(f"Found {len(pdf_sources)} new or modified PDF attachments in {zotero_dir}")
+    
+    # Drop the images of attachments that are about to be extracted again
+    existing_metadata = load_metadata()
+    changed_keys = {extra["zotero_attachment_key"] for _, extra in pdf_sources}
+    stale_ids = []
+    for image_id, record in list(existing_metadata.items()):
+        if record.get("zotero_attachment_key") in changed_keys:
+            remove_image(record.get("path", ""))
+            del existing_metadata[image_id]
+            stale_ids.append(image_id)
+    if stale_ids:
+        with ImageIndex() as index:
+            index.sync_from_metadata(METADATA_FILE_PATH)
+            synced_mtime = metadata_mtime()
+            index.remove_records(stale_ids)
+            update_metadata({}, index=index, since=synced_mtime, removed=stale_ids)
+    
+    yield from iter_extracted_images(pdf_sources, output_folder, size_limit, page_limit,
+                                     existing_metadata, use_packs)
+    
+    state[os.path.abspath(zotero_dir)] = state_entry
+    save_sync_state(state, state_path)
+
+def extract_images_from_zotero(zotero_dir, output_folder, size_limit, page_limit,
+                               state_path=SYNC_STATE_PATH, base_dir=None, use_packs=False):
+    """Extract images from the PDF attachments of a Zotero library; see iter_images_from_zotero."""
+    for _ in iter_images_from_zotero(zotero_dir, output_folder, size_limit, page_limit, state_path,
+                                     base_dir, use_packs):
+        pass
+    return extraction_progress['extracted_images']
+
+async def iterate_in_thread(stream):
+    """
+    Drive a blocking stream such as iter_images_from_directory on a worker
+    thread and yield its items to an asyncio event loop.
+
+    Leaving the async loop early closes the stream as soon as it produces
+    its next item.
+    """
+    loop = asyncio.get_running_loop()
+    items = asyncio.Queue()
+    stop = threading.Event()
+    end = object()
+    
+    def post(item):
+        if stop.is_set():
+            return
+        try:
+            loop.call_soon_threadsafe(items.put_nowait, item)
+        except RuntimeError:
+            pass  # the event loop has already been closed
+    
+    def produce():
+        try:
+            for item in stream:
+                if stop.is_set():
+                    break
+                post(item)
+            post(end)
+        except Exception as e:
+            post(e)
+        finally:
+            stream.close()
+    
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item = await items.get()
+            if item is end:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+def aiter_images_from_directory(directory_path, output_folder, size_limit, page_limit, use_packs=False):
+    """Async counterpart of iter_images_from_directory."""
+    return iterate_in_thread(iter_images_from_directory(directory_path, output_folder, size_limit,
+                                                        page_limit, use_packs))
+
+def aiter_images_from_zotero(zotero_dir, output_folder, size_limit, page_limit,
+                             state_path=SYNC_STATE_PATH, base_dir=None, use_packs=False):
+    """Async counterpart of iter_images_from_zotero."""
+    return iterate_in_thread(iter_images_from_zotero(zotero_dir, output_folder, size_limit, page_limit,
+                                                     state_path, base_dir, use_packs))
+
+def capture_pdf_context(args):
+    """
+    Capture captions and page text for already-extracted images of one PDF.
+
+    Returns (pdf_path, {image_id: caption}, {page_number: page_text}).
+    """
+    pdf_path, images = args
+    
+    captions = {}
+    page_texts = {}
+    try:
+        doc = fitz.open(pdf_path)
+        images_by_page = {}
+        for image_id, page_number, image_index in images:
+            images_by_page.setdefault(page_number, []).append((image_id, image_index))
+        
+        for page_number, page_images in images_by_page.items():
+            if not 1 <= page_number <= len(doc):
+                continue
+            page = doc[page_number - 1]
+            image_list = page.get_images(full=True)
+            blocks = get_text_blocks(page)
+            page_texts[page_number] = capture_page_text(blocks)
+            for image_id, image_index in page_images:
+                # image_index is the 1-based position in get_images, as in process_pdf
+                if 1 <= image_index <= len(image_list):
+                    captions[image_id] = capture_caption(page, image_list[image_index - 1], blocks)
+        
+        doc.close()
+    except Exception as e:
+        print(f"Error capturing text from {pdf_path}: {str(e)}")
+    
+    return pdf_path, captions, page_texts
+
+def backfill_page_context(metadata_file_path=METADATA_FILE_PATH, batch_size=500):
+    """
+    Capture captions and page text for images extracted before text capture existed.
+
+    Images that already have text indexed are skipped, and results are
+    committed as each PDF finishes, so an interrupted run can simply be
+    started again. Returns the number of images given text.
+    """
+    metadata = load_metadata(metadata_file_path)
+    
+    with ImageIndex() as index:
+        index.sync_from_metadata(metadata_file_path, metadata)
+        synced_mtime = metadata_mtime(metadata_file_path)
+        done_ids = index.text_image_ids()
+        
+        images_by_pdf = {}
+        for image_id, record in metadata.items():
+            if image_id in done_ids or "page_number" not in record or "image_index" not in record:
+                continue
+            images_by_pdf.setdefault(record.get("pdf_path", ""), []).append(
+                (image_id, record["page_number"], record["image_index"]))
+        
+        print(f"Capturing text for {sum(map(len, images_by_pdf.values()))} images "
+              f"from {len(images_by_pdf)} PDF files")
+        
+        captured = 0
+        pending_pages = []
+        pending = []
+        captions = {}
+        num_processes = min(cpu_count(), 4)
+        with Pool(num_processes) as pool:
+            for pdf_path, pdf_captions, page_texts in pool.imap_unordered(capture_pdf_context,
+                                                                         images_by_pdf.items()):
+                pending_pages.extend((pdf_path, page_number, page_text)
+                                     for page_number, page_text in page_texts.items())
+                for image_id, caption in pdf_captions.items():
+                    captions[image_id] = {"caption": caption}
+                    pending.append((image_id, caption, pdf_path, metadata[image_id]["page_number"]))
+                if len(pending) >= batch_size:
+                    index.add_page_text(pending_pages)
+                    index.add_text(pending)
+                    captured += len(pending)
+                    pending_pages = []
+                    pending = []
+        index.add_page_text(pending_pages)
+        index.add_text(pending)
+        captured += len(pending)
+        
+        # Captions are also shown in the viewer's metadata panel
+        update_metadata(captions, metadata_file_path, index, synced_mtime)
+    
+    return captured
+
+def hash_image_file(args):
+    """
+    Compute the perceptual hash of one extracted image.
+
+    source is (pdf_path, page_number, image_index) for images to hash from
+    their PDF, or None; the extracted file is used when that fails.
+    """
+    image_id, image_path, source = args
+    if source is not None:
+        phash = compute_phash_from_pdf(*source)
+        if phash:
+            return image_id, phash
+    image_bytes = read_image_bytes(image_path)
+    if image_bytes is None:
+        return image_id, None
+    return image_id, compute_phash(image_bytes)
+
+def backfill_perceptual_hashes(metadata_file_path=METADATA_FILE_PATH, batch_size=1000):
+    """
+    Compute perceptual hashes for images extracted before hashing existed,
+    or too large to hash during extraction.
+
+    Hashes are written to the index as they come in and merged into the
+    metadata file at the end; images that already have a hash are skipped,
+    so the pass can be re-run after an interruption. Images above
+    HASH_MAX_PIXELS go to a single worker of their own, so only one of them
+    is decoded at a time, and are rendered from their source PDF when it is
+    still there. Returns the number of images hashed.
+    """
+    metadata = load_metadata(metadata_file_path)
+    small, large = [], []
+    for image_id, record in metadata.items():
+        # Paths may still point at the flat folder while a migration runs
+        image_path = resolve_image_path(record.get("path", ""))
+        if not record.get("phash") and image_exists(image_path):
+            pixels = (record.get("width") or 0) * (record.get("height") or 0)
+            if pixels <= HASH_MAX_PIXELS:
+                small.append((image_id, image_path, None))
+            elif os.path.exists(record.get("pdf_path", "")) and record.get("image_index"):
+                large.append((image_id, image_path, (record["pdf_path"], record["page_number"], record["image_index"])))
+            else:
+                large.append((image_id, image_path, None))
+    print(f"Hashing {len(small) + len(large)} images")
+    
+    hashed = 0
+    hashes = {}
+    pending = {}
+    with ImageIndex() as index:
+        index.sync_from_metadata(metadata_file_path, metadata)
+        synced_mtime = metadata_mtime(metadata_file_path)
+        num_processes = min(cpu_count(), 4)
+        with Pool(num_processes) as pool, Pool(1) as large_pool:
+            results = chain(pool.imap_unordered(hash_image_file, small, chunksize=64),
+                            large_pool.imap_unordered(hash_image_file, large))
+            for image_id, phash in results:
+                if phash:
+                    metadata[image_id]["phash"] = phash
+                    hashes[image_id] = {"phash": phash}
+                    pending[image_id] = metadata[image_id]
+                if len(pending) >= batch_size:
+                    index.add_records(pending)
+                    hashed += len(pending)
+                    pending = {}
+        index.add_records(pending)
+        hashed += len(pending)
+        
+        update_metadata(hashes, metadata_file_path, index, synced_mtime)
+    
+    return hashed
+
+def write_near_duplicate_report(report_path=NEAR_DUPLICATE_REPORT_PATH, max_distance=DUPLICATE_MAX_DISTANCE,
+                                metadata_file_path=METADATA_FILE_PATH):
+    """
+    Group near-duplicate images by perceptual hash and write them to a JSON report.
+
+    Returns the number of groups found.
+    """
+    metadata = load_metadata(metadata_file_path)
+    with ImageIndex() as index:
+        index.sync_from_metadata(metadata_file_path, metadata)
+        groups = group_near_duplicates(index.all_hashes(), max_distance)
+    
+    report = {
+        "max_distance": max_distance,
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "groups": [
+            [{
+                "image_id": image_id,
+                "path": metadata.get(image_id, {}).get("path"),
+                "pdf_path": metadata.get(image_id, {}).get("pdf_path"),
+                "page_number": metadata.get(image_id, {}).get("page_number"),
+                "phash": metadata.get(image_id, {}).get("phash"),
+            } for image_id in group]
+            for group in groups
+        ],
+    }
     try:
-        with open(metadata_file_path, "w") as json_file:
-            json.dump(new_metadata, json_file, indent=4)
+        with open(report_path, "w") as report_file:
+            json.dump(report, report_file, indent=4)
     except Exception as e:
-        print(f"Error saving metadata: {str(e)}")
+        print(f"Error saving near-duplicate report: {str(e)}")
     
-    return extraction_progress['extracted_images']
+    return len(groups)
 
 def get_extraction_progress():
     """Get current extraction progress information."""
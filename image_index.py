@@ -0,0 +1,591 @@
+import os
+import re
+import sqlite3
+from perceptual_hash import CHUNKS, hash_chunks, chunk_neighbors, hamming_distance, SIMILAR_MAX_DISTANCE
+
+# The JSON metadata file stays the canonical store; this SQLite index mirrors
+# it so the viewer can filter, sort and page without scanning every record.
+INDEX_PATH = "images_index.sqlite"
+
+# Display name -> indexed column, in the order shown in the viewer
+SORT_COLUMNS = {
+    "Extraction Date": "extraction_date",
+    "Source PDF": "file_name",
+    "Page": "page_number",
+    "Image Type": "image_type",
+    "Size": "size_bytes",
+    "Width": "width",
+    "Height": "height",
+}
+
+# Columns the filter bar can restrict on or sort by. Every index carries all of
+# them so that filtering, counting and paging never have to touch the table.
+INDEXED_COLUMNS = ["pdf_id", "image_type", "page_number", "size_bytes", "width", "height",
+                   "extraction_date", "file_name"]
+
+# Probing a filter's index for its number of matches stops here; past it the
+# filter is no help in picking an index.
+PROBE_LIMIT = 20000
+
+# A walk along the sort index is expected to meet a page of matches every
+# limit / share rows. If the first this many times that hold fewer, the
+# matches are bunched along the sort order and the walk is kept to the range
+# they span.
+WALK_PROBE_FACTOR = 4
+
+# Collecting and sorting the matches costs about this many rows of a walk per match
+COLLECT_COST = 3
+
+# Counting stops here; beyond it the viewer only needs to know "many".
+COUNT_LIMIT = 100000
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS pdfs (
+        pdf_id INTEGER PRIMARY KEY,
+        pdf_path TEXT UNIQUE NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS images (
+        image_id TEXT PRIMARY KEY,
+        path TEXT NOT NULL,
+        pdf_id INTEGER REFERENCES pdfs(pdf_id),
+        file_name TEXT,
+        page_number INTEGER,
+        image_index INTEGER,
+        image_type TEXT,
+        size_bytes INTEGER,
+        width INTEGER,
+        height INTEGER,
+        extraction_date TEXT
+    );
+    CREATE TABLE IF NOT EXISTS index_state (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    );
+    CREATE TABLE IF NOT EXISTS image_hashes (
+        image_id TEXT PRIMARY KEY,
+        phash TEXT NOT NULL,
+        chunk0 INTEGER,
+        chunk1 INTEGER,
+        chunk2 INTEGER,
+        chunk3 INTEGER
+    );
+    CREATE INDEX IF NOT EXISTS idx_hash_chunk0 ON image_hashes(chunk0);
+    CREATE INDEX IF NOT EXISTS idx_hash_chunk1 ON image_hashes(chunk1);
+    CREATE INDEX IF NOT EXISTS idx_hash_chunk2 ON image_hashes(chunk2);
+    CREATE INDEX IF NOT EXISTS idx_hash_chunk3 ON image_hashes(chunk3);
+    -- Captions and page text are not kept in the JSON metadata, so unlike the
+    -- tables above these are never rebuilt from it. The text of a page is
+    -- stored once and shared by all the images on it.
+    CREATE TABLE IF NOT EXISTS page_docs (
+        page_id INTEGER PRIMARY KEY,
+        pdf_path TEXT NOT NULL,
+        page_number INTEGER NOT NULL,
+        UNIQUE (pdf_path, page_number)
+    );
+    CREATE VIRTUAL TABLE IF NOT EXISTS page_texts USING fts5(
+        page_text, tokenize = 'unicode61 remove_diacritics 2'
+    );
+    CREATE TABLE IF NOT EXISTS text_docs (
+        doc_id INTEGER PRIMARY KEY,
+        image_id TEXT UNIQUE NOT NULL,
+        page_id INTEGER
+    );
+    CREATE INDEX IF NOT EXISTS idx_text_docs_page ON text_docs(page_id);
+    CREATE VIRTUAL TABLE IF NOT EXISTS image_text USING fts5(
+        caption, tokenize = 'unicode61 remove_diacritics 2'
+    );
+"""
+
+# bm25 weights of caption and page text matches: a caption hit counts far
+# more than the same words somewhere else on the page.
+CAPTION_WEIGHT = 10.0
+PAGE_TEXT_WEIGHT = 1.0
+
+def _covering_index(name, leading_column):
+    columns = [leading_column] + [c for c in INDEXED_COLUMNS if c != leading_column]
+    return f"CREATE INDEX IF NOT EXISTS {name} ON images({', '.join(columns)})"
+
+INDEXES = [_covering_index("idx_images_pdf", "pdf_id")] + [
+    _covering_index(f"idx_sort_{column}", column) for column in SORT_COLUMNS.values()]
+
+def _end_of_day(date_text):
+    # Dates are stored as "YYYY-MM-DD HH:MM:SS", so an upper bound given as a
+    # bare day must include everything that happened during that day.
+    date_text = date_text.strip()
+    if len(date_text) == 10:
+        return date_text + " 23:59:59"
+    return date_text
+
+# Filter key -> (SQL condition, how to convert the user value)
+RANGE_FILTERS = {
+    "page_min": ("page_number >= ?", int),
+    "page_max": ("page_number <= ?", int),
+    "size_min": ("size_bytes >= ?", int),
+    "size_max": ("size_bytes <= ?", int),
+    "width_min": ("width >= ?", int),
+    "width_max": ("width <= ?", int),
+    "height_min": ("height >= ?", int),
+    "height_max": ("height <= ?", int),
+    "date_from": ("extraction_date >= ?", str),
+    "date_to": ("extraction_date <= ?", _end_of_day),
+}
+
+def fts_query(text):
+    """Turn free text into an FTS5 query; the last word matches as a prefix."""
+    words = re.findall(r"\w+", text)
+    if not words:
+        return None
+    return " ".join(f'"{word}"' for word in words) + "*"
+
+def _escape_like(text):
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+class ImageIndex:
+    """SQLite index over the image metadata used for filtering, sorting and paging."""
+    def __init__(self, index_path=INDEX_PATH):
+        self.index_path = index_path
+        self.conn = sqlite3.connect(index_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self.conn.execute("CREATE TEMP TABLE pdf_filter (pdf_id INTEGER PRIMARY KEY)")
+        self._create_indexes()
+        self._pdf_filter_cache = None
+        self._plan_cache = None
+        self._row_count = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def _create_indexes(self):
+        with self.conn:
+            for statement in INDEXES:
+                self.conn.execute(statement)
+
+    def _drop_indexes(self):
+        with self.conn:
+            for (name,) in self.conn.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'images' "
+                    "AND sql IS NOT NULL").fetchall():
+                self.conn.execute(f"DROP INDEX {name}")
+
+    def _pdf_ids(self, pdf_paths):
+        pdf_ids = {}
+        for pdf_path in pdf_paths:
+            if pdf_path not in pdf_ids:
+                self.conn.execute("INSERT OR IGNORE INTO pdfs(pdf_path) VALUES (?)", (pdf_path,))
+                pdf_ids[pdf_path] = self.conn.execute(
+                    "SELECT pdf_id FROM pdfs WHERE pdf_path = ?", (pdf_path,)).fetchone()[0]
+        return pdf_ids
+
+    def add_records(self, metadata):
+        """Insert or replace the given {image_id: record} entries."""
+        self._pdf_filter_cache = None
+        self._plan_cache = None
+        self._row_count = None
+        with self.conn:
+            pdf_ids = self._pdf_ids(record.get("pdf_path", "") for record in metadata.values())
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                ((image_id,
+                  record.get("path", ""),
+                  pdf_ids[record.get("pdf_path", "")],
+                  record.get("file_name"),
+                  record.get("page_number"),
+                  record.get("image_index"),
+                  record.get("image_type"),
+                  record.get("size_bytes"),
+                  record.get("width"),
+                  record.get("height"),
+                  record.get("extraction_date"))
+                 for image_id, record in metadata.items()))
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO image_hashes VALUES (?, ?, ?, ?, ?, ?)",
+                ((image_id, record["phash"], *hash_chunks(record["phash"]))
+                 for image_id, record in metadata.items() if record.get("phash")))
+
+    def remove_records(self, image_ids):
+        """Remove the given image ids from the index."""
+        self._pdf_filter_cache = None
+        self._plan_cache = None
+        self._row_count = None
+        image_ids = list(image_ids)
+        with self.conn:
+            self.conn.executemany("DELETE FROM images WHERE image_id = ?",
+                                  ((image_id,) for image_id in image_ids))
+            self.conn.executemany("DELETE FROM image_hashes WHERE image_id = ?",
+                                  ((image_id,) for image_id in image_ids))
+        self.remove_text(image_ids)
+
+    def update_paths(self, paths):
+        """Update the file paths of (image_id, path) pairs."""
+        with self.conn:
+            self.conn.executemany("UPDATE images SET path = ? WHERE image_id = ?",
+                                  ((path, image_id) for image_id, path in paths))
+
+    def rebuild(self, metadata):
+        """Replace the whole index with the given metadata."""
+        # Bulk loading is much faster without the indexes in place
+        self._drop_indexes()
+        with self.conn:
+            self.conn.execute("DELETE FROM images")
+            self.conn.execute("DELETE FROM pdfs")
+            self.conn.execute("DELETE FROM image_hashes")
+        self.add_records(metadata)
+        self._create_indexes()
+        self.conn.execute("ANALYZE")
+
+    def mark_synced(self, metadata_file_path):
+        """Record that the index matches the current metadata file."""
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO index_state VALUES ('metadata_mtime', ?)",
+                              (str(os.path.getmtime(metadata_file_path)),))
+
+    def mark_unsynced(self):
+        """Make the next sync_from_metadata rebuild the index whatever the metadata file says."""
+        with self.conn:
+            self.conn.execute("DELETE FROM index_state WHERE key = 'metadata_mtime'")
+
+    def clear_caches(self):
+        """Forget cached query plans, e.g. after another connection added images."""
+        self._pdf_filter_cache = None
+        self._plan_cache = None
+        self._row_count = None
+
+    def sync_from_metadata(self, metadata_file_path, metadata=None):
+        """Rebuild the index if the metadata file changed since it was last synced."""
+        if not os.path.exists(metadata_file_path):
+            return False
+        row = self.conn.execute(
+            "SELECT value FROM index_state WHERE key = 'metadata_mtime'").fetchone()
+        if row and row[0] == str(os.path.getmtime(metadata_file_path)):
+            return False
+
+        if metadata is None:
+            from image_extraction import load_metadata
+            metadata = load_metadata(metadata_file_path)
+        self.rebuild(metadata)
+        self.mark_synced(metadata_file_path)
+        return True
+
+    def _pdf_clause(self, text):
+        # Resolve the substring against the much smaller PDF table first and
+        # keep the matching ids in a temp table, which the images indexes are
+        # probed with; a literal IN list of thousands of ids had to be parsed
+        # on every query and checked against every index row. The viewer asks
+        # for the count and then the page, so the last answer is kept, and
+        # while the user types on, the substring only grows, so the previous
+        # matches are narrowed rather than every PDF path scanned again.
+        previous = self._pdf_filter_cache
+        if previous and previous[0] == text:
+            return previous[1]
+        pattern = f"%{_escape_like(text)}%"
+        clause = "pdf_id IN temp.pdf_filter"
+        if previous and previous[1] and previous[0] in text:
+            with self.conn:
+                self.conn.execute(
+                    "DELETE FROM temp.pdf_filter WHERE pdf_id IN (SELECT pdf_id FROM pdfs "
+                    "WHERE pdf_id IN temp.pdf_filter AND pdf_path NOT LIKE ? ESCAPE '\\')", (pattern,))
+        else:
+            # Short substrings tend to match every PDF, which needs no clause.
+            # Looking for one PDF that does not match stops at once when there
+            # is one, and saves filling the table with every id when there is not.
+            if self.conn.execute("SELECT 1 FROM pdfs WHERE pdf_path NOT LIKE ? ESCAPE '\\' LIMIT 1",
+                                 (pattern,)).fetchone():
+                with self.conn:
+                    self.conn.execute("DELETE FROM temp.pdf_filter")
+                    self.conn.execute("INSERT INTO temp.pdf_filter SELECT pdf_id FROM pdfs "
+                                      "WHERE pdf_path LIKE ? ESCAPE '\\'", (pattern,))
+            else:
+                clause = None
+        self._pdf_filter_cache = (text, clause)
+        return clause
+
+    def _conditions(self, filters):
+        # Returns (column, clause, params) for every active filter
+        conditions = []
+        for key, value in (filters or {}).items():
+            if value in (None, ""):
+                continue
+            if key == "pdf":
+                clause = self._pdf_clause(value)
+                if clause:
+                    conditions.append(("pdf_id", clause, []))
+            elif key == "image_type":
+                conditions.append(("image_type", "image_type = ?", [value]))
+            elif key in RANGE_FILTERS:
+                clause, convert = RANGE_FILTERS[key]
+                conditions.append((clause.split()[0], clause, [convert(value)]))
+        return conditions
+
+    def _plan(self, filters):
+        """
+        Build the WHERE clause for the filters and pick the index to scan.
+
+        Without range statistics SQLite guesses poorly which filter is the most
+        selective, so each filtered column's own index is probed with a capped
+        count and the smallest one wins.
+        """
+        key = tuple(sorted((filters or {}).items()))
+        if self._plan_cache and self._plan_cache[0] == key:
+            return self._plan_cache[1]
+
+        conditions = self._conditions(filters)
+        where = "WHERE " + " AND ".join(c[1] for c in conditions) if conditions else ""
+        params = [p for c in conditions for p in c[2]]
+
+        best_index, best_count = None, PROBE_LIMIT + 1
+        columns = {}
+        for column, clause, clause_params in conditions:
+            entry = columns.setdefault(column, ([], []))
+            entry[0].append(clause)
+            entry[1].extend(clause_params)
+        for column, (clauses, clause_params) in columns.items():
+            index = "idx_images_pdf" if column == "pdf_id" else f"idx_sort_{column}"
+            matches = self.conn.execute(
+                f"SELECT COUNT(*) FROM (SELECT 1 FROM images INDEXED BY {index} "
+                f"WHERE {' AND '.join(clauses)} LIMIT ?)", clause_params + [best_count]).fetchone()[0]
+            if matches < best_count:
+                best_index, best_count = index, matches
+
+        plan = (where, params, best_index)
+        # The sort value ranges of the matches are kept along with the plan
+        self._plan_cache = (key, plan, conditions, {})
+        return plan
+
+    def _images_count(self):
+        if self._row_count is None:
+            self._row_count = self.conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+        return self._row_count
+
+    def _walk_conditions(self, sort_column):
+        # Returns the filters on the sort column, which the walk seeks to,
+        # and the others, checked row by row. With many rows per sort value
+        # SQLite would rather skip-scan the index and seek every PDF of the
+        # filter under each value, which is far slower unless the matches
+        # are bunched.
+        conditions = self._plan_cache[2]
+        seek = [(clause, params) for column, clause, params in conditions if column == sort_column]
+        check = [(f"+{clause}", params) for column, clause, params in conditions if column != sort_column]
+        return seek, check
+
+    def _walk_reaches(self, seek, check, sort_column, order, wanted, budget):
+        # Whether the first `budget` rows the walk reads hold `wanted` matches
+        seek_where = "WHERE " + " AND ".join(clause for clause, _ in seek) if seek else ""
+        check_where = "WHERE " + " AND ".join(clause for clause, _ in check) if check else ""
+        found = self.conn.execute(
+            f"SELECT COUNT(*) FROM (SELECT {', '.join(INDEXED_COLUMNS)} FROM images "
+            f"INDEXED BY idx_sort_{sort_column} {seek_where} ORDER BY {sort_column} {order} LIMIT ?) "
+            f"{check_where}",
+            [p for _, params in seek for p in params] + [budget] +
+            [p for _, params in check for p in params]).fetchone()[0]
+        return found >= wanted
+
+    def _sort_range(self, where, params, best_index, sort_column):
+        # Returns the (lowest, highest) sort value among the matches, or None
+        # if some match has no value, which a range would leave out
+        ranges = self._plan_cache[3]
+        if sort_column not in ranges:
+            source = f"images INDEXED BY {best_index}" if best_index else "images"
+            low, high, missing = self.conn.execute(
+                f"SELECT MIN({sort_column}), MAX({sort_column}), COUNT(*) - COUNT({sort_column}) "
+                f"FROM {source} {where}", params).fetchone()
+            ranges[sort_column] = (low, high) if not missing and low is not None else None
+        return ranges[sort_column]
+
+    def count(self, filters=None, limit=None):
+        """Count the images matching the filters, stopping at `limit` if given."""
+        where, params, best_index = self._plan(filters)
+        source = f"images INDEXED BY {best_index}" if best_index else "images"
+        if limit is None:
+            return self.conn.execute(f"SELECT COUNT(*) FROM {source} {where}", params).fetchone()[0]
+        return self.conn.execute(f"SELECT COUNT(*) FROM (SELECT 1 FROM {source} {where} LIMIT ?)",
+                                 params + [limit]).fetchone()[0]
+
+    def query(self, filters=None, sort_column="extraction_date", descending=False, offset=0, limit=40,
+              total=None):
+        """
+        Return (image_id, path) pairs of one page of images matching the filters.
+
+        `total` is the result of count() for the same filters, if the caller
+        already has it; it decides how the page is read from the index.
+        """
+        if sort_column not in SORT_COLUMNS.values():
+            raise ValueError(f"Cannot sort on {sort_column}")
+        where, params, best_index = self._plan(filters)
+        if total is None:
+            total = self.count(filters, COUNT_LIMIT)
+        if total == 0:
+            return []
+
+        # Only rowids are read while filtering, so the scan stops at the
+        # covering indexes; the paths are looked up for the final page alone.
+        # Walking the sort index reads about (offset + limit) / share rows if
+        # the matches are spread evenly over it, while letting SQLite collect
+        # the matches from the most selective index and sort them reads each
+        # match once, at COLLECT_COST. The cheaper of the two is used.
+        order = "DESC" if descending else "ASC"
+        share = total / max(self._images_count(), 1)
+        walk_rows = (offset + limit) / share
+        if not where or walk_rows <= total * COLLECT_COST:
+            source, order_by = f"images INDEXED BY idx_sort_{sort_column}", sort_column
+            seek, check = self._walk_conditions(sort_column)
+            # Matches are often bunched along the sort order, e.g. a PDF
+            # filter sorted by Source PDF, or by a column with few values,
+            # under which rows follow the PDF order. A short probe of the walk
+            # tells; SQLite may then seek in the sort index for the filters,
+            # and the walk is kept to the range the matches span.
+            if not where or self._walk_reaches(seek, check, sort_column, order, limit,
+                                               int(limit / share * WALK_PROBE_FACTOR)):
+                conditions = seek + check
+                where = "WHERE " + " AND ".join(clause for clause, _ in conditions) if conditions else ""
+                params = [p for _, clause_params in conditions for p in clause_params]
+            else:
+                bounds = self._sort_range(where, params, best_index, sort_column)
+                if bounds:
+                    where += f" AND {sort_column} BETWEEN ? AND ?"
+                    params = params + list(bounds)
+        else:
+            source = f"images INDEXED BY {best_index}" if best_index else "images"
+            order_by = f"+{sort_column}"
+        # Ties are broken in the order of the sort index, so that pages read
+        # in different ways still line up
+        tie_break = [column for column in INDEXED_COLUMNS if column != sort_column] + ["rowid"]
+        order_by = ", ".join(f"{column} {order}" for column in [order_by] + tie_break)
+        rowids = [row[0] for row in self.conn.execute(
+            f"SELECT rowid FROM {source} {where} ORDER BY {order_by} LIMIT ? OFFSET ?",
+            params + [limit, offset])]
+        if not rowids:
+            return []
+        rows = {rowid: (image_id, path) for rowid, image_id, path in self.conn.execute(
+            f"SELECT rowid, image_id, path FROM images WHERE rowid IN ({', '.join(map(str, rowids))})")}
+        return [rows[rowid] for rowid in rowids if rowid in rows]
+
+    def iter_matching(self, filters=None):
+        """Yield (image_id, path) for every image matching the filters, in no particular order."""
+        where, params, best_index = self._plan(filters)
+        source = f"images INDEXED BY {best_index}" if best_index else "images"
+        yield from self.conn.execute(f"SELECT image_id, path FROM {source} {where}", params)
+
+    def _page_id(self, pdf_path, page_number):
+        self.conn.execute("INSERT OR IGNORE INTO page_docs(pdf_path, page_number) VALUES (?, ?)",
+                          (pdf_path, page_number))
+        return self.conn.execute("SELECT page_id FROM page_docs WHERE pdf_path = ? AND page_number = ?",
+                                 (pdf_path, page_number)).fetchone()[0]
+
+    def add_page_text(self, entries):
+        """Insert or replace (pdf_path, page_number, page_text) entries in the full-text index."""
+        with self.conn:
+            for pdf_path, page_number, page_text in entries:
+                page_id = self._page_id(pdf_path, page_number)
+                self.conn.execute("DELETE FROM page_texts WHERE rowid = ?", (page_id,))
+                self.conn.execute("INSERT INTO page_texts(rowid, page_text) VALUES (?, ?)",
+                                  (page_id, page_text or ""))
+
+    def add_text(self, entries):
+        """
+        Insert or replace (image_id, caption, pdf_path, page_number) entries in
+        the full-text index; the image is linked to the text of its page.
+        """
+        with self.conn:
+            for image_id, caption, pdf_path, page_number in entries:
+                page_id = self._page_id(pdf_path, page_number)
+                self.conn.execute("INSERT OR IGNORE INTO text_docs(image_id) VALUES (?)", (image_id,))
+                doc_id = self.conn.execute("SELECT doc_id FROM text_docs WHERE image_id = ?",
+                                           (image_id,)).fetchone()[0]
+                self.conn.execute("UPDATE text_docs SET page_id = ? WHERE doc_id = ?", (page_id, doc_id))
+                self.conn.execute("DELETE FROM image_text WHERE rowid = ?", (doc_id,))
+                self.conn.execute("INSERT INTO image_text(rowid, caption) VALUES (?, ?)",
+                                  (doc_id, caption or ""))
+
+    def remove_text(self, image_ids):
+        """Remove the given image ids, and the text of pages left without images, from the full-text index."""
+        with self.conn:
+            page_ids = set()
+            for image_id in image_ids:
+                row = self.conn.execute("SELECT doc_id, page_id FROM text_docs WHERE image_id = ?",
+                                        (image_id,)).fetchone()
+                if row:
+                    self.conn.execute("DELETE FROM image_text WHERE rowid = ?", (row[0],))
+                    self.conn.execute("DELETE FROM text_docs WHERE doc_id = ?", (row[0],))
+                    page_ids.add(row[1])
+            for page_id in page_ids:
+                if not self.conn.execute("SELECT 1 FROM text_docs WHERE page_id = ? LIMIT 1",
+                                         (page_id,)).fetchone():
+                    self.conn.execute("DELETE FROM page_texts WHERE rowid = ?", (page_id,))
+                    self.conn.execute("DELETE FROM page_docs WHERE page_id = ?", (page_id,))
+
+    def text_image_ids(self):
+        """Return the set of image ids that already have text indexed."""
+        return {row[0] for row in self.conn.execute("SELECT image_id FROM text_docs")}
+
+    def search_text(self, text, limit=50):
+        """
+        Ranked full-text search over captions and page text.
+
+        Returns (image_id, path, snippet) tuples, best match first.
+        """
+        query = fts_query(text)
+        if query is None:
+            return []
+        # Captions and pages are searched separately; an image matches if
+        # either does, and ranks by the weighted sum of both scores
+        return self.conn.execute(
+            "WITH caption_hits AS ("
+            "    SELECT rowid AS doc_id, bm25(image_text) AS rank, "
+            "           snippet(image_text, 0, '[', ']', '...', 12) AS snippet "
+            "    FROM image_text WHERE image_text MATCH ?), "
+            "page_hits AS ("
+            "    SELECT rowid AS page_id, bm25(page_texts) AS rank, "
+            "           snippet(page_texts, 0, '[', ']', '...', 12) AS snippet "
+            "    FROM page_texts WHERE page_texts MATCH ?), "
+            "hits AS ("
+            "    SELECT doc_id FROM caption_hits "
+            "    UNION SELECT d.doc_id FROM page_hits JOIN text_docs d ON d.page_id = page_hits.page_id) "
+            "SELECT d.image_id, i.path, COALESCE(c.snippet, p.snippet) "
+            "FROM hits "
+            "JOIN text_docs d ON d.doc_id = hits.doc_id "
+            "JOIN images i ON i.image_id = d.image_id "
+            "LEFT JOIN caption_hits c ON c.doc_id = d.doc_id "
+            "LEFT JOIN page_hits p ON p.page_id = d.page_id "
+            "ORDER BY COALESCE(c.rank, 0) * ? + COALESCE(p.rank, 0) * ? LIMIT ?",
+            (query, query, CAPTION_WEIGHT, PAGE_TEXT_WEIGHT, limit)).fetchall()
+
+    def similar_images(self, phash, max_distance=SIMILAR_MAX_DISTANCE, limit=50):
+        """
+        Find images whose perceptual hash is within max_distance bits of phash.
+
+        Uses multi-index hashing: each hash chunk is looked up within
+        max_distance // CHUNKS bits, and only those candidates are compared in
+        full. Returns (image_id, path, distance) tuples, closest first.
+        """
+        masks = chunk_neighbors(0, max_distance // CHUNKS)
+        candidates = {}
+        for i, chunk in enumerate(hash_chunks(phash)):
+            values = ", ".join(str(chunk ^ mask) for mask in masks)
+            for image_id, other in self.conn.execute(
+                    f"SELECT image_id, phash FROM image_hashes WHERE chunk{i} IN ({values})"):
+                candidates[image_id] = other
+
+        matches = sorted((distance, image_id) for image_id, distance in
+                         ((image_id, hamming_distance(phash, other)) for image_id, other in candidates.items())
+                         if distance <= max_distance)[:limit]
+        paths = dict(self.conn.execute(
+            f"SELECT image_id, path FROM images WHERE image_id IN ({', '.join('?' * len(matches))})",
+            [image_id for _, image_id in matches])) if matches else {}
+        return [(image_id, paths[image_id], distance) for distance, image_id in matches if image_id in paths]
+
+    def all_hashes(self):
+        """Return {image_id: phash} for every hashed image."""
+        return dict(self.conn.execute("SELECT image_id, phash FROM image_hashes"))
+
+    def image_types(self):
+        """Return the distinct image types present in the index."""
+        return [row[0] for row in self.conn.execute(
+            "SELECT DISTINCT image_type FROM images WHERE image_type IS NOT NULL ORDER BY image_type")]
@@ -0,0 +1,362 @@
+import os
+import sys
+import mmap
+import time
+import uuid
+import struct
+import threading
+
+# Pack files hold many extracted images back to back, like an uncompressed
+# zip: every image is stored as a small header, its name and its bytes, and a
+# sidecar .idx file lists "name<TAB>offset<TAB>length" for each of them so
+# readers do not have to walk the headers. An image in a pack is addressed
+# as <pack path>/<name>, e.g. extracted_images/pack-....pack/<id>.png, so the
+# image id can still be read off the end of its path.
+PACK_EXTENSION = ".pack"
+INDEX_EXTENSION = ".idx"
+PACK_MAGIC = b"PIXPACK1"
+ENTRY_MAGIC = b"PIXE"
+ENTRY_HEADER = struct.Struct("<4sHQ")
+
+# A writer starts a new pack once the current one passes PACK_MAX_BYTES.
+# Compaction rewrites packs in which less than COMPACT_LIVE_RATIO of the
+# bytes still belong to images in the metadata store, and merges packs
+# smaller than SMALL_PACK_BYTES.
+PACK_MAX_BYTES = 1024 * 1024 * 1024
+SMALL_PACK_BYTES = PACK_MAX_BYTES // 4
+COMPACT_LIVE_RATIO = 0.75
+
+def member_path(pack_path, name):
+    """Return the path that addresses an image stored in a pack."""
+    return os.path.join(pack_path, name)
+
+def split_member_path(path):
+    """Split a pack member path into (pack_path, name), or return None for an ordinary file."""
+    pack_path, name = os.path.split(path)
+    if pack_path.endswith(PACK_EXTENSION):
+        return pack_path, name
+    return None
+
+def iter_packs(output_folder):
+    """Yield the paths of the pack files in an output folder."""
+    if not os.path.isdir(output_folder):
+        return
+    with os.scandir(output_folder) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.endswith(PACK_EXTENSION):
+                yield entry.path
+
+class PackWriter:
+    """Appends images to pack files in a folder, starting a new pack when one is full."""
+    def __init__(self, output_folder, max_bytes=PACK_MAX_BYTES):
+        self.output_folder = output_folder
+        self.max_bytes = max_bytes
+        self.pack_path = None
+        self.pack_file = None
+        self.index_file = None
+
+    def _open_new_pack(self):
+        self.close()
+        os.makedirs(self.output_folder, exist_ok=True)
+        name = f"pack-{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}{PACK_EXTENSION}"
+        self.pack_path = os.path.join(self.output_folder, name)
+        self.pack_file = open(self.pack_path, "xb")
+        self.pack_file.write(PACK_MAGIC)
+        self.index_file = open(self.pack_path + INDEX_EXTENSION, "x", encoding="utf-8")
+
+    def write(self, name, data):
+        """Append one image and return its member path."""
+        if self.pack_file is None or self.pack_file.tell() >= self.max_bytes:
+            self._open_new_pack()
+        encoded_name = name.encode("utf-8")
+        self.pack_file.write(ENTRY_HEADER.pack(ENTRY_MAGIC, len(encoded_name), len(data)))
+        self.pack_file.write(encoded_name)
+        offset = self.pack_file.tell()
+        self.pack_file.write(data)
+        self.index_file.write(f"{name}\t{offset}\t{len(data)}\n")
+        return member_path(self.pack_path, name)
+
+    def flush(self, sync=False):
+        """Push written images to disk; the pack goes first so the index never runs ahead of it."""
+        if self.pack_file is None:
+            return
+        self.pack_file.flush()
+        if sync:
+            os.fsync(self.pack_file.fileno())
+        self.index_file.flush()
+        if sync:
+            os.fsync(self.index_file.fileno())
+
+    def close(self):
+        if self.pack_file is not None:
+            self.flush()
+            self.pack_file.close()
+            self.index_file.close()
+        self.pack_file = None
+        self.index_file = None
+
+class PackReader:
+    """
+    Random access to the images of one pack through a read-only memory map.
+
+    The pack may still be growing while it is read; a lookup that misses
+    maps the file again and picks up whatever was appended since.
+    """
+    def __init__(self, pack_path):
+        self.pack_path = pack_path
+        self.members = {}
+        self.size = 0
+        self.end = len(PACK_MAGIC)
+        self.index_position = 0
+        self._file = None
+        self._map = None
+        self._lock = threading.RLock()
+        self.refresh()
+
+    def refresh(self):
+        """Map the pack again if it has grown and index the new entries."""
+        with self._lock:
+            if os.path.getsize(self.pack_path) == self.size:
+                return
+            self._unmap()
+            self._file = open(self.pack_path, "rb")
+            try:
+                self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty file, nothing has been written yet
+                self._map = None
+            self.size = len(self._map) if self._map is not None else 0
+            self._read_index()
+            self._scan_headers()
+
+    def _read_index(self):
+        index_path = self.pack_path + INDEX_EXTENSION
+        if not os.path.exists(index_path):
+            return
+        with open(index_path, "rb") as index_file:
+            index_file.seek(self.index_position)
+            for line in index_file:
+                if not line.endswith(b"\n"):
+                    break  # still being written
+                try:
+                    name, offset, length = line.decode("utf-8").rstrip("\n").split("\t")
+                    offset, length = int(offset), int(length)
+                except ValueError:
+                    break
+                if offset + length > self.size:
+                    break  # describes data beyond the current mapping
+                self.members[name] = (offset, length)
+                self.end = max(self.end, offset + length)
+                self.index_position += len(line)
+
+    def _scan_headers(self):
+        # Entries the index does not list yet (or at all, if the index file
+        # was lost) are found by following the headers from the last known one.
+        while self.end + ENTRY_HEADER.size <= self.size:
+            magic, name_length, length = ENTRY_HEADER.unpack_from(self._map, self.end)
+            offset = self.end + ENTRY_HEADER.size + name_length
+            if magic != ENTRY_MAGIC or offset + length > self.size:
+                break
+            name = self._map[self.end + ENTRY_HEADER.size:offset].decode("utf-8", "replace")
+            self.members[name] = (offset, length)
+            self.end = offset + length
+
+    def __contains__(self, name):
+        with self._lock:
+            if name not in self.members:
+                self.refresh()
+            return name in self.members
+
+    def locate(self, name):
+        """Return the (offset, length) of one image in the pack file, or None."""
+        with self._lock:
+            if name not in self.members:
+                self.refresh()
+            return self.members.get(name)
+
+    def read(self, name):
+        """Return the bytes of one image, or None if the pack does not hold it."""
+        with self._lock:
+            if name not in self.members:
+                self.refresh()
+            entry = self.members.get(name)
+            if entry is None:
+                return None
+            offset, length = entry
+            return self._map[offset:offset + length]
+
+    def _unmap(self):
+        if self._map is not None:
+            self._map.close()
+        if self._file is not None:
+            self._file.close()
+        self._map = None
+        self._file = None
+
+    def close(self):
+        with self._lock:
+            self._unmap()
+            self.size = 0
+            self.end = len(PACK_MAGIC)
+            self.index_position = 0
+            self.members = {}
+
+# Readers stay open, so browsing a pack costs one mapping rather than an
+# open() per image.
+_readers = {}
+_readers_lock = threading.Lock()
+
+def open_pack(pack_path):
+    """Return the shared reader of a pack file."""
+    key = os.path.normpath(pack_path)
+    with _readers_lock:
+        reader = _readers.get(key)
+        if reader is None:
+            reader = PackReader(pack_path)
+            _readers[key] = reader
+        return reader
+
+def close_packs():
+    """Unmap every open pack, e.g. before pack files are replaced."""
+    with _readers_lock:
+        for reader in _readers.values():
+            reader.close()
+        _readers.clear()
+
+def read_member(path):
+    """Return the bytes of an image stored in a pack, or None if it is not there."""
+    pack_path, name = split_member_path(path)
+    if not os.path.isfile(pack_path):
+        return None
+    try:
+        return open_pack(pack_path).read(name)
+    except (OSError, ValueError) as e:
+        print(f"Error reading {path}: {str(e)}")
+        return None
+
+def locate_member(path):
+    """Return the (offset, length) of a pack member within its pack file, or None."""
+    pack_path, name = split_member_path(path)
+    if not os.path.isfile(pack_path):
+        return None
+    try:
+        return open_pack(pack_path).locate(name)
+    except (OSError, ValueError):
+        return None
+
+def member_exists(path):
+    """Check whether a pack member path points at a stored image."""
+    pack_path, name = split_member_path(path)
+    if not os.path.isfile(pack_path):
+        return False
+    try:
+        return name in open_pack(pack_path)
+    except (OSError, ValueError):
+        return False
+
+def iter_pack_members(pack_path):
+    """Yield the member paths of every image in a pack."""
+    reader = PackReader(pack_path)
+    try:
+        names = list(reader.members)
+    finally:
+        reader.close()
+    for name in names:
+        yield member_path(pack_path, name)
+
+def compact_packs(output_folder, metadata_file_path=None, min_live_ratio=COMPACT_LIVE_RATIO,
+                  progress_callback=None):
+    """
+    Rewrite pack files to reclaim the space of images no longer in the metadata store.
+
+    Packs with too little live data are copied, live images only, into new
+    packs, and small packs are merged on the way. The metadata and index are
+    pointed at the new packs before the old ones are deleted, so an
+    interrupted run loses nothing; packs it had already written are simply
+    unreferenced and go away on the next run. The packs of a running
+    extraction hold images its metadata does not list yet, so compaction
+    refuses to start, with RuntimeError, while one runs, and extractions
+    refuse to start until it is done.
+
+    Returns the number of bytes reclaimed.
+    """
+    from image_extraction import extraction_lock, METADATA_FILE_PATH
+
+    with extraction_lock(compaction=True):
+        return _compact_packs(output_folder, metadata_file_path or METADATA_FILE_PATH, min_live_ratio,
+                              progress_callback)
+
+def _compact_packs(output_folder, metadata_file_path, min_live_ratio, progress_callback):
+    from image_extraction import load_metadata, update_metadata, metadata_mtime
+    from image_index import ImageIndex
+
+    metadata = load_metadata(metadata_file_path)
+    loaded_mtime = metadata_mtime(metadata_file_path)
+
+    live = {}
+    for image_id, record in metadata.items():
+        parts = split_member_path(record.get("path", ""))
+        if parts:
+            live.setdefault(os.path.normpath(parts[0]), {})[parts[1]] = image_id
+
+    rewrite, small = [], []
+    for pack_path in iter_packs(output_folder):
+        reader = PackReader(pack_path)
+        members = live.get(os.path.normpath(pack_path), {})
+        live_bytes = sum(reader.members[name][1] for name in members if name in reader.members)
+        size = reader.size
+        reader.close()
+        if live_bytes < size * min_live_ratio:
+            rewrite.append(pack_path)
+        elif size < SMALL_PACK_BYTES:
+            small.append(pack_path)
+    # A single small pack gains nothing from being copied on its own
+    if len(small) + len(rewrite) > 1:
+        rewrite.extend(small)
+    if not rewrite:
+        return 0
+
+    old_bytes = sum(os.path.getsize(pack_path) for pack_path in rewrite)
+    writer = PackWriter(output_folder)
+    new_packs = set()
+    updated = {}
+    for pack_path in rewrite:
+        reader = PackReader(pack_path)
+        members = live.get(os.path.normpath(pack_path), {})
+        # Copy in file order so the old pack is read sequentially
+        for name in sorted((name for name in members if name in reader.members),
+                           key=lambda name: reader.members[name][0]):
+            new_path = writer.write(name, reader.read(name))
+            new_packs.add(writer.pack_path)
+            updated[members[name]] = {"path": new_path}
+            if progress_callback and len(updated) % 1000 == 0:
+                progress_callback(len(updated))
+        reader.close()
+        writer.flush(sync=True)
+    writer.close()
+
+    # Only the paths are merged, so a backfill or recompression that saved
+    # meanwhile keeps its changes
+    with ImageIndex() as index:
+        index.sync_from_metadata(metadata_file_path)
+        index.update_paths((image_id, fields["path"]) for image_id, fields in updated.items())
+        update_metadata(updated, metadata_file_path, index, loaded_mtime)
+
+    # Readers of the old packs must let go before the files can be removed on Windows
+    close_packs()
+    for pack_path in rewrite:
+        for path in (pack_path, pack_path + INDEX_EXTENSION):
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+            except OSError as e:
+                print(f"Error removing {path}: {str(e)}")
+    new_bytes = sum(os.path.getsize(pack_path) for pack_path in new_packs)
+    return old_bytes - new_bytes
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python image_pack.py <output_folder>")
+        sys.exit(1)
+    reclaimed = compact_packs(sys.argv[1], progress_callback=lambda n: print(f"Copied {n} images"))
+    print(f"Compaction complete, reclaimed {reclaimed / (1024 * 1024):.1f} MB")
@@ -0,0 +1,281 @@
+import os
+import sys
+import time
+import zlib
+import struct
+from multiprocessing import Pool
+from image_extraction import load_metadata, update_metadata, metadata_mtime, METADATA_FILE_PATH
+from image_store import resolve_image_path, image_exists
+from image_index import ImageIndex
+from image_pack import split_member_path
+
+# Extraction writes PNGs with fast deflate and no row filters. This pass
+# re-encodes their pixel data with zlib at its highest level, also trying
+# the Sub and Up row filters, and keeps whichever stream is smallest. Only
+# the IDAT chunks change; the header, palette and every other chunk are
+# copied as they are, and the new file is only kept if its unfiltered
+# pixel rows are byte for byte those of the original.
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+IDAT_CHUNK_BYTES = 1024 * 1024
+CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+FILTER_NONE, FILTER_SUB, FILTER_UP = 0, 1, 2
+
+# Images whose raw pixels exceed this are left alone, so a worker never
+# holds more than a few copies of this much in memory.
+RECOMPRESS_MAX_RAW_BYTES = 256 * 1024 * 1024
+
+# The pass runs beside interactive use: one low-priority worker by
+# default, optionally sleeping between images.
+RECOMPRESS_PROCESSES = 1
+RECOMPRESS_NICE = 19
+
+def read_chunks(data):
+    """Split PNG bytes into a list of (type, body) chunks."""
+    if not data.startswith(PNG_SIGNATURE):
+        raise ValueError("not a PNG file")
+    chunks = []
+    position = len(PNG_SIGNATURE)
+    while position + 8 <= len(data):
+        length, chunk_type = struct.unpack(">I4s", data[position:position + 8])
+        body = data[position + 8:position + 8 + length]
+        if len(body) != length:
+            raise ValueError("truncated chunk")
+        chunks.append((chunk_type, body))
+        position += 12 + length
+        if chunk_type == b"IEND":
+            break
+    return chunks
+
+def write_chunks(chunks):
+    parts = [PNG_SIGNATURE]
+    for chunk_type, body in chunks:
+        parts.append(struct.pack(">I", len(body)))
+        parts.append(chunk_type)
+        parts.append(body)
+        parts.append(struct.pack(">I", zlib.crc32(body, zlib.crc32(chunk_type))))
+    return b"".join(parts)
+
+# Row filters work byte by byte modulo 256. Each row is handled as one big
+# integer, with the high bit of every byte masked so carries and borrows
+# never cross into the neighbouring byte; Python then does the whole row
+# in a few C-level operations instead of a loop per byte.
+def _byte_masks(row_bytes):
+    return int.from_bytes(b"\x80" * row_bytes, "big"), int.from_bytes(b"\x7f" * row_bytes, "big")
+
+def _subtract(a, b, high, low):
+    return ((a | high) - (b & low)) ^ ((a ^ ~b) & high)
+
+def _add(a, b, high, low):
+    return ((a & low) + (b & low)) ^ ((a ^ b) & high)
+
+def png_geometry(header):
+    """Return (row_bytes, bytes_per_pixel, height, interlaced) from an IHDR body."""
+    width, height, bit_depth, color_type, _, _, interlace = struct.unpack(">IIBBBBB", header)
+    bits = CHANNELS[color_type] * bit_depth
+    return (width * bits + 7) // 8, max(bits // 8, 1), height, interlace != 0
+
+def split_rows(raw, row_bytes, height):
+    """Return the filter type and contents of each row of a decompressed, non-interlaced IDAT stream."""
+    stride = row_bytes + 1
+    if len(raw) < stride * height:
+        raise ValueError("pixel data is shorter than the image")
+    return [(raw[i * stride], raw[i * stride + 1:(i + 1) * stride]) for i in range(height)]
+
+def filter_rows(rows, filter_type, bpp):
+    """Apply one filter to every row of an unfiltered image; returns the IDAT stream before compression."""
+    row_bytes = len(rows[0])
+    high, low = _byte_masks(row_bytes)
+    out = []
+    previous = 0
+    for row in rows:
+        current = int.from_bytes(row, "big")
+        if filter_type == FILTER_SUB:
+            filtered = _subtract(current, current >> (8 * bpp), high, low)
+        else:
+            filtered = _subtract(current, previous, high, low)
+        out.append(bytes((filter_type,)))
+        out.append(filtered.to_bytes(row_bytes, "big"))
+        previous = current
+    return b"".join(out)
+
+def unfilter_rows(rows, bpp):
+    """Undo Sub and Up filters, returning the pixel rows; any other filter raises ValueError."""
+    row_bytes = len(rows[0][1])
+    high, low = _byte_masks(row_bytes)
+    out = []
+    previous = 0
+    for filter_type, row in rows:
+        current = int.from_bytes(row, "big")
+        if filter_type == FILTER_SUB:
+            # Prefix sum over the pixels of the row, doubling the reach each step
+            shift = bpp
+            while shift < row_bytes:
+                current = _add(current, current >> (8 * shift), high, low)
+                shift *= 2
+        elif filter_type == FILTER_UP:
+            current = _add(current, previous, high, low)
+        elif filter_type != FILTER_NONE:
+            raise ValueError(f"unsupported filter {filter_type}")
+        out.append(current.to_bytes(row_bytes, "big"))
+        previous = current
+    return out
+
+def _deflate(data):
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 15, 9)
+    return compressor.compress(data) + compressor.flush()
+
+def recompress_png(data):
+    """
+    Return a smaller, pixel-identical encoding of PNG bytes, or None if none was found.
+
+    The chosen stream is decoded again and compared with the original
+    pixels before it is accepted.
+    """
+    chunks = read_chunks(data)
+    header = next((body for chunk_type, body in chunks if chunk_type == b"IHDR"), None)
+    if header is None:
+        raise ValueError("missing IHDR chunk")
+    row_bytes, bpp, height, interlaced = png_geometry(header)
+    if (row_bytes + 1) * height > RECOMPRESS_MAX_RAW_BYTES:
+        return None
+    old_stream = zlib.decompress(b"".join(body for chunk_type, body in chunks if chunk_type == b"IDAT"))
+
+    candidates = [old_stream]
+    pixels = None
+    if not interlaced and height and row_bytes:
+        rows = split_rows(old_stream, row_bytes, height)
+        # Re-filtering needs the plain pixels, which are only at hand when
+        # the original rows are unfiltered, as extraction writes them
+        if all(filter_type == FILTER_NONE for filter_type, _ in rows):
+            pixels = [row for _, row in rows]
+            candidates += [filter_rows(pixels, FILTER_SUB, bpp), filter_rows(pixels, FILTER_UP, bpp)]
+
+    best = min((_deflate(stream) for stream in candidates), key=len)
+    # The rest of the file is unchanged, so it is enough to beat the old IDAT data
+    old_idat = sum(len(body) for chunk_type, body in chunks if chunk_type == b"IDAT")
+    if len(best) >= old_idat:
+        return None
+
+    new_stream = zlib.decompress(best)
+    if pixels is None:
+        identical = new_stream == old_stream
+    else:
+        identical = unfilter_rows(split_rows(new_stream, row_bytes, height), bpp) == pixels
+    if not identical:
+        raise ValueError("re-encoded pixels differ from the original")
+
+    idat = [(b"IDAT", best[i:i + IDAT_CHUNK_BYTES]) for i in range(0, len(best), IDAT_CHUNK_BYTES)]
+    first = next(i for i, (chunk_type, _) in enumerate(chunks) if chunk_type == b"IDAT")
+    rest = [chunk for chunk in chunks if chunk[0] != b"IDAT"]
+    return write_chunks(rest[:first] + idat + rest[first:])
+
+_pause = 0
+
+def _lower_priority(pause):
+    global _pause
+    _pause = pause
+    if hasattr(os, "nice"):
+        try:
+            os.nice(RECOMPRESS_NICE)
+        except OSError:
+            pass
+
+def recompress_png_file(args):
+    """
+    Recompress one PNG in place; returns (image_id, size in bytes), with
+    size None if the file could not be read or re-encoded.
+
+    The new file is written beside the old one and renamed over it, so a
+    crash never leaves a half-written image behind.
+    """
+    image_id, image_path = args
+    try:
+        with open(image_path, "rb") as image_file:
+            data = image_file.read()
+        smaller = recompress_png(data)
+        if smaller is None:
+            size = len(data)
+        else:
+            temporary_path = image_path + ".tmp"
+            with open(temporary_path, "wb") as image_file:
+                image_file.write(smaller)
+            os.replace(temporary_path, image_path)
+            size = len(smaller)
+    except Exception as e:
+        print(f"Error recompressing {image_path}: {str(e)}")
+        size = None
+    if _pause:
+        time.sleep(_pause)
+    return image_id, size
+
+def recompress_pngs(metadata_file_path=METADATA_FILE_PATH, processes=RECOMPRESS_PROCESSES, pause=0,
+                    batch_size=500, progress_callback=None, should_stop=None):
+    """
+    Losslessly recompress extracted PNGs in the background.
+
+    Workers run at the lowest CPU priority and sleep `pause` seconds after
+    each image. Images that have been through the pass are marked
+    "recompressed" in the metadata, with their new size_bytes, so a stopped
+    or interrupted pass picks up where it left off; should_stop is polled
+    between images. Images stored in pack files are skipped, since packs are
+    never rewritten in place. Only these two fields are merged into the
+    metadata file, as it is when the pass ends.
+
+    Returns (images processed, bytes saved).
+    """
+    metadata = load_metadata(metadata_file_path)
+    # Paths may still point at the flat folder while a migration runs
+    todo = [(image_id, resolve_image_path(record.get("path", ""))) for image_id, record in metadata.items()
+            if record.get("image_type") == "PNG" and not record.get("recompressed")
+            and not split_member_path(record.get("path", ""))]
+    todo = [(image_id, image_path) for image_id, image_path in todo if image_exists(image_path)]
+    print(f"Recompressing {len(todo)} PNG images")
+
+    done = {}
+    pending = {}
+    saved = 0
+    with ImageIndex() as index:
+        index.sync_from_metadata(metadata_file_path, metadata)
+        synced_mtime = metadata_mtime(metadata_file_path)
+        try:
+            with Pool(processes, initializer=_lower_priority, initargs=(pause,)) as pool:
+                for image_id, size in pool.imap_unordered(recompress_png_file, todo):
+                    if size is not None:
+                        record = metadata[image_id]
+                        saved += record.get("size_bytes", size) - size
+                        record["size_bytes"] = size
+                        record["recompressed"] = True
+                        done[image_id] = size
+                        pending[image_id] = record
+                    if len(pending) >= batch_size:
+                        index.add_records(pending)
+                        pending = {}
+                        if progress_callback:
+                            progress_callback(len(done))
+                    if should_stop and should_stop():
+                        break
+        finally:
+            index.add_records(pending)
+            if done:
+                update_metadata({image_id: {"size_bytes": size, "recompressed": True}
+                                 for image_id, size in done.items()}, metadata_file_path, index, synced_mtime)
+    return len(done), saved
+
+if __name__ == "__main__":
+    arguments = sys.argv[1:]
+    processes, pause = RECOMPRESS_PROCESSES, 0
+    for option in ("--processes", "--pause"):
+        if option in arguments:
+            position = arguments.index(option)
+            value = arguments[position + 1]
+            del arguments[position:position + 2]
+            if option == "--processes":
+                processes = int(value)
+            else:
+                pause = float(value)
+    if arguments:
+        print("Usage: python image_recompress.py [--processes N] [--pause SECONDS]")
+        sys.exit(1)
+    count, saved = recompress_pngs(processes=processes, pause=pause,
+                                   progress_callback=lambda n: print(f"Recompressed {n} images"))
+    print(f"Recompressed {count} images, saved {saved / (1024 * 1024):.1f} MB")
@@ -0,0 +1,139 @@
+import os
+import sys
+import hashlib
+from image_pack import split_member_path, read_member, member_exists
+
+# Extracted images are spread over a two-level hash-prefix tree, e.g.
+# extracted_images/ab/cd/<id>.png, so that no single directory grows past a
+# few hundred entries per level even for millions of images.
+SHARD_DEPTH = 2
+SHARD_WIDTH = 2
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+def shard_dir(output_folder, image_id):
+    """Return the shard directory an image id belongs in."""
+    digest = hashlib.sha1(image_id.encode("utf-8")).hexdigest()
+    parts = [digest[i * SHARD_WIDTH:(i + 1) * SHARD_WIDTH] for i in range(SHARD_DEPTH)]
+    return os.path.join(output_folder, *parts)
+
+def shard_path(output_folder, image_id, extension, create=False):
+    """Return the sharded path of an image, optionally creating its directory."""
+    directory = shard_dir(output_folder, image_id)
+    if create:
+        os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, f"{image_id}.{extension}")
+
+def resolve_image_path(image_path):
+    """
+    Return where an image lives now, following it into its shard if it was moved.
+
+    Paths recorded before a migration still point at the flat folder; this
+    keeps them usable while the migration is running.
+    """
+    if os.path.exists(image_path) or split_member_path(image_path):
+        return image_path
+    folder, file_name = os.path.split(image_path)
+    image_id, extension = os.path.splitext(file_name)
+    sharded = shard_path(folder, image_id, extension.lstrip("."))
+    if os.path.exists(sharded):
+        return sharded
+    return image_path
+
+def image_exists(image_path):
+    """Check whether an image file or pack member exists."""
+    if split_member_path(image_path):
+        return member_exists(image_path)
+    return os.path.exists(image_path)
+
+def read_image_bytes(image_path):
+    """Return the encoded bytes of an image file or pack member, or None if it cannot be read."""
+    if split_member_path(image_path):
+        return read_member(image_path)
+    try:
+        with open(image_path, "rb") as img_file:
+            return img_file.read()
+    except OSError as e:
+        print(f"Error reading {image_path}: {str(e)}")
+        return None
+
+def remove_image(image_path):
+    """
+    Delete an image file.
+
+    Images in packs stay where they are until the pack is compacted, which
+    drops every image that is no longer in the metadata store.
+    """
+    if not split_member_path(image_path) and os.path.exists(image_path):
+        os.remove(image_path)
+
+def migrate_to_sharded(output_folder, metadata_file_path=None, batch_size=1000, progress_callback=None):
+    """
+    Move the images of a flat output folder into the sharded layout.
+
+    The top-level directory is streamed with os.scandir, so memory use does
+    not grow with the number of files. Each move is a single rename, which
+    leaves every file either in its old or its new place; an interrupted run
+    is resumed by simply running it again. The index is updated batch by
+    batch so the viewer keeps finding images while the migration runs, and
+    the metadata file is brought up to date at the end.
+
+    Returns the number of images moved.
+    """
+    from image_extraction import load_metadata, update_metadata, metadata_mtime, METADATA_FILE_PATH
+    from image_index import ImageIndex
+
+    metadata_file_path = metadata_file_path or METADATA_FILE_PATH
+    moved = 0
+    with ImageIndex() as index:
+        index.sync_from_metadata(metadata_file_path)
+        synced_mtime = metadata_mtime(metadata_file_path)
+
+        # Whether readdir still returns every entry while others are being
+        # renamed away is unspecified (notably on NFS), so keep going until a
+        # pass over the folder finds nothing left to move.
+        while True:
+            moved_in_pass = 0
+            batch = []
+            with os.scandir(output_folder) as entries:
+                for entry in entries:
+                    if not entry.is_file() or not entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                        continue
+                    image_id, extension = os.path.splitext(entry.name)
+                    destination = shard_path(output_folder, image_id, extension.lstrip("."), create=True)
+                    os.replace(entry.path, destination)
+                    batch.append((image_id, destination))
+                    if len(batch) >= batch_size:
+                        index.update_paths(batch)
+                        moved_in_pass += len(batch)
+                        batch = []
+                        if progress_callback:
+                            progress_callback(moved + moved_in_pass)
+            index.update_paths(batch)
+            moved_in_pass += len(batch)
+            moved += moved_in_pass
+            if moved_in_pass == 0:
+                break
+
+        # Rewrite every recorded path that still points at the flat folder.
+        # This also repairs records left behind by an interrupted run. The
+        # folder may be given relative or absolute, whatever the records use.
+        flat_folder = os.path.abspath(output_folder)
+        updates = {}
+        for image_id, record in load_metadata(metadata_file_path).items():
+            path = record.get("path", "")
+            if path and os.path.abspath(os.path.dirname(path)) == flat_folder:
+                resolved = resolve_image_path(path)
+                if resolved != path:
+                    updates[image_id] = {"path": resolved}
+        if updates:
+            index.update_paths((image_id, fields["path"]) for image_id, fields in updates.items())
+            update_metadata(updates, metadata_file_path, index, synced_mtime)
+
+    return moved
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python image_store.py <output_folder>")
+        sys.exit(1)
+    total = migrate_to_sharded(sys.argv[1], progress_callback=lambda n: print(f"Moved {n} images"))
+    print(f"Migration complete, moved {total} images")
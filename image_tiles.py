@@ -0,0 +1,54 @@
+import threading
+import fitz  # PyMuPDF
+
+# Images with more pixels than this are never decoded whole for display; the
+# preview renders them region by region instead.
+LARGE_IMAGE_PIXELS = 4096 * 4096
+TILE_SIZE = 512
+
+# The scratch page an image is drawn on is kept within the page sizes PDF
+# tools accept; the image keeps its own resolution regardless.
+MAX_PAGE_SIDE = 14400
+
+# PyMuPDF must not be used from two threads at once
+FITZ_LOCK = threading.RLock()
+
+class PdfImageRenderer:
+    """
+    Renders regions of an extracted image from its source PDF at any scale.
+
+    The image is placed alone on a scratch page of its own document; MuPDF
+    then decodes only the rows a region needs, subsampled to the requested
+    scale, so memory follows the size of the region that is asked for and
+    not the size of the image.
+    """
+    def __init__(self, pdf_path, page_number, image_index):
+        with FITZ_LOCK:
+            self.doc = fitz.open(pdf_path)
+            try:
+                # image_index is the 1-based position in get_images, as in process_pdf
+                image = self.doc[page_number - 1].get_images(full=True)[image_index - 1]
+                xref, self.width, self.height = image[0], image[2], image[3]
+                self.scale = min(1.0, MAX_PAGE_SIDE / max(self.width, self.height))
+                self.page = self.doc.new_page(width=self.width * self.scale, height=self.height * self.scale)
+                self.page.insert_image(self.page.rect, xref=xref, keep_proportion=False)
+            except Exception:
+                self.doc.close()
+                raise
+
+    def render(self, x, y, width, height, zoom):
+        """
+        Render the region (x, y, width, height), given in image pixels, at
+        `zoom` output pixels per image pixel.
+
+        Returns (samples, width, height, stride) of an RGB pixmap.
+        """
+        with FITZ_LOCK:
+            clip = fitz.Rect(x, y, x + width, y + height) * self.scale
+            matrix = fitz.Matrix(zoom / self.scale, zoom / self.scale)
+            pix = self.page.get_pixmap(matrix=matrix, clip=clip, alpha=False)
+            return pix.samples, pix.width, pix.height, pix.stride
+
+    def close(self):
+        with FITZ_LOCK:
+            self.doc.close()
@@ -2,14 +2,174 @@ import sys
 import os
 import json
 import time
+import math
+import threading
+from collections import OrderedDict
 
 from PyQt5.QtWidgets import (QApplication, QDialog, QWidget, QHBoxLayout, QFormLayout,
                              QGridLayout, QLabel, QPushButton, QScrollArea, QFileDialog,
                              QVBoxLayout, QLineEdit, QSlider, QCheckBox, QSplitter, 
-                             QProgressBar, QMessageBox, QStyle, QStyleFactory)
-from PyQt5.QtGui import QPixmap, QIcon, QFont, QPalette, QColor
-from PyQt5.QtCore import Qt, pyqtSignal, QSize, QThread, pyqtSlot, QRunnable, QThreadPool, QObject
-from image_extraction import extract_images_from_directory
+                             QProgressBar, QMessageBox, QStyle, QStyleFactory, QComboBox,
+                             QListWidget, QListWidgetItem)
+from PyQt5.QtGui import (QPixmap, QImage, QImageReader, QPainter, QIcon, QFont, QPalette,
+                         QColor, QIntValidator)
+from PyQt5.QtCore import (Qt, pyqtSignal, QSize, QThread, pyqtSlot, QRunnable, QThreadPool, QObject,
+                          QTimer, QBuffer, QIODevice, QRect, QRectF, QPointF)
+from image_extraction import (iter_images_from_directory, iter_images_from_zotero, backfill_page_context,
+                              backfill_perceptual_hashes, write_near_duplicate_report, hash_image_file,
+                              NEAR_DUPLICATE_REPORT_PATH)
+from perceptual_hash import HASH_MAX_PIXELS
+from extraction_plan import plan_directories, plan_zotero, format_plan
+from image_store import resolve_image_path, image_exists, read_image_bytes
+from image_index import ImageIndex, SORT_COLUMNS, COUNT_LIMIT
+from image_tiles import PdfImageRenderer, FITZ_LOCK, LARGE_IMAGE_PIXELS, TILE_SIZE
+from image_export import export_images
+from image_recompress import recompress_pngs
+
+# Thumbnails are decoded once at the largest zoom level and scaled for
+# display; the sidebar preview has its own size. All decoded images share
+# one memory budget.
+THUMBNAIL_SIZE = 300
+PREVIEW_SIZE = 330
+IMAGE_CACHE_BYTES = 256 * 1024 * 1024
+# Each open preview keeps at most this much of decoded tiles
+TILE_CACHE_BYTES = 64 * 1024 * 1024
+# Formats Qt really decodes at reduced size or clipped; for others (PNG) it
+# decodes the whole image first whatever options are set
+PARTIAL_DECODE_FORMATS = (b"jpeg",)
+
+def image_reader(data):
+    """Return a QImageReader over encoded image bytes."""
+    buffer = QBuffer()
+    buffer.setData(data)
+    buffer.open(QIODevice.ReadOnly)
+    reader = QImageReader(buffer)
+    # The reader does not take ownership of the buffer
+    reader.buffer = buffer
+    return reader
+
+def decode_image(img_path, size=None, record=None):
+    """
+    Decode an image file or pack member into a QImage, shrunk to fit size x size if given.
+
+    Huge images whose format cannot be decoded at reduced size are rendered
+    from their source PDF, given their metadata record, so they are never
+    decoded at full resolution.
+    """
+    data = read_image_bytes(img_path)
+    if not data:
+        return QImage()
+    reader = image_reader(data)
+    original = reader.size()
+    if size and original.isValid() and (original.width() > size or original.height() > size):
+        if (original.width() * original.height() > LARGE_IMAGE_PIXELS and record
+                and bytes(reader.format()) not in PARTIAL_DECODE_FORMATS):
+            try:
+                source = PdfTileSource(record)
+            except Exception as e:
+                print(f"Error opening source of {img_path}: {str(e)}")
+                return QImage()
+            try:
+                return source.render(0, 0, source.width, source.height,
+                                     size / max(source.width, source.height))
+            finally:
+                source.close()
+        # Lets JPEG decode at reduced resolution instead of scaling afterwards
+        reader.setScaledSize(original.scaled(size, size, Qt.KeepAspectRatio))
+    return reader.read()
+
+class DecodedTileSource:
+    """Tiles cut from an image small enough to be decoded whole."""
+    def __init__(self, image):
+        self.image = image
+        self.width = image.width()
+        self.height = image.height()
+
+    def render(self, x, y, width, height, zoom):
+        region = self.image.copy(QRect(x, y, width, height))
+        return region.scaled(max(round(width * zoom), 1), max(round(height * zoom), 1),
+                             Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+
+    def close(self):
+        pass
+
+class ReaderTileSource:
+    """Tiles decoded straight from the encoded bytes, for formats Qt can clip while decoding (JPEG)."""
+    def __init__(self, data, size):
+        self.data = data
+        self.width = size.width()
+        self.height = size.height()
+
+    def render(self, x, y, width, height, zoom):
+        reader = image_reader(self.data)
+        reader.setClipRect(QRect(x, y, width, height))
+        reader.setScaledSize(QSize(max(round(width * zoom), 1), max(round(height * zoom), 1)))
+        return reader.read()
+
+    def close(self):
+        pass
+
+class PdfTileSource:
+    """Tiles rendered from the image's source PDF, see PdfImageRenderer."""
+    def __init__(self, record):
+        self.renderer = PdfImageRenderer(record["pdf_path"], record["page_number"], record["image_index"])
+        self.width = self.renderer.width
+        self.height = self.renderer.height
+
+    def render(self, x, y, width, height, zoom):
+        samples, out_width, out_height, stride = self.renderer.render(x, y, width, height, zoom)
+        return QImage(samples, out_width, out_height, stride, QImage.Format_RGB888).copy()
+
+    def close(self):
+        self.renderer.close()
+
+def open_tile_source(img_path, record=None):
+    """Pick how an image is decoded for the tiled preview; returns None if it cannot be shown."""
+    data = read_image_bytes(img_path)
+    if not data:
+        return None
+    reader = image_reader(data)
+    size = reader.size()
+    if size.isValid() and size.width() * size.height() <= LARGE_IMAGE_PIXELS:
+        image = reader.read()
+        return DecodedTileSource(image) if not image.isNull() else None
+    if record and os.path.exists(record.get("pdf_path", "")):
+        try:
+            return PdfTileSource(record)
+        except Exception as e:
+            print(f"Error opening source of {img_path}: {str(e)}")
+    if size.isValid() and bytes(reader.format()) in PARTIAL_DECODE_FORMATS:
+        return ReaderTileSource(data, size)
+    return None
+
+class ImageCache:
+    """Thread-safe LRU cache of decoded QImages, bounded by their total size in bytes."""
+    def __init__(self, max_bytes=IMAGE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self.images = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.images
+
+    def get(self, key):
+        with self.lock:
+            image = self.images.get(key)
+            if image is not None:
+                self.images.move_to_end(key)
+            return image
+
+    def put(self, key, image):
+        with self.lock:
+            if key in self.images:
+                self.used_bytes -= self.images.pop(key).sizeInBytes()
+            self.images[key] = image
+            self.used_bytes += image.sizeInBytes()
+            while self.used_bytes > self.max_bytes and len(self.images) > 1:
+                _, evicted = self.images.popitem(last=False)
+                self.used_bytes -= evicted.sizeInBytes()
 
 # Worker classes for background processing
 class WorkerSignals(QObject):
@@ -18,14 +178,17 @@ class WorkerSignals(QObject):
     progress = pyqtSignal(int)
     error = pyqtSignal(str)
     result = pyqtSignal(list)
+    counts = pyqtSignal(dict)
 
 class ImageExtractionWorker(QRunnable):
-    def __init__(self, dir_path, output_folder, size_limit, page_limit):
+    def __init__(self, dir_path, output_folder, size_limit, page_limit, use_zotero=False, use_packs=False):
         super().__init__()
         self.dir_path = dir_path
         self.output_folder = output_folder
         self.size_limit = size_limit
         self.page_limit = page_limit
+        self.use_zotero = use_zotero
+        self.use_packs = use_packs
         self.signals = WorkerSignals()
 
     def run(self):
@@ -35,14 +198,21 @@ class ImageExtractionWorker(QRunnable):
             if not os.path.exists(self.output_folder):
                 os.makedirs(self.output_folder)
                 
-            extract_images_from_directory(self.dir_path, self.output_folder, self.size_limit, self.page_limit)
+            if self.use_zotero:
+                stream = iter_images_from_zotero(self.dir_path, self.output_folder, self.size_limit,
+                                                 self.page_limit, use_packs=self.use_packs)
+            else:
+                stream = iter_images_from_directory(self.dir_path, self.output_folder, self.size_limit,
+                                                    self.page_limit, self.use_packs)
             
-            # Get extracted image paths
+            # Report images as they are written so the grid can show them early
             extracted_images = []
-            if os.path.exists(self.output_folder):
-                image_paths = os.listdir(self.output_folder)
-                extracted_images = [os.path.join(self.output_folder, file) for file in image_paths 
-                                   if file.endswith(('.png', '.jpg', '.jpeg'))]
+            last_report = 0
+            for image_id, record in stream:
+                extracted_images.append(record["path"])
+                if time.time() - last_report >= 0.25:
+                    self.signals.progress.emit(len(extracted_images))
+                    last_report = time.time()
             
             self.signals.result.emit(extracted_images)
         except Exception as e:
@@ -50,8 +220,327 @@ class ImageExtractionWorker(QRunnable):
         finally:
             self.signals.finished.emit()
 
+class ExtractionPlanWorker(QRunnable):
+    """Estimates an extraction from PDF metadata without extracting anything."""
+    def __init__(self, dir_path, size_limit, page_limit, use_zotero=False):
+        super().__init__()
+        self.dir_path = dir_path
+        self.size_limit = size_limit
+        self.page_limit = page_limit
+        self.use_zotero = use_zotero
+        self.signals = WorkerSignals()
+
+    def run(self):
+        self.signals.started.emit()
+        try:
+            if self.use_zotero:
+                plan = plan_zotero(self.dir_path, self.size_limit, self.page_limit)
+            else:
+                plan = plan_directories([self.dir_path], self.size_limit, self.page_limit)
+            self.signals.result.emit(plan)
+        except Exception as e:
+            self.signals.error.emit(str(e))
+        finally:
+            self.signals.finished.emit()
+
+class TextBackfillWorker(QRunnable):
+    """Captures caption and page text for images extracted before text capture existed."""
+    def __init__(self):
+        super().__init__()
+        self.signals = WorkerSignals()
+
+    def run(self):
+        self.signals.started.emit()
+        try:
+            captured = backfill_page_context()
+            self.signals.progress.emit(captured)
+        except Exception as e:
+            self.signals.error.emit(str(e))
+        finally:
+            self.signals.finished.emit()
+
+class NearDuplicateReportWorker(QRunnable):
+    """Hashes any unhashed images, then writes the near-duplicate report."""
+    def __init__(self):
+        super().__init__()
+        self.signals = WorkerSignals()
+
+    def run(self):
+        self.signals.started.emit()
+        try:
+            backfill_perceptual_hashes()
+            groups = write_near_duplicate_report()
+            self.signals.progress.emit(groups)
+        except Exception as e:
+            self.signals.error.emit(str(e))
+        finally:
+            self.signals.finished.emit()
+
+class SimilarImageHashWorker(QRunnable):
+    """Hashes one image extracted before hashing existed, for Find Similar."""
+    def __init__(self, image_id, image_path):
+        super().__init__()
+        self.image_id = image_id
+        self.image_path = image_path
+        self.signals = WorkerSignals()
+
+    def run(self):
+        try:
+            with FITZ_LOCK:
+                _, phash = hash_image_file((self.image_id, self.image_path, None))
+            self.signals.result.emit([self.image_id, phash])
+        except Exception as e:
+            self.signals.error.emit(str(e))
+        finally:
+            self.signals.finished.emit()
+
+class RecompressWorker(QRunnable):
+    """Losslessly recompresses extracted PNGs at low priority until done or stopped."""
+    def __init__(self):
+        super().__init__()
+        self.stop_requested = threading.Event()
+        self.signals = WorkerSignals()
+
+    def run(self):
+        self.signals.started.emit()
+        try:
+            count, saved = recompress_pngs(progress_callback=self.signals.progress.emit,
+                                           should_stop=self.stop_requested.is_set)
+            self.signals.result.emit([count, saved])
+        except Exception as e:
+            self.signals.error.emit(str(e))
+        finally:
+            self.signals.finished.emit()
+
+class ImageExportWorker(QRunnable):
+    """Exports the selected images and their metadata into a folder."""
+    def __init__(self, selection, metadata, target_folder):
+        super().__init__()
+        self.selection = selection
+        self.metadata = metadata
+        self.target_folder = target_folder
+        self.signals = WorkerSignals()
+
+    def run(self):
+        self.signals.started.emit()
+        try:
+            records = {}
+            for image_id, img_path in self.selection.items():
+                record = dict(self.metadata.get(image_id, {}))
+                record["path"] = resolve_image_path(img_path)
+                records[image_id] = record
+            counts = export_images(records, self.target_folder, progress_callback=self.signals.progress.emit)
+            self.signals.counts.emit(counts)
+        except Exception as e:
+            self.signals.error.emit(str(e))
+        finally:
+            self.signals.finished.emit()
+
+class PrefetchWorker(QRunnable):
+    """
+    Decodes images into the cache before they are shown.
+
+    Runs at the lowest thread priority and gives up as soon as a newer
+    prefetch has been scheduled, i.e. once the user has moved elsewhere.
+    """
+    def __init__(self, cache, requests, generation, current_generation, decode=decode_image):
+        super().__init__()
+        self.cache = cache
+        self.requests = requests
+        self.generation = generation
+        self.current_generation = current_generation
+        self.decode = decode
+
+    def run(self):
+        QThread.currentThread().setPriority(QThread.LowestPriority)
+        for img_path, size in self.requests:
+            if self.current_generation() != self.generation:
+                return
+            if (img_path, size) in self.cache:
+                continue
+            try:
+                image = self.decode(img_path, size)
+            except Exception as e:
+                print(f"Error prefetching image {img_path}: {str(e)}")
+                continue
+            if not image.isNull():
+                self.cache.put((img_path, size), image)
+
+class TileSignals(QObject):
+    tile_ready = pyqtSignal(object, object)
+
+class TileLoader(QRunnable):
+    """Renders one tile of a TiledImageView, unless the view has moved on by the time it runs."""
+    def __init__(self, source, key, rect, zoom, wanted, signals):
+        super().__init__()
+        self.source = source
+        self.key = key
+        self.rect = rect
+        self.zoom = zoom
+        self.wanted = wanted
+        self.signals = signals
+
+    def run(self):
+        image = None
+        if self.key in self.wanted():
+            try:
+                image = self.source.render(*self.rect, self.zoom)
+            except Exception as e:
+                print(f"Error rendering tile {self.key}: {str(e)}")
+        self.signals.tile_ready.emit(self.key, image)
+
+class TiledImageView(QWidget):
+    """
+    Zoom and pan view over an image that is decoded tile by tile.
+
+    Tiles are rendered at the power-of-two level just above the current zoom,
+    and only those covering the viewport, so memory stays within the tile
+    cache however large the image is. A single tile of the whole image is
+    drawn underneath while the finer ones load.
+    """
+    MAX_ZOOM = 16
+
+    def __init__(self, source, parent=None):
+        super().__init__(parent)
+        self.source = source
+        self.tiles = ImageCache(TILE_CACHE_BYTES)
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(1)
+        self.signals = TileSignals()
+        self.signals.tile_ready.connect(self.tileReady)
+        self.pending = set()
+        self.wanted = set()
+        self.request_serial = 0
+        self.zoom = None
+        self.center = QPointF(source.width / 2, source.height / 2)
+        self.drag_position = None
+        # The coarsest level fits the whole image into one tile
+        self.min_level = min(0, math.floor(math.log2(TILE_SIZE / max(source.width, source.height))))
+        self.setMinimumSize(400, 400)
+        self.setCursor(Qt.OpenHandCursor)
+
+    def fitZoom(self):
+        return min(self.width() / self.source.width, self.height() / self.source.height)
+
+    def fitToView(self):
+        self.zoom = self.fitZoom()
+        self.center = QPointF(self.source.width / 2, self.source.height / 2)
+        self.update()
+
+    def actualSize(self):
+        self.zoom = 1.0
+        self.update()
+
+    def setZoom(self, zoom, anchor=None):
+        """Zoom to `zoom` display pixels per image pixel, keeping the image point under anchor in place."""
+        zoom = min(max(zoom, min(self.fitZoom(), 1.0) / 2), self.MAX_ZOOM)
+        if anchor is not None:
+            offset = QPointF(anchor.x() - self.width() / 2, anchor.y() - self.height() / 2)
+            point = self.center + offset / self.zoom
+            self.center = point - offset / zoom
+        self.zoom = zoom
+        self.update()
+
+    def levelFor(self, zoom):
+        # Past 100% the real pixels are scaled up instead of rendered larger
+        return max(min(0, math.ceil(math.log2(zoom))), self.min_level)
+
+    def tileRect(self, level, column, row):
+        span = TILE_SIZE / 2 ** level
+        x, y = int(column * span), int(row * span)
+        return (x, y, min(int((column + 1) * span), self.source.width) - x,
+                min(int((row + 1) * span), self.source.height) - y)
+
+    def requestTile(self, key):
+        if key in self.pending or key in self.tiles:
+            return
+        self.pending.add(key)
+        # Newer requests run first, they are for what is on screen now
+        self.request_serial += 1
+        level = key[0]
+        self.pool.start(TileLoader(self.source, key, self.tileRect(*key), 2 ** level,
+                                   lambda: self.wanted, self.signals), self.request_serial)
+
+    @pyqtSlot(object, object)
+    def tileReady(self, key, image):
+        self.pending.discard(key)
+        if image is not None and not image.isNull():
+            self.tiles.put(key, image)
+            self.update()
+
+    def paintEvent(self, event):
+        if self.zoom is None:
+            self.zoom = self.fitZoom()
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), QColor("#1e1e1e"))
+        painter.setRenderHint(QPainter.SmoothPixmapTransform)
+
+        left = self.center.x() - self.width() / 2 / self.zoom
+        top = self.center.y() - self.height() / 2 / self.zoom
+
+        def draw(key):
+            image = self.tiles.get(key)
+            if image is None:
+                return False
+            x, y, width, height = self.tileRect(*key)
+            target = QRectF((x - left) * self.zoom, (y - top) * self.zoom, width * self.zoom, height * self.zoom)
+            painter.drawImage(target, image, QRectF(image.rect()))
+            return True
+
+        overview = (self.min_level, 0, 0)
+        wanted = {overview}
+        draw(overview)
+        level = self.levelFor(self.zoom)
+        if level != self.min_level:
+            span = TILE_SIZE / 2 ** level
+            right = min(left + self.width() / self.zoom, self.source.width)
+            bottom = min(top + self.height() / self.zoom, self.source.height)
+            for row in range(max(int(top // span), 0), int(math.ceil(bottom / span))):
+                for column in range(max(int(left // span), 0), int(math.ceil(right / span))):
+                    key = (level, column, row)
+                    wanted.add(key)
+                    draw(key)
+        self.wanted = wanted
+        painter.end()
+
+        for key in wanted:
+            self.requestTile(key)
+
+    def wheelEvent(self, event):
+        self.setZoom(self.zoom * 1.25 ** (event.angleDelta().y() / 120), event.pos())
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.LeftButton:
+            self.drag_position = event.pos()
+            self.setCursor(Qt.ClosedHandCursor)
+
+    def mouseMoveEvent(self, event):
+        if self.drag_position is not None:
+            delta = event.pos() - self.drag_position
+            self.drag_position = event.pos()
+            self.center -= QPointF(delta) / self.zoom
+            self.update()
+
+    def mouseReleaseEvent(self, event):
+        self.drag_position = None
+        self.setCursor(Qt.OpenHandCursor)
+
+    def mouseDoubleClickEvent(self, event):
+        # Toggle between the whole image and its real pixels
+        if abs(self.zoom - 1.0) < 1e-6:
+            self.fitToView()
+        else:
+            self.setZoom(1.0, event.pos())
+
+    def release(self):
+        """Stop rendering and close the image source."""
+        self.wanted = set()
+        self.pool.clear()
+        self.pool.waitForDone()
+        self.source.close()
+
 class ImagePreviewDialog(QDialog):
-    def __init__(self, image_path, parent=None):
+    def __init__(self, image_path, parent=None, record=None):
         super(ImagePreviewDialog, self).__init__(parent)
         self.setWindowTitle("Image Preview")
         self.setStyleSheet("""
@@ -77,28 +566,22 @@ class ImagePreviewDialog(QDialog):
         layout.setContentsMargins(20, 20, 20, 20)
         layout.setSpacing(15)
 
-        # Load and display the image
-        if os.path.exists(image_path):
-            pixmap = QPixmap(image_path)
-            self.image_label = QLabel()
-            self.image_label.setAlignment(Qt.AlignCenter)
-            self.image_label.setPixmap(pixmap.scaled(650, 650, Qt.KeepAspectRatio, Qt.SmoothTransformation))
-            
-            # Add a scrollable area for large images
-            scroll_area = QScrollArea()
-            scroll_area.setWidgetResizable(True)
-            scroll_area.setWidget(self.image_label)
-            layout.addWidget(scroll_area)
+        # Display the image in a tiled view that only decodes what is visible;
+        # images in packs are read from a memory map
+        source = open_tile_source(image_path, record)
+        self.image_view = None
+        if source is not None:
+            self.image_view = TiledImageView(source)
+            layout.addWidget(self.image_view)
 
             # Information about the image
             info_layout = QHBoxLayout()
-            size_label = QLabel(f"Size: {pixmap.width()}x{pixmap.height()} pixels")
+            size_label = QLabel(f"Size: {source.width}x{source.height} pixels")
             size_label.setStyleSheet("color: #cccccc; font-style: italic;")
             info_layout.addWidget(size_label)
             
             # Add file size info
-            file_info = os.stat(image_path)
-            file_size = file_info.st_size / 1024  # KB
+            file_size = ((record or {}).get("size_bytes") or len(read_image_bytes(image_path) or b"")) / 1024  # KB
             if file_size > 1024:
                 file_size = f"{file_size/1024:.2f} MB"
             else:
@@ -107,6 +590,11 @@ class ImagePreviewDialog(QDialog):
             file_size_label.setStyleSheet("color: #cccccc; font-style: italic;")
             info_layout.addWidget(file_size_label)
             
+            hint_label = QLabel("Scroll to zoom, drag to pan, double-click for actual size")
+            hint_label.setStyleSheet("color: #cccccc; font-style: italic;")
+            info_layout.addStretch()
+            info_layout.addWidget(hint_label)
+            
             layout.addLayout(info_layout)
         else:
             error_label = QLabel("Image file not found or cannot be opened")
@@ -124,12 +612,27 @@ class ImagePreviewDialog(QDialog):
         copy_path_button = QPushButton("Copy Image Path")
         copy_path_button.clicked.connect(lambda: QApplication.clipboard().setText(image_path))
         
+        if self.image_view is not None:
+            fit_button = QPushButton("Fit")
+            fit_button.clicked.connect(self.image_view.fitToView)
+            actual_size_button = QPushButton("100%")
+            actual_size_button.clicked.connect(self.image_view.actualSize)
+            button_layout.addWidget(fit_button)
+            button_layout.addWidget(actual_size_button)
+        
         button_layout.addStretch()
         button_layout.addWidget(copy_path_button)
         button_layout.addWidget(close_button)
         
         layout.addLayout(button_layout)
 
+    def done(self, result):
+        # Stop tile rendering and release the decoder before the dialog goes away
+        if self.image_view is not None:
+            self.image_view.release()
+            self.image_view = None
+        super().done(result)
+
 
 class ClickableLabel(QLabel):
     clicked = pyqtSignal()
@@ -184,11 +687,22 @@ class ImageGrid(QWidget):
         self.threadpool = QThreadPool()
         self.max_label_size = 150
         self.thumbnail_size = QSize(self.max_label_size, self.max_label_size)
-        self.image_cache = {}
+        self.image_cache = ImageCache()
+        self.prefetch_pool = QThreadPool()
+        self.prefetch_pool.setMaxThreadCount(2)
+        self.prefetch_generation = 0
+        self.adjacent_page_paths = []
         self.use_thumbnails = True
         self.selected_label = None
+        # Images picked for export, image_id -> path; kept across pages
+        self.selected_images = {}
+        self.selection_anchor = None
         self.page = 0
         self.page_size = 40
+        self.filters = {}
+        self.sort_column = "extraction_date"
+        self.sort_descending = False
+        self.total_images = 0
         
         # Set dark theme application-wide
         self.setStyleSheet("""
@@ -212,7 +726,7 @@ class ImageGrid(QWidget):
                 background-color: #555555;
                 color: #aaaaaa;
             }
-            QLineEdit, QScrollArea {
+            QLineEdit, QScrollArea, QComboBox, QListWidget {
                 background-color: #2d2d30;
                 border: 1px solid #3f3f46;
                 border-radius: 4px;
@@ -251,12 +765,10 @@ class ImageGrid(QWidget):
         else:
             self.metadata = {}
 
-        if os.path.exists(extraction_path):
-            image_paths = os.listdir(extraction_path)
-            self.extracted_image_paths = [os.path.join(extraction_path, file) for file in image_paths 
-                                        if file.endswith(('.png', '.jpg', '.jpeg'))]
-        else:
-            self.extracted_image_paths = []
+        # The grid pages through the index rather than the directory listing
+        self.index = ImageIndex()
+        self.index.sync_from_metadata("images_metadata.json", self.metadata)
+        self.extracted_image_paths = []
             
         self.image_paths = extraction_path
         self.initUI()
@@ -295,6 +807,11 @@ class ImageGrid(QWidget):
         extract.clicked.connect(self.extractImages)
         extraction_layout.addWidget(extract)
         
+        self.plan_button = QPushButton('Plan', self)
+        self.plan_button.setToolTip("Estimate image count, disk usage and time without extracting")
+        self.plan_button.clicked.connect(self.planExtraction)
+        extraction_layout.addWidget(self.plan_button)
+        
         self.size_limit_input = QLineEdit(self)
         self.size_limit_input.setPlaceholderText("Size Limit (KB)")
         self.size_limit_input.setText("1000")
@@ -305,6 +822,16 @@ class ImageGrid(QWidget):
         self.page_limit_input.setText("50")
         extraction_layout.addWidget(self.page_limit_input)
         
+        self.zotero_toggle = QCheckBox("Zotero Library", self)
+        self.zotero_toggle.setToolTip("Treat the selected directory as a Zotero data directory "
+                                      "and read its PDF attachments from zotero.sqlite")
+        extraction_layout.addWidget(self.zotero_toggle)
+        
+        self.pack_toggle = QCheckBox("Pack Files", self)
+        self.pack_toggle.setToolTip("Append extracted images to a few large pack files "
+                                    "instead of writing one file per image")
+        extraction_layout.addWidget(self.pack_toggle)
+        
         grid_layout.addLayout(extraction_layout)
         
         # Progress bar for extraction (hidden initially)
@@ -332,6 +859,9 @@ class ImageGrid(QWidget):
         self.status_label.setVisible(False)
         grid_layout.addWidget(self.status_label)
         
+        # Filter and sort bar
+        grid_layout.addWidget(self.createFilterBar())
+        
         # Sidebar for full-size image display and info
         sidebar = QWidget()
         sidebar_layout = QVBoxLayout(sidebar)
@@ -396,6 +926,13 @@ class ImageGrid(QWidget):
         self.preview_button.clicked.connect(lambda: self.openPreviewDialog(self.address_field.text()) if self.address_field.text() else None)
         self.preview_button.setEnabled(False)
         sidebar_layout.addWidget(self.preview_button)
+        
+        # Find similar button
+        self.similar_button = QPushButton("Find Similar", self)
+        self.similar_button.setIcon(self.style().standardIcon(QStyle.SP_FileDialogDetailedView))
+        self.similar_button.clicked.connect(self.findSimilarImages)
+        self.similar_button.setEnabled(False)
+        sidebar_layout.addWidget(self.similar_button)
 
         # Form layout for metadata
         metadata_title = QLabel("Metadata")
@@ -407,6 +944,79 @@ class ImageGrid(QWidget):
         self.info_form.setSpacing(8)
         sidebar_layout.addWidget(self.info_form_widget)
         
+        # Ranked full-text search over captions and page text
+        search_title = QLabel("Caption Search")
+        search_title.setStyleSheet("font-weight: bold; margin-top: 15px;")
+        sidebar_layout.addWidget(search_title)
+        
+        self.text_search_timer = QTimer(self)
+        self.text_search_timer.setSingleShot(True)
+        self.text_search_timer.setInterval(150)
+        self.text_search_timer.timeout.connect(self.runTextSearch)
+        
+        self.text_search_input = QLineEdit(self)
+        self.text_search_input.setPlaceholderText("Search captions and page text...")
+        self.text_search_input.textChanged.connect(self.text_search_timer.start)
+        sidebar_layout.addWidget(self.text_search_input)
+        
+        self.text_search_results = QListWidget(self)
+        self.text_search_results.setMaximumHeight(150)
+        self.text_search_results.itemClicked.connect(self.onSearchResultClicked)
+        sidebar_layout.addWidget(self.text_search_results)
+        
+        self.backfill_button = QPushButton("Index Text of Existing Images", self)
+        self.backfill_button.setToolTip("Capture captions and page text for images extracted earlier")
+        self.backfill_button.clicked.connect(self.backfillText)
+        sidebar_layout.addWidget(self.backfill_button)
+        
+        # Perceptual-hash matches for the selected image
+        similar_title = QLabel("Similar Images")
+        similar_title.setStyleSheet("font-weight: bold; margin-top: 15px;")
+        sidebar_layout.addWidget(similar_title)
+        
+        self.similar_results = QListWidget(self)
+        self.similar_results.setMaximumHeight(120)
+        self.similar_results.itemClicked.connect(self.onSearchResultClicked)
+        sidebar_layout.addWidget(self.similar_results)
+        
+        self.duplicate_report_button = QPushButton("Near-Duplicate Report", self)
+        self.duplicate_report_button.setToolTip(f"Group near-duplicate images into {NEAR_DUPLICATE_REPORT_PATH}")
+        self.duplicate_report_button.clicked.connect(self.writeDuplicateReport)
+        sidebar_layout.addWidget(self.duplicate_report_button)
+        
+        self.recompress_worker = None
+        self.recompress_button = QPushButton("Recompress PNGs", self)
+        self.recompress_button.setToolTip("Shrink extracted PNGs losslessly in the background; can be stopped and resumed")
+        self.recompress_button.clicked.connect(self.toggleRecompression)
+        sidebar_layout.addWidget(self.recompress_button)
+        
+        # Bulk export of the images selected with Ctrl/Shift-click
+        export_title = QLabel("Export")
+        export_title.setStyleSheet("font-weight: bold; margin-top: 15px;")
+        sidebar_layout.addWidget(export_title)
+        
+        self.selection_label = QLabel("No images selected")
+        self.selection_label.setStyleSheet("color: #cccccc; font-style: italic;")
+        sidebar_layout.addWidget(self.selection_label)
+        
+        selection_layout = QHBoxLayout()
+        select_matching_button = QPushButton("Select All Matching", self)
+        select_matching_button.setToolTip("Select every image that matches the current filters")
+        select_matching_button.clicked.connect(self.selectAllMatching)
+        selection_layout.addWidget(select_matching_button)
+        
+        clear_selection_button = QPushButton("Clear Selection", self)
+        clear_selection_button.clicked.connect(self.clearSelection)
+        selection_layout.addWidget(clear_selection_button)
+        sidebar_layout.addLayout(selection_layout)
+        
+        self.export_button = QPushButton("Export Selected...", self)
+        self.export_button.setIcon(self.style().standardIcon(QStyle.SP_DialogSaveButton))
+        self.export_button.setToolTip("Link or copy the selected images into a folder with a metadata manifest")
+        self.export_button.clicked.connect(self.exportSelected)
+        self.export_button.setEnabled(False)
+        sidebar_layout.addWidget(self.export_button)
+        
         # Add stretch to push everything up
         sidebar_layout.addStretch(1)
 
@@ -455,6 +1065,280 @@ class ImageGrid(QWidget):
         # Now we can safely call updateGrid
         self.updateGrid()
         
+    def createFilterBar(self):
+        filter_widget = QWidget()
+        filter_layout = QGridLayout(filter_widget)
+        filter_layout.setContentsMargins(0, 0, 0, 0)
+        filter_layout.setSpacing(6)
+        self.filter_inputs = {}
+        
+        # Re-query shortly after the user stops typing rather than on every key
+        self.filter_timer = QTimer(self)
+        self.filter_timer.setSingleShot(True)
+        self.filter_timer.setInterval(150)
+        self.filter_timer.timeout.connect(self.applyFilters)
+        
+        filter_layout.addWidget(QLabel("PDF:"), 0, 0)
+        pdf_input = QLineEdit(self)
+        pdf_input.setPlaceholderText("Source PDF contains...")
+        pdf_input.textChanged.connect(self.filter_timer.start)
+        self.filter_inputs["pdf"] = pdf_input
+        filter_layout.addWidget(pdf_input, 0, 1, 1, 3)
+        
+        filter_layout.addWidget(QLabel("Type:"), 0, 4)
+        self.type_filter = QComboBox(self)
+        self.refreshTypeFilter()
+        self.type_filter.currentIndexChanged.connect(self.filter_timer.start)
+        filter_layout.addWidget(self.type_filter, 0, 5, 1, 2)
+        
+        filter_layout.addWidget(QLabel("Sort:"), 0, 7)
+        self.sort_combo = QComboBox(self)
+        self.sort_combo.addItems(list(SORT_COLUMNS.keys()))
+        self.sort_combo.currentIndexChanged.connect(self.applyFilters)
+        filter_layout.addWidget(self.sort_combo, 0, 8, 1, 2)
+        
+        self.sort_order_button = QPushButton("Asc", self)
+        self.sort_order_button.setCheckable(True)
+        self.sort_order_button.toggled.connect(self.applyFilters)
+        filter_layout.addWidget(self.sort_order_button, 0, 10)
+        
+        ranges = [
+            ("Pages:", "page_min", "page_max", "min", "max", QIntValidator(0, 1000000, self)),
+            ("Size (KB):", "size_min", "size_max", "min", "max", QIntValidator(0, 10000000, self)),
+            ("Width:", "width_min", "width_max", "min", "max", QIntValidator(0, 1000000, self)),
+            ("Height:", "height_min", "height_max", "min", "max", QIntValidator(0, 1000000, self)),
+            ("Date:", "date_from", "date_to", "YYYY-MM-DD", "YYYY-MM-DD", None),
+        ]
+        for i, (title, key_min, key_max, hint_min, hint_max, validator) in enumerate(ranges):
+            row = 1 + i // 3
+            col = (i % 3) * 4
+            filter_layout.addWidget(QLabel(title), row, col)
+            for offset, key, hint in ((1, key_min, hint_min), (2, key_max, hint_max)):
+                range_input = QLineEdit(self)
+                range_input.setPlaceholderText(hint)
+                if validator is not None:
+                    range_input.setValidator(validator)
+                range_input.textChanged.connect(self.filter_timer.start)
+                self.filter_inputs[key] = range_input
+                filter_layout.addWidget(range_input, row, col + offset)
+        
+        return filter_widget
+
+    def applyFilters(self):
+        filters = {key: field.text().strip() for key, field in self.filter_inputs.items()}
+        
+        # Sizes are entered in KB like the extraction size limit
+        for key in ("size_min", "size_max"):
+            if filters[key]:
+                filters[key] = int(filters[key]) * 1024
+        
+        if self.type_filter.currentText() != "Any":
+            filters["image_type"] = self.type_filter.currentText()
+        
+        self.filters = filters
+        self.sort_column = SORT_COLUMNS[self.sort_combo.currentText()]
+        self.sort_descending = self.sort_order_button.isChecked()
+        self.sort_order_button.setText("Desc" if self.sort_descending else "Asc")
+        self.page = 0
+        self.updateGrid()
+
+    def runTextSearch(self):
+        self.text_search_results.clear()
+        for image_id, img_path, snippet in self.index.search_text(self.text_search_input.text()):
+            record = self.metadata.get(image_id, {})
+            label = f"{record.get('file_name', '')} p.{record.get('page_number', '?')}: {snippet}"
+            item = QListWidgetItem(label)
+            item.setToolTip(snippet)
+            item.setData(Qt.UserRole, img_path)
+            self.text_search_results.addItem(item)
+
+    def onSearchResultClicked(self, item):
+        self.onImageClicked(item.data(Qt.UserRole), None)
+
+    def backfillText(self):
+        self.backfill_button.setEnabled(False)
+        self.status_label.setText("Indexing captions and page text of existing images...")
+        self.status_label.setStyleSheet("color: #cccccc; font-style: italic;")
+        self.status_label.setVisible(True)
+        
+        worker = TextBackfillWorker()
+        worker.signals.progress.connect(self.backfill_finished)
+        worker.signals.error.connect(self.extraction_error)
+        worker.signals.finished.connect(lambda: self.backfill_button.setEnabled(True))
+        self.threadpool.start(worker)
+
+    @pyqtSlot(int)
+    def backfill_finished(self, captured):
+        self.metadata = self.load_metadata("images_metadata.json")
+        self.status_label.setText(f"Indexed text for {captured} images.")
+        self.runTextSearch()
+
+    def findSimilarImages(self):
+        img_path = self.address_field.text()
+        if not img_path:
+            return
+        image_id = os.path.splitext(os.path.basename(img_path))[0]
+        record = self.metadata.get(image_id, {})
+        
+        self.similar_results.clear()
+        if record.get("phash"):
+            self.showSimilarImages([image_id, record["phash"]])
+            return
+        
+        # Images extracted before hashing existed are hashed in the background;
+        # huge ones are left to the background pass, which hashes them from their PDF
+        if (record.get("width") or 0) * (record.get("height") or 0) > HASH_MAX_PIXELS:
+            self.similar_results.addItem("Too large to hash here, run the Near-Duplicate Report first")
+            return
+        self.similar_results.addItem("Hashing image...")
+        self.similar_button.setEnabled(False)
+        worker = SimilarImageHashWorker(image_id, img_path)
+        worker.signals.result.connect(self.showSimilarImages)
+        worker.signals.error.connect(self.extraction_error)
+        worker.signals.finished.connect(lambda: self.similar_button.setEnabled(bool(self.address_field.text())))
+        self.threadpool.start(worker)
+
+    @pyqtSlot(list)
+    def showSimilarImages(self, result):
+        image_id, phash = result
+        # Another image may have been selected while this one was hashed
+        if os.path.splitext(os.path.basename(self.address_field.text()))[0] != image_id:
+            return
+        
+        self.similar_results.clear()
+        if not phash:
+            self.similar_results.addItem("Could not hash this image")
+            return
+        
+        for other_id, other_path, distance in self.index.similar_images(phash):
+            if other_id == image_id:
+                continue
+            record = self.metadata.get(other_id, {})
+            item = QListWidgetItem(f"[{distance}] {record.get('file_name', '')} p.{record.get('page_number', '?')}")
+            item.setToolTip(other_path)
+            item.setData(Qt.UserRole, other_path)
+            self.similar_results.addItem(item)
+        if self.similar_results.count() == 0:
+            self.similar_results.addItem("No similar images found")
+
+    def writeDuplicateReport(self):
+        self.duplicate_report_button.setEnabled(False)
+        self.status_label.setText("Hashing images and grouping near-duplicates...")
+        self.status_label.setStyleSheet("color: #cccccc; font-style: italic;")
+        self.status_label.setVisible(True)
+        
+        worker = NearDuplicateReportWorker()
+        worker.signals.progress.connect(self.duplicate_report_finished)
+        worker.signals.error.connect(self.extraction_error)
+        worker.signals.finished.connect(lambda: self.duplicate_report_button.setEnabled(True))
+        self.threadpool.start(worker)
+
+    @pyqtSlot(int)
+    def duplicate_report_finished(self, groups):
+        self.metadata = self.load_metadata("images_metadata.json")
+        self.status_label.setText(f"Found {groups} near-duplicate groups, see {NEAR_DUPLICATE_REPORT_PATH}.")
+
+    def toggleRecompression(self):
+        if self.recompress_worker is not None:
+            # Stops after the image being worked on; the rest is kept for the next run
+            self.recompress_worker.stop_requested.set()
+            self.recompress_button.setEnabled(False)
+            return
+        
+        self.recompress_button.setText("Stop Recompressing")
+        self.status_label.setText("Recompressing PNGs in the background...")
+        self.status_label.setStyleSheet("color: #cccccc; font-style: italic;")
+        self.status_label.setVisible(True)
+        
+        self.recompress_worker = RecompressWorker()
+        self.recompress_worker.signals.progress.connect(
+            lambda count: self.status_label.setText(f"Recompressed {count} PNGs..."))
+        self.recompress_worker.signals.result.connect(self.recompression_finished)
+        self.recompress_worker.signals.error.connect(self.extraction_error)
+        self.recompress_worker.signals.finished.connect(self.recompression_stopped)
+        self.threadpool.start(self.recompress_worker)
+
+    @pyqtSlot(list)
+    def recompression_finished(self, result):
+        count, saved = result
+        self.metadata = self.load_metadata("images_metadata.json")
+        self.status_label.setText(f"Recompressed {count} PNGs, saved {saved / (1024 * 1024):.1f} MB.")
+
+    @pyqtSlot()
+    def recompression_stopped(self):
+        self.recompress_worker = None
+        self.recompress_button.setText("Recompress PNGs")
+        self.recompress_button.setEnabled(True)
+
+    def selectionChanged(self):
+        count = len(self.selected_images)
+        self.selection_label.setText(f"{count} images selected" if count else "No images selected")
+        self.export_button.setEnabled(count > 0)
+        for i in range(self.grid.count()):
+            label = self.grid.itemAt(i).widget()
+            if isinstance(label, ClickableLabel):
+                try:
+                    label.setSelected(label.image_id in self.selected_images)
+                except RuntimeError:
+                    # Label was deleted, just ignore
+                    pass
+
+    def selectAllMatching(self):
+        for image_id, img_path in self.index.iter_matching(self.filters):
+            self.selected_images[image_id] = img_path
+        self.selectionChanged()
+
+    def clearSelection(self):
+        self.selected_images = {}
+        self.selection_anchor = None
+        self.selectionChanged()
+
+    def updateSelection(self, img_path):
+        # Ctrl toggles one image, Shift extends from the last click across the page
+        image_id = os.path.splitext(os.path.basename(img_path))[0]
+        modifiers = QApplication.keyboardModifiers()
+        paths = self.extracted_image_paths
+        if modifiers & Qt.ShiftModifier and self.selection_anchor in paths and img_path in paths:
+            start, end = sorted((paths.index(self.selection_anchor), paths.index(img_path)))
+            for path in paths[start:end + 1]:
+                self.selected_images[os.path.splitext(os.path.basename(path))[0]] = path
+            return
+        if modifiers & Qt.ControlModifier:
+            if self.selected_images.pop(image_id, None) is None:
+                self.selected_images[image_id] = img_path
+        else:
+            self.selected_images = {image_id: img_path}
+        self.selection_anchor = img_path
+
+    def exportSelected(self):
+        if not self.selected_images:
+            return
+        target_folder = QFileDialog.getExistingDirectory(self, "Select Export Folder")
+        if not target_folder:
+            return
+        
+        self.export_button.setEnabled(False)
+        self.status_label.setText(f"Exporting {len(self.selected_images)} images...")
+        self.status_label.setStyleSheet("color: #cccccc; font-style: italic;")
+        self.status_label.setVisible(True)
+        
+        worker = ImageExportWorker(dict(self.selected_images), self.metadata, target_folder)
+        worker.signals.progress.connect(lambda exported: self.status_label.setText(f"Exported {exported} images..."))
+        worker.signals.counts.connect(self.export_finished)
+        worker.signals.error.connect(self.extraction_error)
+        worker.signals.finished.connect(lambda: self.export_button.setEnabled(bool(self.selected_images)))
+        self.threadpool.start(worker)
+
+    @pyqtSlot(dict)
+    def export_finished(self, counts):
+        exported = sum(count for method, count in counts.items() if method != "failed")
+        methods = ", ".join(f"{count} {method}" for method, count in counts.items()
+                            if count and method != "failed")
+        message = f"Exported {exported} images ({methods})." if exported else "No images exported."
+        if counts["failed"]:
+            message += f" {counts['failed']} failed."
+        self.status_label.setText(message)
+
     def load_metadata(self, metadata_path):
         try:
             with open(metadata_path, 'r') as f:
@@ -469,6 +1353,38 @@ class ImageGrid(QWidget):
             self.dir_path = dir_path
             self.show_path.setText(f"Selected directory: {dir_path}")
 
+    def planExtraction(self):
+        if not hasattr(self, 'dir_path') or not self.dir_path:
+            QMessageBox.warning(self, "No Directory Selected", 
+                               "Please select a directory first.")
+            return
+        
+        try:
+            size_limit = int(self.size_limit_input.text()) * 1024  # KB to bytes
+            page_limit = int(self.page_limit_input.text())
+        except ValueError:
+            QMessageBox.warning(self, "Invalid Input", 
+                               "Please enter valid numbers for size and page limits.")
+            return
+        
+        self.plan_button.setEnabled(False)
+        self.status_label.setText("Inspecting PDFs...")
+        self.status_label.setStyleSheet("color: #cccccc; font-style: italic;")
+        self.status_label.setVisible(True)
+        
+        worker = ExtractionPlanWorker(self.dir_path, size_limit, page_limit, self.zotero_toggle.isChecked())
+        worker.signals.result.connect(self.plan_finished)
+        worker.signals.error.connect(self.extraction_error)
+        worker.signals.finished.connect(lambda: self.plan_button.setEnabled(True))
+        self.threadpool.start(worker)
+
+    @pyqtSlot(list)
+    def plan_finished(self, plan):
+        total = plan[-1]
+        self.status_label.setText(f"Plan: {total['images']} images, "
+                                  f"{total['bytes'] / (1024 * 1024):.1f} MB.")
+        QMessageBox.information(self, "Extraction Plan", format_plan(plan))
+
     def extractImages(self):
         if not hasattr(self, 'dir_path') or not self.dir_path:
             QMessageBox.warning(self, "No Directory Selected", 
@@ -492,27 +1408,49 @@ class ImageGrid(QWidget):
         self.path_button.setEnabled(False)
         self.size_limit_input.setEnabled(False)
         self.page_limit_input.setEnabled(False)
+        self.zotero_toggle.setEnabled(False)
+        self.pack_toggle.setEnabled(False)
         
         # Reset selected label to avoid reference to deleted object
         self.selected_label = None
         
         # Create and start the worker
         output_folder = 'extracted_images'
-        worker = ImageExtractionWorker(self.dir_path, output_folder, size_limit, page_limit)
+        worker = ImageExtractionWorker(self.dir_path, output_folder, size_limit, page_limit,
+                                       self.zotero_toggle.isChecked(), self.pack_toggle.isChecked())
         
         # Connect signals
         worker.signals.started.connect(self.extraction_started)
         worker.signals.finished.connect(self.extraction_finished)
         worker.signals.error.connect(self.extraction_error)
         worker.signals.result.connect(self.update_extracted_images)
+        worker.signals.progress.connect(self.extraction_progress)
         
         # Start the extraction in a background thread
         self.threadpool.start(worker)
 
+    def refreshTypeFilter(self):
+        # Offer the image types present in the index, keeping the current choice
+        current = self.type_filter.currentText() or "Any"
+        self.type_filter.blockSignals(True)
+        self.type_filter.clear()
+        self.type_filter.addItems(["Any"] + self.index.image_types())
+        self.type_filter.setCurrentIndex(max(self.type_filter.findText(current), 0))
+        self.type_filter.blockSignals(False)
+
     @pyqtSlot()
     def extraction_started(self):
         print("Extraction started")
         
+    @pyqtSlot(int)
+    def extraction_progress(self, extracted):
+        self.status_label.setText(f"Extracting images... {extracted} so far.")
+        # New images are already in the index; refresh the grid unless the
+        # user is looking at a selected image
+        if self.selected_label is None and not self.address_field.text():
+            self.index.clear_caches()
+            self.updateGrid()
+
     @pyqtSlot()
     def extraction_finished(self):
         self.progress_bar.setVisible(False)
@@ -522,6 +1460,8 @@ class ImageGrid(QWidget):
         self.path_button.setEnabled(True)
         self.size_limit_input.setEnabled(True)
         self.page_limit_input.setEnabled(True)
+        self.zotero_toggle.setEnabled(True)
+        self.pack_toggle.setEnabled(True)
         
     @pyqtSlot(str)
     def extraction_error(self, error_msg):
@@ -533,21 +1473,25 @@ class ImageGrid(QWidget):
         self.path_button.setEnabled(True)
         self.size_limit_input.setEnabled(True)
         self.page_limit_input.setEnabled(True)
+        self.zotero_toggle.setEnabled(True)
+        self.pack_toggle.setEnabled(True)
     
     @pyqtSlot(list)
     def update_extracted_images(self, extracted_images):
-        self.extracted_image_paths = extracted_images
+        # Reload metadata
+        if os.path.exists("images_metadata.json"):
+            self.metadata = self.load_metadata("images_metadata.json")
+            self.index.sync_from_metadata("images_metadata.json", self.metadata)
+        self.index.clear_caches()
+        self.refreshTypeFilter()
+        
         self.page = 0  # Reset to first page
         # Clear any stored references to UI elements before updating the grid
         self.selected_label = None
         self.updateGrid()  # Refresh the grid with new images
-        
-        # Reload metadata
-        if os.path.exists("images_metadata.json"):
-            self.metadata = self.load_metadata("images_metadata.json")
             
         # Show count of extracted images
-        self.status_label.setText(f"Extracted {len(self.extracted_image_paths)} images.")
+        self.status_label.setText(f"Extracted {len(extracted_images)} images.")
 
     def wheelEvent(self, event):
         if event.modifiers() & Qt.ControlModifier:
@@ -564,8 +1508,8 @@ class ImageGrid(QWidget):
             super().wheelEvent(event)
 
     def openPreviewDialog(self, img_path):
-        if img_path and os.path.exists(img_path):
-            dialog = ImagePreviewDialog(img_path, self)
+        if img_path and image_exists(img_path):
+            dialog = ImagePreviewDialog(img_path, self, self.recordFor(img_path))
             dialog.exec_()
 
     def toggleThumbnails(self, state):
@@ -584,29 +1528,64 @@ class ImageGrid(QWidget):
             self.status_label.setStyleSheet("color: #4CAF50;")
             self.status_label.setVisible(True)
 
-    def load_image(self, img_path):
-        if not os.path.exists(img_path):
+    def recordFor(self, img_path):
+        """Return the metadata record of an image path, or None."""
+        return self.metadata.get(os.path.splitext(os.path.basename(img_path))[0])
+
+    def decodeImage(self, img_path, size):
+        return decode_image(img_path, size, self.recordFor(img_path))
+
+    def load_image(self, img_path, size=THUMBNAIL_SIZE):
+        """Return a pixmap of an image shrunk to fit size x size, decoding it unless it is cached."""
+        if not image_exists(img_path):
             # Return a placeholder for missing images
             placeholder = QPixmap(self.max_label_size, self.max_label_size)
             placeholder.fill(Qt.gray)
             return placeholder
             
-        if img_path not in self.image_cache:
+        image = self.image_cache.get((img_path, size))
+        if image is None:
             try:
-                image = QPixmap(img_path)
-                if not image.isNull():
-                    self.image_cache[img_path] = image
-                else:
-                    # Return a placeholder for corrupted images
-                    placeholder = QPixmap(self.max_label_size, self.max_label_size)
-                    placeholder.fill(Qt.red)
-                    self.image_cache[img_path] = placeholder
+                image = self.decodeImage(img_path, size)
             except Exception as e:
                 print(f"Error loading image {img_path}: {str(e)}")
+                image = QImage()
+            if image.isNull():
+                # Return a placeholder for corrupted images
                 placeholder = QPixmap(self.max_label_size, self.max_label_size)
                 placeholder.fill(Qt.red)
-                self.image_cache[img_path] = placeholder
-        return self.image_cache[img_path]
+                return placeholder
+            self.image_cache.put((img_path, size), image)
+        return QPixmap.fromImage(image)
+
+    def schedulePrefetch(self, requests):
+        """Replace any pending prefetch with decoding the given (path, size) requests."""
+        self.prefetch_generation += 1
+        self.prefetch_pool.clear()
+        if requests:
+            self.prefetch_pool.start(PrefetchWorker(self.image_cache, requests, self.prefetch_generation,
+                                                    lambda: self.prefetch_generation, self.decodeImage))
+
+    def prefetchAdjacentPages(self):
+        # Paging forward is the common case, so the next page comes first
+        self.adjacent_page_paths = []
+        for page in (self.page + 1, self.page - 1):
+            if page < 0 or (page * self.page_size >= self.total_images and self.total_images < COUNT_LIMIT):
+                continue
+            self.adjacent_page_paths.extend(resolve_image_path(path) for _, path in self.index.query(
+                self.filters, self.sort_column, self.sort_descending,
+                page * self.page_size, self.page_size, self.total_images))
+        self.schedulePrefetch([(path, THUMBNAIL_SIZE) for path in self.adjacent_page_paths])
+
+    def prefetchNeighborPreviews(self, img_path):
+        # After a selection the next click usually lands on a neighbour
+        paths = self.extracted_image_paths
+        neighbors = []
+        if img_path in paths:
+            position = paths.index(img_path)
+            neighbors = [paths[i] for i in (position + 1, position - 1) if 0 <= i < len(paths)]
+        self.schedulePrefetch([(path, PREVIEW_SIZE) for path in neighbors] +
+                              [(path, THUMBNAIL_SIZE) for path in self.adjacent_page_paths])
 
     def updateGrid(self):
         # Clear existing grid and reset selected label
@@ -619,32 +1598,40 @@ class ImageGrid(QWidget):
         self.full_size_image_label.clear()
         self.address_field.clear()
         self.preview_button.setEnabled(False)
+        self.similar_button.setEnabled(False)
         
         # Clear form layout
         while self.info_form.rowCount() > 0:
             self.info_form.removeRow(0)
 
+        # Fetch the current page from the index
+        self.total_images = self.index.count(self.filters, COUNT_LIMIT)
+        self.extracted_image_paths = [resolve_image_path(path) for _, path in self.index.query(
+            self.filters, self.sort_column, self.sort_descending,
+            self.page * self.page_size, self.page_size, self.total_images)]
+        
         image_paths_to_display = self.extracted_image_paths
         if not image_paths_to_display:
             # Show a message when no images are available
-            no_images_label = QLabel("No images available.\nSelect a directory and click 'Extract' to begin.")
+            if any(self.filters.values()):
+                no_images_label = QLabel("No images match the current filters.")
+            else:
+                no_images_label = QLabel("No images available.\nSelect a directory and click 'Extract' to begin.")
             no_images_label.setStyleSheet("color: #cccccc; font-size: 14px;")
             no_images_label.setAlignment(Qt.AlignCenter)
             self.grid.addWidget(no_images_label, 0, 0)
             self.page_number_label.setText("Page 0 of 0")
+            self.schedulePrefetch([])
             return
-            
-        start = self.page * self.page_size
-        end = min(start + self.page_size, len(image_paths_to_display))
 
         container_width = self.grid.parent().width() or 600
         self.num_images_per_row = max(container_width // (self.max_label_size + 20), 1)
 
-        for i, img_path in enumerate(image_paths_to_display[start:end], start=1):
-            if not os.path.exists(img_path):
+        for i, img_path in enumerate(image_paths_to_display, start=1):
+            if not image_exists(img_path):
                 continue  # Skip images that don't exist
                 
-            pixmap = self.load_image(img_path)
+            pixmap = self.load_image(img_path, THUMBNAIL_SIZE)
             scaled_pixmap = pixmap.scaled(self.max_label_size, self.max_label_size, 
                                           Qt.KeepAspectRatio, Qt.SmoothTransformation)
 
@@ -655,6 +1642,8 @@ class ImageGrid(QWidget):
             
             # Store image path as property on the label to avoid closure issues
             label.img_path = img_path
+            label.image_id = os.path.splitext(os.path.basename(img_path))[0]
+            label.setSelected(label.image_id in self.selected_images)
             
             # Connect signals with direct method reference
             label.clicked.connect(lambda label=label: self.onImageClicked(label.img_path, label))
@@ -664,17 +1653,25 @@ class ImageGrid(QWidget):
             col = (i - 1) % self.num_images_per_row
             self.grid.addWidget(label, row, col)
             
-        # Update page number display
-        total_pages = max((len(image_paths_to_display) - 1) // self.page_size + 1, 1)
-        self.page_number_label.setText(f"Page {self.page + 1} of {total_pages}")
+        # Update page number display; very large results are only counted up to COUNT_LIMIT
+        total_pages = max((self.total_images - 1) // self.page_size + 1, 1)
+        more = "+" if self.total_images >= COUNT_LIMIT else ""
+        self.page_number_label.setText(f"Page {self.page + 1} of {total_pages}{more}")
+        
+        # Warm the thumbnails of the neighbouring pages while this one is viewed
+        self.prefetchAdjacentPages()
 
     def changePage(self, direction):
-        image_paths_to_display = self.extracted_image_paths
-        if not image_paths_to_display:
+        if not self.total_images:
             return
             
         new_page = self.page + direction
-        max_page = (len(image_paths_to_display) - 1) // self.page_size
+        max_page = (self.total_images - 1) // self.page_size
+        if new_page > max_page and self.total_images >= COUNT_LIMIT:
+            # The count was capped, so keep paging while there is more to show
+            if self.index.query(self.filters, self.sort_column, self.sort_descending,
+                                new_page * self.page_size, 1, self.total_images):
+                max_page = new_page
         
         if 0 <= new_page <= max_page:
             self.page = new_page
@@ -682,48 +1679,26 @@ class ImageGrid(QWidget):
 
     def onImageClicked(self, img_path, clicked_label):
         # Make sure we have valid objects before doing anything
-        if not os.path.exists(img_path):
+        img_path = resolve_image_path(img_path)
+        if not image_exists(img_path):
             return
             
-        # Deselect previous label if any and it still exists
-        if self.selected_label is not None:
-            try:
-                # Check if the label is still valid
-                self.selected_label.selected = False
-                self.selected_label.setStyleSheet("""
-                    ClickableLabel {
-                        border: 2px solid #555555;
-                        border-radius: 6px;
-                        padding: 4px;
-                        background-color: #2d2d30;
-                    }
-                    ClickableLabel:hover {
-                        border-color: #0098ff;
-                        background-color: #383838;
-                    }
-                """)
-            except RuntimeError:
-                # Label was deleted, just ignore
-                pass
-            
-        # Select the clicked label
-        self.selected_label = clicked_label
+        # Grid clicks also pick images for export; search results only show one
         if clicked_label is not None:
-            try:
-                clicked_label.setSelected(True)
-            except RuntimeError:
-                # Label was deleted, just ignore
-                self.selected_label = None
-                return
+            self.updateSelection(img_path)
+        self.selected_label = clicked_label
+        self.selectionChanged()
         
         # Update the address field
         self.address_field.setText(img_path)
         self.preview_button.setEnabled(True)
+        self.similar_button.setEnabled(True)
         
         # Show quick preview in sidebar
-        pixmap = self.load_image(img_path)
-        preview_pixmap = pixmap.scaled(330, 330, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        pixmap = self.load_image(img_path, PREVIEW_SIZE)
+        preview_pixmap = pixmap.scaled(PREVIEW_SIZE, PREVIEW_SIZE, Qt.KeepAspectRatio, Qt.SmoothTransformation)
         self.full_size_image_label.setPixmap(preview_pixmap)
+        self.prefetchNeighborPreviews(img_path)
 
         # Extract the image ID from the filename
         image_id = os.path.splitext(os.path.basename(img_path))[0]
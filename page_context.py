@@ -0,0 +1,65 @@
+import re
+
+# How far (in PDF points) a text block may sit from an image and still count
+# as its caption, and the words a caption usually starts with.
+CAPTION_MAX_GAP = 40
+CAPTION_PREFIXES = ("fig", "figure", "table", "plate", "chart", "scheme", "abb", "image")
+MAX_CAPTION_LENGTH = 1000
+MAX_PAGE_TEXT_LENGTH = 20000
+
+def normalize_text(text, max_length):
+    """Collapse whitespace and cap the length of extracted text."""
+    return re.sub(r"\s+", " ", text).strip()[:max_length]
+
+def get_text_blocks(page):
+    """Return the text blocks of a page as (x0, y0, x1, y1, text) tuples."""
+    try:
+        return [block[:5] for block in page.get_text("blocks") if block[6] == 0 and block[4].strip()]
+    except Exception as e:
+        print(f"Error reading page text: {str(e)}")
+        return []
+
+def find_caption(blocks, rect):
+    """
+    Pick the text block that most likely captions the image at rect.
+
+    Candidates overlap the image horizontally and sit just below or above it.
+    A block starting with a caption word wins, then the nearest block below,
+    then the nearest block above.
+    """
+    candidates = []
+    for x0, y0, x1, y1, text in blocks:
+        if x1 <= rect.x0 or x0 >= rect.x1:
+            continue
+        if y0 >= rect.y1 - 2 and y0 - rect.y1 <= CAPTION_MAX_GAP:
+            gap, below = y0 - rect.y1, True
+        elif y1 <= rect.y0 + 2 and rect.y0 - y1 <= CAPTION_MAX_GAP:
+            gap, below = rect.y0 - y1, False
+        else:
+            continue
+        is_caption = text.strip().lower().startswith(CAPTION_PREFIXES)
+        candidates.append((not is_caption, not below, gap, text))
+
+    if not candidates:
+        return ""
+    return normalize_text(min(candidates)[3], MAX_CAPTION_LENGTH)
+
+def capture_caption(page, image, blocks):
+    """
+    Return the caption of an image on a page, or "".
+
+    image is the entry of page.get_images(full=True). Its position is read
+    from the page's content stream alone; get_image_rects would decode the
+    image, and every other image on the page, to identify it.
+    """
+    try:
+        rect = page.get_image_bbox(image)
+    except Exception:
+        return ""
+    if rect.is_infinite or rect.is_empty:
+        return ""
+    return find_caption(blocks, rect)
+
+def capture_page_text(blocks):
+    """Return the text of a page, captured once for all the images on it."""
+    return normalize_text(" ".join(block[4] for block in blocks), MAX_PAGE_TEXT_LENGTH)
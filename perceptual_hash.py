@@ -0,0 +1,170 @@
+import fitz  # PyMuPDF
+import math
+from itertools import combinations
+
+from image_tiles import PdfImageRenderer
+
+# DCT-based perceptual hash: the image is reduced to 32x32 grey pixels, the
+# 8x8 lowest frequencies of its DCT are kept and each bit says whether a
+# coefficient lies above their median. Re-encoded or rescaled copies of the
+# same figure end up a few bits apart.
+HASH_SIZE = 8
+SAMPLE_SIZE = 32
+HASH_BITS = HASH_SIZE * HASH_SIZE
+
+# For multi-index hashing the 64-bit hash is cut into chunks that are indexed
+# separately. Two hashes within distance r must agree to within r // CHUNKS
+# bits on at least one chunk, so only those chunk values need to be looked up.
+CHUNKS = 4
+CHUNK_BITS = HASH_BITS // CHUNKS
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+# "Find similar" tolerates more change than the near-duplicate report. Below
+# CHUNKS bits every match shares an exact chunk, so the report only compares
+# hashes within the same buckets, which keeps a pass over a whole library of
+# a million images under a minute.
+SIMILAR_MAX_DISTANCE = 10
+DUPLICATE_MAX_DISTANCE = 3
+
+# Hashing an image file decodes the whole image first, so an 8000 x 8000
+# image takes about 190 MB. Extraction, where several workers decode at once,
+# leaves images above this many pixels to the background pass, which hashes
+# them one at a time and from their source PDF where it still exists.
+HASH_MAX_PIXELS = 4096 * 4096
+
+# Images hashed from their PDF are rendered at most this many pixels across
+# before being reduced like an image file, which keeps their hashes within a
+# few bits of those of the extracted files.
+PDF_RENDER_SIDE = 1024
+
+_DCT_COS = [[math.cos((2 * x + 1) * u * math.pi / (2 * SAMPLE_SIZE)) for x in range(SAMPLE_SIZE)]
+            for u in range(HASH_SIZE)]
+
+def _grey_samples(image_bytes):
+    return _reduce_pixmap(fitz.Pixmap(image_bytes))
+
+def _reduce_pixmap(pix):
+    small = fitz.Pixmap(pix, SAMPLE_SIZE, SAMPLE_SIZE)
+    if small.alpha:
+        small = fitz.Pixmap(small, 0)
+    if small.n != 1:
+        small = fitz.Pixmap(fitz.csGRAY, small)
+    if small.width != SAMPLE_SIZE or small.height != SAMPLE_SIZE:
+        return None
+    return small.samples
+
+def compute_phash(image_bytes):
+    """Return the 64-bit perceptual hash of an encoded image as 16 hex digits, or None."""
+    try:
+        samples = _grey_samples(image_bytes)
+    except Exception as e:
+        print(f"Error hashing image: {str(e)}")
+        return None
+    if samples is None:
+        return None
+    return _hash_samples(samples)
+
+def compute_phash_from_pdf(pdf_path, page_number, image_index):
+    """
+    Hash an image from its source PDF instead of the extracted file.
+
+    The image is rendered through PdfImageRenderer at PDF_RENDER_SIDE, so
+    MuPDF subsamples Flate-encoded images while decoding them and a
+    12000 x 12000 image needs about 60 MB instead of 430 MB. JPEG images are
+    still decoded whole. Returns the hash as compute_phash does, or None.
+    """
+    try:
+        renderer = PdfImageRenderer(pdf_path, page_number, image_index)
+        try:
+            zoom = min(1.0, PDF_RENDER_SIDE / max(renderer.width, renderer.height))
+            samples, width, height, _ = renderer.render(0, 0, renderer.width, renderer.height, zoom)
+        finally:
+            renderer.close()
+        samples = _reduce_pixmap(fitz.Pixmap(fitz.csRGB, width, height, samples, False))
+    except Exception as e:
+        print(f"Error hashing image {image_index} on page {page_number} of {pdf_path}: {str(e)}")
+        return None
+    if samples is None:
+        return None
+    return _hash_samples(samples)
+
+def _hash_samples(samples):
+    rows = [samples[y * SAMPLE_SIZE:(y + 1) * SAMPLE_SIZE] for y in range(SAMPLE_SIZE)]
+    # Only the low frequencies are needed, so the separable DCT is evaluated
+    # for the first HASH_SIZE coefficients in each direction.
+    row_dct = [[sum(p * c for p, c in zip(row, _DCT_COS[u])) for u in range(HASH_SIZE)]
+               for row in rows]
+    coefficients = [sum(row_dct[y][u] * _DCT_COS[v][y] for y in range(SAMPLE_SIZE))
+                    for v in range(HASH_SIZE) for u in range(HASH_SIZE)]
+
+    median = sorted(coefficients)[HASH_BITS // 2]
+    value = 0
+    for coefficient in coefficients:
+        value = (value << 1) | (coefficient > median)
+    return f"{value:016x}"
+
+def hamming_distance(hash_a, hash_b):
+    """Number of differing bits between two hex hashes."""
+    return bin(int(hash_a, 16) ^ int(hash_b, 16)).count("1")
+
+def _value_chunks(value):
+    return [(value >> (CHUNK_BITS * (CHUNKS - 1 - i))) & CHUNK_MASK for i in range(CHUNKS)]
+
+def hash_chunks(phash):
+    """Split a hex hash into its CHUNKS integer chunks, most significant first."""
+    return _value_chunks(int(phash, 16))
+
+def chunk_neighbors(chunk, radius):
+    """All chunk values within `radius` bits of `chunk`, including itself."""
+    values = [chunk]
+    for r in range(1, radius + 1):
+        for bits in combinations(range(CHUNK_BITS), r):
+            flipped = chunk
+            for bit in bits:
+                flipped ^= 1 << bit
+            values.append(flipped)
+    return values
+
+def group_near_duplicates(hashes, max_distance=DUPLICATE_MAX_DISTANCE):
+    """
+    Group image ids whose hashes lie within max_distance of each other.
+
+    hashes maps image_id -> hex hash. Groups are connected components, so two
+    members of a group can be further apart than max_distance through a chain
+    of closer neighbours. Returns lists of image ids, largest group first.
+    """
+    # Identical hashes (blank pages, logos) are merged up front so that large
+    # runs of them do not turn the bucket scan quadratic.
+    ids_by_value = {}
+    for image_id, phash in hashes.items():
+        ids_by_value.setdefault(int(phash, 16), []).append(image_id)
+    values = list(ids_by_value)
+
+    chunks = [_value_chunks(value) for value in values]
+    buckets = [{} for _ in range(CHUNKS)]
+    for n, value_chunks in enumerate(chunks):
+        for i, chunk in enumerate(value_chunks):
+            buckets[i].setdefault(chunk, []).append(n)
+
+    parent = list(range(len(values)))
+
+    def find(n):
+        while parent[n] != n:
+            parent[n] = parent[parent[n]]
+            n = parent[n]
+        return n
+
+    masks = chunk_neighbors(0, max_distance // CHUNKS)
+    for n, value in enumerate(values):
+        for i, chunk in enumerate(chunks[n]):
+            for mask in masks:
+                for m in buckets[i].get(chunk ^ mask, ()):
+                    if m > n and bin(value ^ values[m]).count("1") <= max_distance:
+                        root_n, root_m = find(n), find(m)
+                        if root_n != root_m:
+                            parent[root_m] = root_n
+
+    groups = {}
+    for n, value in enumerate(values):
+        groups.setdefault(find(n), []).extend(ids_by_value[value])
+    return sorted((group for group in groups.values() if len(group) > 1), key=len, reverse=True)
@@ -0,0 +1,65 @@
+import random
+
+import fitz
+
+from extraction_plan import inspect_pdf, plan_sources
+
+LARGE = 200 * 200 * 3
+
+def make_pdf(pdf_path, pages=2):
+    # Every page shows a noisy image, which Flate cannot shrink, and a flat one,
+    # which it shrinks to almost nothing; the noisy image repeats on every page
+    rng = random.Random(0)
+    noisy = fitz.Pixmap(fitz.csRGB, 200, 200, rng.randbytes(LARGE), False)
+    flat = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 200, 200), False)
+    flat.set_rect(flat.irect, (200, 120, 40))
+    doc = fitz.open()
+    noisy_xref = None
+    for _ in range(pages):
+        page = doc.new_page()
+        if noisy_xref is None:
+            noisy_xref = page.insert_image(fitz.Rect(50, 50, 250, 250), pixmap=noisy)
+        else:
+            page.insert_image(fitz.Rect(50, 50, 250, 250), xref=noisy_xref)
+        page.insert_image(fitz.Rect(50, 300, 250, 500), pixmap=flat)
+    doc.save(pdf_path, deflate=True)
+    doc.close()
+
+def test_inspect_pdf_filters_by_size_and_page_limit(tmp_path):
+    pdf_path = str(tmp_path / "paper.pdf")
+    make_pdf(pdf_path, pages=3)
+
+    result = inspect_pdf((pdf_path, 0, 50))
+    assert (result["pages"], result["images_seen"], result["images"]) == (3, 6, 6)
+
+    # Only the noisy image passes the size limit, and it counts once per page it is on
+    result = inspect_pdf((pdf_path, LARGE // 2, 50))
+    assert (result["images_seen"], result["images"]) == (6, 3)
+    assert 3 * LARGE * 0.9 <= result["bytes"] <= 3 * LARGE * 1.01
+    assert not result["skipped"] and not result["error"]
+
+    result = inspect_pdf((pdf_path, 0, 2))
+    assert result["skipped"] and result["images"] == 0
+
+    result = inspect_pdf((str(tmp_path / "missing.pdf"), 0, 50))
+    assert result["error"]
+
+def test_plan_sources_adds_up_each_root(tmp_path):
+    paths = []
+    for i, pages in enumerate([1, 2, 5]):
+        paths.append(str(tmp_path / f"paper{i}.pdf"))
+        make_pdf(paths[-1], pages)
+    single = {path: inspect_pdf((path, LARGE // 2, 4)) for path in paths}
+
+    # The roots overlap on the second PDF, which counts under both
+    summaries = plan_sources([("a", paths[:2]), ("b", paths[1:])], LARGE // 2, 4,
+                             stats_path=str(tmp_path / "no_stats.json"))
+    a, b, total = summaries
+    assert [summary["root"] for summary in summaries] == ["a", "b", "Total"]
+    assert (a["pdfs"], a["skipped_pdfs"], a["images"]) == (2, 0, 3)
+    assert (b["pdfs"], b["skipped_pdfs"], b["images"]) == (2, 1, 2)
+    assert a["bytes"] == single[paths[0]]["bytes"] + single[paths[1]]["bytes"]
+    assert b["bytes"] == single[paths[1]]["bytes"]
+    assert 0 < a["estimated_seconds"] and 0 < b["estimated_seconds"]
+    for key in ("pdfs", "skipped_pdfs", "unreadable_pdfs", "images", "bytes", "estimated_seconds"):
+        assert total[key] == a[key] + b[key]
@@ -0,0 +1,115 @@
+import os
+import json
+import errno
+
+import pytest
+
+import image_export
+from image_export import ImageExporter, export_images, EXPORT_MANIFEST_NAME, METHODS
+from image_pack import PackWriter, close_packs
+
+def make_files(folder, count):
+    os.makedirs(folder, exist_ok=True)
+    records = {}
+    for i in range(count):
+        path = os.path.join(folder, f"source{i}.png")
+        with open(path, "wb") as f:
+            f.write(f"image {i} ".encode() * 100)
+        records[f"img{i}"] = {"path": path, "page_number": i + 1}
+    return records
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+def failing(calls, name, error):
+    def fail(*args):
+        calls.append(name)
+        raise OSError(error, os.strerror(error))
+    return fail
+
+def test_falls_back_in_order_and_remembers_unsupported_methods(tmp_path, monkeypatch):
+    records = make_files(str(tmp_path / "images"), 3)
+    calls = []
+    monkeypatch.setattr(image_export, "_reflink", failing(calls, "reflink", errno.EOPNOTSUPP))
+    monkeypatch.setattr(image_export.os, "link", failing(calls, "hardlink", errno.EXDEV))
+    monkeypatch.setattr(image_export, "_copy_range", failing(calls, "copy_file_range", errno.ENOSYS))
+
+    counts = export_images(records, str(tmp_path / "export"), max_workers=1)
+    assert counts == {"reflink": 0, "hardlink": 0, "copy_file_range": 0, "copy": 3, "failed": 0}
+    # Each method was tried once, in order, and skipped for the other images
+    assert calls == ["reflink", "hardlink", "copy_file_range"]
+    for image_id, record in records.items():
+        assert read(tmp_path / "export" / f"{image_id}.png") == read(record["path"])
+
+def test_other_errors_do_not_rule_a_method_out(tmp_path, monkeypatch):
+    records = make_files(str(tmp_path / "images"), 2)
+    calls = []
+    monkeypatch.setattr(image_export, "_reflink", failing(calls, "reflink", errno.EIO))
+    exporter = ImageExporter(str(tmp_path / "export"))
+    os.makedirs(exporter.target_folder)
+    for image_id, record in records.items():
+        _, _, method = exporter.export(image_id, record)
+        assert method == "hardlink"
+    assert calls == ["reflink", "reflink"]
+    assert exporter.unsupported == set()
+
+def write_members(folder):
+    writer = PackWriter(folder)
+    records = {f"img{i}": {"path": writer.write(f"img{i}.png", f"member {i} ".encode() * (i + 10))}
+               for i in range(3)}
+    writer.close()
+    return records
+
+@pytest.mark.skipif(not hasattr(os, "copy_file_range"), reason="needs os.copy_file_range")
+def test_pack_members_are_copied_from_their_byte_range(tmp_path, monkeypatch):
+    records = write_members(str(tmp_path / "images"))
+    ranges = []
+    copy_range = image_export._copy_range
+
+    def record_range(source_fd, destination, offset, length):
+        ranges.append((offset, length))
+        copy_range(source_fd, destination, offset, length)
+
+    monkeypatch.setattr(image_export, "_copy_range", record_range)
+    counts = export_images(records, str(tmp_path / "export"), max_workers=1)
+    assert counts["failed"] == 0
+    for i in range(3):
+        assert read(tmp_path / "export" / f"img{i}.png") == f"member {i} ".encode() * (i + 10)
+    # Only the member's bytes are read from the pack, never the whole pack
+    assert sorted(length for _, length in ranges) == [len(f"member {i} ".encode() * (i + 10)) for i in range(3)]
+    assert all(offset > 0 for offset, _ in ranges)
+    close_packs()
+
+def test_pack_members_without_copy_file_range(tmp_path, monkeypatch):
+    # The member is written from the memory-mapped pack instead
+    records = write_members(str(tmp_path / "images"))
+    monkeypatch.setattr(image_export, "_copy_range", failing([], "copy_file_range", errno.ENOSYS))
+    counts = export_images(records, str(tmp_path / "export2"), max_workers=1)
+    assert counts["copy"] == 3
+    assert read(tmp_path / "export2" / "img2.png") == "member 2 ".encode() * 12
+    close_packs()
+
+def test_exporting_again_merges_the_manifest(tmp_path):
+    records = make_files(str(tmp_path / "images"), 3)
+    target = str(tmp_path / "export")
+    first = {image_id: records[image_id] for image_id in ("img0", "img1")}
+    assert export_images(first, target)["failed"] == 0
+
+    # img1 was replaced at its source; exporting it again replaces the earlier copy,
+    # which may be a hardlink to the old file
+    os.remove(records["img1"]["path"])
+    with open(records["img1"]["path"], "wb") as f:
+        f.write(b"changed")
+    second = {image_id: records[image_id] for image_id in ("img1", "img2")}
+    counts = export_images(second, target)
+    assert counts["failed"] == 0
+    assert sum(counts[method] for method in METHODS) == 2
+
+    with open(os.path.join(target, EXPORT_MANIFEST_NAME)) as f:
+        manifest = json.load(f)
+    assert set(manifest["images"]) == {"img0", "img1", "img2"}
+    assert manifest["images"]["img1"] == {"source_path": records["img1"]["path"], "page_number": 2,
+                                          "file": "img1.png"}
+    assert read(os.path.join(target, "img1.png")) == b"changed"
+    assert sorted(os.listdir(target)) == [EXPORT_MANIFEST_NAME, "img0.png", "img1.png", "img2.png"]
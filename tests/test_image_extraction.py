@@ -0,0 +1,140 @@
+import os
+import time
+import asyncio
+
+import fitz
+
+import image_extraction
+from image_extraction import (load_metadata, save_metadata, update_metadata, metadata_mtime, process_image,
+                              iter_images_from_directory, extract_images_from_directory,
+                              aiter_images_from_directory, backfill_perceptual_hashes)
+from image_index import ImageIndex
+from image_store import read_image_bytes
+from perceptual_hash import compute_phash
+
+def make_record(image_id, **fields):
+    record = {"path": f"extracted_images/{image_id}.png", "pdf_path": "/library/paper.pdf",
+              "file_name": "paper.pdf", "page_number": 1, "image_index": 1, "image_type": "PNG",
+              "size_bytes": 1000, "width": 10, "height": 10, "extraction_date": "2024-01-01 10:00:00"}
+    record.update(fields)
+    return record
+
+def test_update_metadata_keeps_what_others_saved(tmp_path):
+    metadata_path = str(tmp_path / "images_metadata.json")
+    save_metadata({"a": make_record("a"), "b": make_record("b")}, metadata_path)
+    with ImageIndex(str(tmp_path / "index.sqlite")) as index:
+        index.sync_from_metadata(metadata_path)
+        synced_mtime = metadata_mtime(metadata_path)
+
+        # Another run saves a new image and drops one while this one works on a stale copy
+        other = load_metadata(metadata_path)
+        other["c"] = make_record("c")
+        del other["b"]
+        save_metadata(other, metadata_path)
+        os.utime(metadata_path, (0, 0))
+
+        merged = update_metadata({"a": {"caption": "Figure 1"}, "b": {"caption": "Figure 2"},
+                                  "d": make_record("d")}, metadata_path, index, synced_mtime)
+        assert set(merged) == {"a", "c"}
+        assert merged["a"]["caption"] == "Figure 1"
+        assert load_metadata(metadata_path) == merged
+        # The index was rebuilt from the merged file, so the other run's image shows
+        assert {image_id for image_id, _ in index.iter_matching()} == {"a", "c"}
+        assert not index.sync_from_metadata(metadata_path)
+
+        merged = update_metadata({"d": make_record("d")}, metadata_path, index,
+                                 metadata_mtime(metadata_path), add_new=True, removed=["c"])
+        assert set(merged) == {"a", "d"}
+
+def make_pdf(pdf_path, side=64, pages=1, images_per_page=1):
+    doc = fitz.open()
+    for p in range(pages):
+        page = doc.new_page()
+        for i in range(images_per_page):
+            # Every image differs, so none is stored twice
+            pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, side, side), False)
+            pix.set_rect(pix.irect, (200, 120, 40))
+            pix.set_rect(fitz.IRect(0, 0, side // 2, side // 2), (p % 256, i * 50, hash(pdf_path) % 256))
+            top = 50 + i * 250
+            page.insert_image(fitz.Rect(100, top, 300, top + 200), stream=pix.tobytes("png"))
+    doc.save(pdf_path)
+    doc.close()
+
+def make_library(count=3, pages=1, images_per_page=2):
+    os.makedirs("pdfs")
+    for i in range(count):
+        make_pdf(os.path.join("pdfs", f"paper{i}.pdf"), pages=pages, images_per_page=images_per_page)
+
+def image_files(output_folder):
+    return {os.path.join(root, name) for root, _, names in os.walk(output_folder) for name in names}
+
+def test_large_images_are_left_to_the_background_hash(tmp_path, monkeypatch):
+    pdf_path = str(tmp_path / "paper.pdf")
+    make_pdf(pdf_path)
+    doc = fitz.open(pdf_path)
+    xref = doc[0].get_images(full=True)[0][0]
+    (record,) = process_image(doc, xref, str(tmp_path / "images"), 1, 1, 0, pdf_path).values()
+    assert record["phash"]
+    monkeypatch.setattr(image_extraction, "HASH_MAX_PIXELS", 64 * 64 - 1)
+    (record,) = process_image(doc, xref, str(tmp_path / "images"), 1, 1, 0, pdf_path).values()
+    assert record["phash"] is None
+    doc.close()
+
+def test_large_images_are_hashed_from_their_pdf(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    make_library(count=1, images_per_page=1)
+    monkeypatch.setattr(image_extraction, "HASH_MAX_PIXELS", 64 * 64 - 1)
+    assert extract_images_from_directory("pdfs", "extracted_images", 0, 100) == 1
+    ((image_id, record),) = load_metadata().items()
+    assert record["phash"] is None
+    expected = compute_phash(read_image_bytes(record["path"]))
+    # The extracted file cannot be decoded, so only the PDF can give the hash
+    with open(record["path"], "wb") as f:
+        f.write(b"not an image")
+
+    assert backfill_perceptual_hashes() == 1
+    assert load_metadata()[image_id]["phash"] == expected
+
+def test_stream_yields_every_record_it_saves(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    make_library()
+    streamed = dict(iter_images_from_directory("pdfs", "extracted_images", 0, 100))
+    assert len(streamed) == 6
+    saved = load_metadata()
+    assert saved == streamed
+    assert {record["path"] for record in saved.values()} == image_files("extracted_images")
+    with ImageIndex() as index:
+        assert {image_id for image_id, _ in index.iter_matching()} == set(saved)
+
+    assert extract_images_from_directory("pdfs", "extracted_images", 0, 100) == 6
+    assert len(load_metadata()) == 12
+
+def test_closing_the_stream_early_keeps_every_written_image(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    make_library(count=4, pages=20)
+    stream = iter_images_from_directory("pdfs", "extracted_images", 0, 100)
+    first_id, _ = next(stream)
+    # The workers keep writing while the consumer is busy
+    time.sleep(0.5)
+    stream.close()
+
+    saved = load_metadata()
+    assert first_id in saved
+    # Every file written has its record, and every record its file
+    assert {record["path"] for record in saved.values()} == image_files("extracted_images")
+
+def test_async_stream(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    make_library()
+
+    async def collect(limit=None):
+        items = []
+        async for image_id, record in aiter_images_from_directory("pdfs", "extracted_images", 0, 100):
+            items.append((image_id, record))
+            if limit and len(items) == limit:
+                break
+        return items
+
+    items = asyncio.run(collect())
+    assert len(items) == 6
+    assert dict(items) == load_metadata()
@@ -0,0 +1,101 @@
+import random
+
+from image_index import ImageIndex, COUNT_LIMIT, SORT_COLUMNS
+
+def make_metadata(count=2000, seed=0):
+    rng = random.Random(seed)
+    metadata = {}
+    for i in range(count):
+        pdf = i // 10
+        metadata[f"id{i:05d}"] = {
+            "path": f"extracted_images/id{i:05d}.png",
+            "pdf_path": f"/library/storage/K{pdf:04d}/Paper_{pdf % 7}.pdf",
+            "file_name": f"Paper_{pdf % 7}.pdf",
+            "page_number": rng.randint(1, 30),
+            "image_index": 1,
+            "image_type": rng.choice(["JPEG", "PNG"]),
+            "size_bytes": rng.randint(1000, 100000),
+            "width": rng.randint(100, 3000),
+            "height": rng.randint(100, 3000),
+            "extraction_date": f"2024-01-{rng.randint(1, 28):02d} 10:00:00",
+        }
+    return metadata
+
+def expected_ids(metadata, text, image_type=None):
+    return {image_id for image_id, record in metadata.items()
+            if text.lower() in record["pdf_path"].lower()
+            and (image_type is None or record["image_type"] == image_type)}
+
+def test_pdf_filter_follows_typing(tmp_path):
+    metadata = make_metadata()
+    with ImageIndex(str(tmp_path / "index.sqlite")) as index:
+        index.rebuild(metadata)
+        # Growing, shrinking and unrelated substrings, with and without another filter
+        for text in ["s", "storage", "storage/K00", "storage/K001", "storage/K0012", "storage/K001",
+                     "paper_3", "PAPER_3.pdf", "K01", "K01%", "nothing"]:
+            for image_type in (None, "PNG"):
+                filters = {"pdf": text, "image_type": image_type}
+                expected = expected_ids(metadata, text, image_type)
+                assert index.count(filters, COUNT_LIMIT) == len(expected)
+                assert {image_id for image_id, _ in index.iter_matching(filters)} == expected
+                page = [image_id for image_id, _ in index.query(filters, "size_bytes", False, 0, 40)]
+                sizes = [metadata[image_id]["size_bytes"] for image_id in page]
+                assert len(page) == min(40, len(expected))
+                assert set(page) <= expected
+                assert sizes == sorted(sizes)
+                if expected:
+                    assert sizes[0] == min(metadata[image_id]["size_bytes"] for image_id in expected)
+
+def test_pages_follow_the_sort_order(tmp_path):
+    metadata = make_metadata()
+    with ImageIndex(str(tmp_path / "index.sqlite")) as index:
+        index.rebuild(metadata)
+        # Matches bunched along the PDF order or by file name, spread evenly, sparse and everything
+        for filters in [{"pdf": "K001"}, {"pdf": "Paper_3"}, {"pdf": "K001", "width_min": 1500},
+                        {"width_min": 1000}, {"width_min": 2950}, {}]:
+            expected = [image_id for image_id, _ in index.iter_matching(filters)]
+            total = index.count(filters, COUNT_LIMIT)
+            for sort_column in SORT_COLUMNS.values():
+                for descending in (False, True):
+                    seen = []
+                    for offset in range(0, total, 40):
+                        seen.extend(image_id for image_id, _ in
+                                    index.query(filters, sort_column, descending, offset, 40, total))
+                    values = [metadata[image_id][sort_column] for image_id in seen]
+                    assert sorted(seen) == sorted(expected)
+                    assert values == sorted(values, reverse=descending)
+
+def test_pdf_filter_sees_new_records(tmp_path):
+    metadata = make_metadata(100)
+    with ImageIndex(str(tmp_path / "index.sqlite")) as index:
+        index.rebuild(metadata)
+        assert index.count({"pdf": "K0003"}) == 10
+        extra = make_metadata(200)
+        index.add_records({image_id: record for image_id, record in extra.items() if image_id not in metadata})
+        assert index.count({"pdf": "K0003"}) == 10
+        assert index.count({"pdf": "K001"}) == 100
+
+def test_page_text_is_stored_once_per_page(tmp_path):
+    metadata = make_metadata(30)
+    with ImageIndex(str(tmp_path / "index.sqlite")) as index:
+        index.rebuild(metadata)
+        # Three images on one page, one of them captioned, and one image on another page
+        pdf_path = "/library/storage/K0000/Paper_0.pdf"
+        index.add_page_text([(pdf_path, 1, "Results of the spectral analysis"),
+                             (pdf_path, 2, "An unrelated page about methods")])
+        index.add_text([("id00000", "", pdf_path, 1), ("id00001", "Figure 2: spectral plot", pdf_path, 1),
+                        ("id00002", "", pdf_path, 1), ("id00003", "", pdf_path, 2)])
+        assert index.conn.execute("SELECT COUNT(*) FROM page_texts").fetchone()[0] == 2
+
+        results = index.search_text("spectral")
+        assert [image_id for image_id, _, _ in results][0] == "id00001"
+        assert {image_id for image_id, _, _ in results} == {"id00000", "id00001", "id00002"}
+        assert "[spectral]" in results[0][2]
+        assert [image_id for image_id, _, _ in index.search_text("methods")] == ["id00003"]
+
+        # Page text goes with the last image on its page
+        index.remove_text(["id00000", "id00001"])
+        assert {image_id for image_id, _, _ in index.search_text("spectral")} == {"id00002"}
+        index.remove_records(["id00002"])
+        assert index.search_text("spectral") == []
+        assert index.conn.execute("SELECT COUNT(*) FROM page_texts").fetchone()[0] == 1
@@ -0,0 +1,103 @@
+import os
+
+import pytest
+
+from image_extraction import save_metadata, load_metadata, extraction_lock, METADATA_FILE_PATH
+from image_index import ImageIndex
+from image_pack import (PackWriter, PackReader, compact_packs, close_packs, iter_packs, read_member,
+                        member_exists, split_member_path, INDEX_EXTENSION)
+
+def image_bytes(i):
+    return f"image {i} ".encode() * (i + 1)
+
+def write_pack(output_folder, names):
+    writer = PackWriter(output_folder)
+    paths = {name: writer.write(name, image_bytes(i)) for i, name in enumerate(names)}
+    writer.close()
+    return writer.pack_path, paths
+
+def test_write_and_read(tmp_path):
+    writer = PackWriter(str(tmp_path))
+    first = writer.write("a.png", image_bytes(0))
+    writer.flush()
+    assert read_member(first) == image_bytes(0)
+    # A reader that is already open picks up what is appended later
+    second = writer.write("b.png", image_bytes(1))
+    writer.flush()
+    assert read_member(second) == image_bytes(1)
+    writer.close()
+    assert split_member_path(second) == (writer.pack_path, "b.png")
+    assert member_exists(first) and not member_exists(os.path.join(writer.pack_path, "c.png"))
+    close_packs()
+
+def test_lost_or_truncated_index_is_recovered_from_headers(tmp_path):
+    names = [f"{i}.png" for i in range(20)]
+    pack_path, _ = write_pack(str(tmp_path), names)
+    index_path = pack_path + INDEX_EXTENSION
+    with open(index_path, "rb") as index_file:
+        lines = index_file.readlines()
+
+    # Half the index, ending in a partly written line
+    with open(index_path, "wb") as index_file:
+        index_file.writelines(lines[:10])
+        index_file.write(lines[10][:5])
+    reader = PackReader(pack_path)
+    assert sorted(reader.members) == sorted(names)
+    assert all(reader.read(name) == image_bytes(i) for i, name in enumerate(names))
+    reader.close()
+
+    os.remove(index_path)
+    reader = PackReader(pack_path)
+    assert all(reader.read(name) == image_bytes(i) for i, name in enumerate(names))
+    reader.close()
+
+def make_packed_library(count_per_pack=10, packs=3):
+    metadata = {}
+    for p in range(packs):
+        names = [f"p{p}i{i}.png" for i in range(count_per_pack)]
+        _, paths = write_pack("extracted_images", names)
+        # Every other image has since been deleted from the library
+        for i, name in enumerate(names):
+            if i % 2 == 0:
+                metadata[name[:-4]] = {"path": paths[name], "pdf_path": "/library/paper.pdf",
+                                       "file_name": "paper.pdf", "page_number": p + 1, "image_index": i + 1,
+                                       "image_type": "PNG", "size_bytes": len(image_bytes(i))}
+    save_metadata(metadata)
+    return metadata
+
+def test_compaction_keeps_live_images_only(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    metadata = make_packed_library()
+    old_packs = set(iter_packs("extracted_images"))
+
+    assert compact_packs("extracted_images") > 0
+    compacted = load_metadata()
+    assert set(compacted) == set(metadata)
+    new_packs = set(iter_packs("extracted_images"))
+    assert not new_packs & old_packs
+    assert not any(os.path.exists(pack_path + INDEX_EXTENSION) for pack_path in old_packs)
+    for image_id, record in compacted.items():
+        assert split_member_path(record["path"])[0] in new_packs
+        assert read_member(record["path"]) == image_bytes(int(image_id.split("i")[1]))
+    with ImageIndex() as index:
+        assert not index.sync_from_metadata(METADATA_FILE_PATH)
+        assert dict(index.iter_matching()) == {image_id: record["path"] for image_id, record in compacted.items()}
+    close_packs()
+
+def test_compaction_and_extraction_never_overlap(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    metadata = make_packed_library()
+    with extraction_lock():
+        # A second extraction may run alongside the first
+        with extraction_lock():
+            pass
+        with pytest.raises(RuntimeError):
+            compact_packs("extracted_images")
+    assert load_metadata() == metadata
+
+    with extraction_lock(compaction=True):
+        with pytest.raises(RuntimeError):
+            with extraction_lock():
+                pass
+    assert compact_packs("extracted_images") > 0
+    close_packs()
@@ -0,0 +1,127 @@
+import struct
+import zlib
+
+import fitz
+import pytest
+
+from image_recompress import recompress_png, read_chunks, write_chunks, CHANNELS
+
+def make_png(width, height, color_type, bit_depth, row, filter_type=0, palette=None):
+    """Build a PNG whose rows come from row(y) -> bytes, written with one filter and fast deflate."""
+    bits = CHANNELS[color_type] * bit_depth
+    row_bytes = (width * bits + 7) // 8
+    bpp = max(bits // 8, 1)
+    raw, previous = [], bytes(row_bytes)
+    for y in range(height):
+        current = row(y)[:row_bytes].ljust(row_bytes, b"\0")
+        if filter_type == 1:
+            filtered = bytes((current[i] - (current[i - bpp] if i >= bpp else 0)) & 0xff for i in range(row_bytes))
+        elif filter_type == 2:
+            filtered = bytes((current[i] - previous[i]) & 0xff for i in range(row_bytes))
+        else:
+            filtered = current
+        raw.append(bytes((filter_type,)) + filtered)
+        previous = current
+    chunks = [(b"IHDR", struct.pack(">IIBBBBB", width, height, bit_depth, color_type, 0, 0, 0))]
+    if palette is not None:
+        chunks.append((b"PLTE", palette))
+    chunks.append((b"tEXt", b"Comment\0kept as it is"))
+    chunks.append((b"IDAT", zlib.compress(b"".join(raw), 1)))
+    chunks.append((b"IEND", b""))
+    return write_chunks(chunks)
+
+def decode_rows(data):
+    """Plain per-byte reference decoder for non-interlaced PNGs, all five filters."""
+    chunks = read_chunks(data)
+    width, height, bit_depth, color_type = struct.unpack(">IIBB", dict(chunks)[b"IHDR"][:10])
+    bits = CHANNELS[color_type] * bit_depth
+    row_bytes = (width * bits + 7) // 8
+    bpp = max(bits // 8, 1)
+    raw = zlib.decompress(b"".join(body for chunk_type, body in chunks if chunk_type == b"IDAT"))
+    rows, previous = [], bytearray(row_bytes)
+    for y in range(height):
+        filter_type = raw[y * (row_bytes + 1)]
+        current = bytearray(raw[y * (row_bytes + 1) + 1:(y + 1) * (row_bytes + 1)])
+        for i in range(row_bytes):
+            a = current[i - bpp] if i >= bpp else 0
+            b = previous[i]
+            c = previous[i - bpp] if i >= bpp else 0
+            if filter_type == 1:
+                current[i] = (current[i] + a) & 0xff
+            elif filter_type == 2:
+                current[i] = (current[i] + b) & 0xff
+            elif filter_type == 3:
+                current[i] = (current[i] + (a + b) // 2) & 0xff
+            elif filter_type == 4:
+                p = a + b - c
+                predictor = min((abs(p - a), 0, a), (abs(p - b), 1, b), (abs(p - c), 2, c))[2]
+                current[i] = (current[i] + predictor) & 0xff
+        rows.append(bytes(current))
+        previous = current
+    return rows
+
+def palette_of(entries):
+    return bytes(v for i in range(entries) for v in (i * 7 % 256, i * 13 % 256, i * 29 % 256))
+
+CASES = {
+    # name: (width, height, color_type, bit_depth, palette)
+    "gray1": (101, 40, 0, 1, None),
+    "gray2": (67, 40, 0, 2, None),
+    "gray4": (37, 40, 0, 4, None),
+    "gray8": (64, 48, 0, 8, None),
+    "gray16": (33, 30, 0, 16, None),
+    "rgb8": (61, 50, 2, 8, None),
+    "rgb16": (29, 30, 2, 16, None),
+    "palette1": (99, 30, 3, 1, palette_of(2)),
+    "palette4": (45, 30, 3, 4, palette_of(16)),
+    "palette8": (50, 30, 3, 8, palette_of(256)),
+    "gray_alpha8": (40, 30, 4, 8, None),
+    "gray_alpha16": (21, 30, 4, 16, None),
+    "rgba8": (47, 40, 6, 8, None),
+    "rgba16": (19, 30, 6, 16, None),
+}
+
+def smooth_rows(width, color_type, bit_depth):
+    row_bytes = (width * CHANNELS[color_type] * bit_depth + 7) // 8
+    return lambda y: bytes(((i // 3) + y // 4) & 0xff for i in range(row_bytes))
+
+@pytest.mark.parametrize("name", sorted(CASES))
+def test_recompressed_pixels_are_identical(name):
+    width, height, color_type, bit_depth, palette = CASES[name]
+    original = make_png(width, height, color_type, bit_depth, smooth_rows(width, color_type, bit_depth),
+                        palette=palette)
+    smaller = recompress_png(original)
+    assert smaller is not None and len(smaller) < len(original)
+    assert decode_rows(smaller) == decode_rows(original)
+    # Every chunk other than the pixel data is carried over unchanged
+    assert [chunk for chunk in read_chunks(smaller) if chunk[0] != b"IDAT"] == \
+        [chunk for chunk in read_chunks(original) if chunk[0] != b"IDAT"]
+    # And an independent decoder sees the same image
+    assert fitz.Pixmap(smaller).samples == fitz.Pixmap(original).samples
+
+@pytest.mark.parametrize("filter_type", [1, 2])
+def test_filtered_originals_are_only_deflated_again(filter_type):
+    original = make_png(64, 48, 2, 8, smooth_rows(64, 2, 8), filter_type=filter_type)
+    smaller = recompress_png(original)
+    assert smaller is not None
+    assert decode_rows(smaller) == decode_rows(original)
+
+def test_recompressed_images_are_left_alone():
+    original = make_png(64, 64, 6, 8, smooth_rows(64, 6, 8))
+    smaller = recompress_png(original)
+    assert smaller is not None
+    assert recompress_png(smaller) is None
+
+def test_mupdf_output_is_recompressed_losslessly():
+    pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 120, 80), True)
+    pix.set_rect(pix.irect, (200, 120, 40, 255))
+    pix.set_rect(fitz.IRect(10, 10, 60, 50), (10, 10, 200, 128))
+    original = pix.tobytes("png")
+    smaller = recompress_png(original)
+    assert smaller is not None
+    assert decode_rows(smaller) == decode_rows(original)
+    assert fitz.Pixmap(smaller).samples == fitz.Pixmap(original).samples
+
+def test_not_a_png():
+    with pytest.raises(ValueError):
+        recompress_png(b"\xff\xd8 not a png")
@@ -0,0 +1,56 @@
+import os
+
+import pytest
+
+from image_extraction import load_metadata, save_metadata, METADATA_FILE_PATH
+from image_index import ImageIndex
+from image_store import migrate_to_sharded, shard_path, resolve_image_path
+
+class Interrupted(Exception):
+    pass
+
+def make_flat_folder(count):
+    os.makedirs("extracted_images")
+    metadata = {}
+    for i in range(count):
+        image_id = f"img{i:03d}"
+        path = os.path.join("extracted_images", f"{image_id}.png")
+        with open(path, "wb") as image_file:
+            image_file.write(image_id.encode())
+        metadata[image_id] = {"path": path, "pdf_path": "/library/paper.pdf", "file_name": "paper.pdf",
+                              "page_number": 1, "image_index": i + 1, "image_type": "PNG"}
+    save_metadata(metadata)
+    return metadata
+
+def test_interrupted_migration_resumes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    metadata = make_flat_folder(10)
+
+    def interrupt(moved):
+        raise Interrupted()
+
+    # The records hold relative paths; the folder is given as an absolute one
+    output_folder = os.path.abspath("extracted_images")
+    with pytest.raises(Interrupted):
+        migrate_to_sharded(output_folder, batch_size=3, progress_callback=interrupt)
+    moved_early = [image_id for image_id in metadata
+                   if os.path.exists(shard_path("extracted_images", image_id, "png"))]
+    assert len(moved_early) == 3
+    # In between, the old paths still lead to the images
+    for image_id, record in load_metadata().items():
+        assert os.path.exists(resolve_image_path(record["path"]))
+
+    assert migrate_to_sharded(output_folder, batch_size=3) == 7
+    migrated = load_metadata()
+    for image_id, record in migrated.items():
+        assert record["path"] == shard_path("extracted_images", image_id, "png")
+        with open(record["path"], "rb") as image_file:
+            assert image_file.read() == image_id.encode()
+    assert [entry.name for entry in os.scandir("extracted_images") if entry.is_file()] == []
+    with ImageIndex() as index:
+        assert not index.sync_from_metadata(METADATA_FILE_PATH)
+        assert dict(index.iter_matching()) == {image_id: record["path"] for image_id, record in migrated.items()}
+
+    # Running it again finds nothing left to do
+    assert migrate_to_sharded(output_folder) == 0
+    assert load_metadata() == migrated
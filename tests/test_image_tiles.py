@@ -0,0 +1,55 @@
+import fitz
+
+from image_tiles import PdfImageRenderer, MAX_PAGE_SIDE
+
+COLOURS = [(255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 255, 0)]
+
+def make_pdf(pdf_path, width, height):
+    # Four quadrants of plain colour, drawn much smaller on the page than the
+    # image is, so that rendering the page would lose its resolution
+    half_width, half_height = width // 2, height // 2
+    top = bytes(COLOURS[0]) * half_width + bytes(COLOURS[1]) * half_width
+    bottom = bytes(COLOURS[2]) * half_width + bytes(COLOURS[3]) * half_width
+    pix = fitz.Pixmap(fitz.csRGB, width, height, top * half_height + bottom * half_height, False)
+    doc = fitz.open()
+    page = doc.new_page()
+    page.insert_image(fitz.Rect(100, 100, 200, 200), pixmap=pix)
+    doc.save(pdf_path, deflate=True)
+    doc.close()
+
+def pixel(tile, x, y):
+    samples, _, _, stride = tile
+    offset = y * stride + x * 3
+    return tuple(samples[offset:offset + 3])
+
+def test_tiles_have_the_requested_size_and_pixels(tmp_path):
+    pdf_path = str(tmp_path / "paper.pdf")
+    make_pdf(pdf_path, 800, 600)
+    renderer = PdfImageRenderer(pdf_path, 1, 1)
+    try:
+        assert (renderer.width, renderer.height) == (800, 600)
+
+        tile = renderer.render(0, 0, 400, 300, 1.0)
+        assert tile[1:3] == (400, 300)
+        assert pixel(tile, 10, 10) == COLOURS[0] and pixel(tile, 390, 290) == COLOURS[0]
+
+        # A region across all four quadrants, at half scale
+        tile = renderer.render(200, 150, 400, 300, 0.5)
+        assert tile[1:3] == (200, 150)
+        assert [pixel(tile, x, y) for x, y in [(20, 20), (180, 20), (20, 130), (180, 130)]] == COLOURS
+    finally:
+        renderer.close()
+
+def test_images_wider_than_a_page_keep_their_resolution(tmp_path):
+    pdf_path = str(tmp_path / "wide.pdf")
+    width = MAX_PAGE_SIDE + 1600
+    make_pdf(pdf_path, width, 40)
+    renderer = PdfImageRenderer(pdf_path, 1, 1)
+    try:
+        # One image pixel is still one tile pixel at zoom 1
+        tile = renderer.render(width // 2 - 64, 0, 128, 40, 1.0)
+        assert tile[1:3] == (128, 40)
+        assert pixel(tile, 10, 5) == COLOURS[0] and pixel(tile, 117, 5) == COLOURS[1]
+        assert pixel(tile, 10, 35) == COLOURS[2] and pixel(tile, 117, 35) == COLOURS[3]
+    finally:
+        renderer.close()
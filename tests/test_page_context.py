@@ -0,0 +1,20 @@
+import fitz
+
+from page_context import get_text_blocks, capture_caption, capture_page_text
+
+def test_caption_is_found_from_the_image_position():
+    pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 40, 40), False)
+    pix.set_rect(pix.irect, (200, 120, 40))
+    doc = fitz.open()
+    page = doc.new_page()
+    page.insert_image(fitz.Rect(100, 100, 300, 300), stream=pix.tobytes("png"))
+    page.insert_text((100, 320), "Figure 3: the test image")
+    page.insert_text((100, 600), "Unrelated text further down")
+    blocks = get_text_blocks(page)
+    (image,) = page.get_images(full=True)
+
+    assert capture_caption(page, image, blocks) == "Figure 3: the test image"
+    assert "Unrelated text further down" in capture_page_text(blocks)
+    # An image the page never draws has no position and so no caption
+    assert capture_caption(page, (999999, 0, 40, 40, 8, "DeviceRGB", "", "Missing", "", 0), blocks) == ""
+    doc.close()
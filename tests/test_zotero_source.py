@@ -0,0 +1,171 @@
+import os
+import sqlite3
+
+import fitz
+
+from zotero_source import (collect_zotero_attachments, resolve_attachment_path, ZOTERO_DB_NAME,
+                           load_sync_state, LINK_MODE_IMPORTED_FILE, LINK_MODE_IMPORTED_URL, LINK_MODE_LINKED_FILE)
+from image_extraction import iter_images_from_zotero, load_metadata
+
+def make_zotero_db(zotero_dir):
+    """Build a stand-in zotero.sqlite with just the tables zotero_source reads."""
+    os.makedirs(zotero_dir, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(zotero_dir, ZOTERO_DB_NAME))
+    conn.executescript("""
+        CREATE TABLE items (itemID INTEGER PRIMARY KEY, key TEXT, dateModified TEXT);
+        CREATE TABLE itemAttachments (itemID INTEGER PRIMARY KEY, parentItemID INTEGER,
+                                      linkMode INTEGER, contentType TEXT, path TEXT);
+        CREATE TABLE fields (fieldID INTEGER PRIMARY KEY, fieldName TEXT);
+        CREATE TABLE itemDataValues (valueID INTEGER PRIMARY KEY, value TEXT);
+        CREATE TABLE itemData (itemID INTEGER, fieldID INTEGER, valueID INTEGER);
+        CREATE TABLE deletedItems (itemID INTEGER PRIMARY KEY);
+        INSERT INTO fields VALUES (1, 'title');
+    """)
+    conn.commit()
+    return conn
+
+def add_item(conn, item_id, key, date_modified, title=None):
+    conn.execute("INSERT INTO items VALUES (?, ?, ?)", (item_id, key, date_modified))
+    if title is not None:
+        conn.execute("INSERT INTO itemDataValues VALUES (?, ?)", (item_id, title))
+        conn.execute("INSERT INTO itemData VALUES (?, 1, ?)", (item_id, item_id))
+    conn.commit()
+
+def add_attachment(conn, item_id, key, date_modified, path, parent_id=None,
+                   link_mode=LINK_MODE_IMPORTED_FILE, content_type="application/pdf", on_disk=True):
+    add_item(conn, item_id, key, date_modified)
+    conn.execute("INSERT INTO itemAttachments VALUES (?, ?, ?, ?, ?)",
+                 (item_id, parent_id, link_mode, content_type, path))
+    conn.commit()
+    if on_disk:
+        store_file(conn, key, path)
+
+def store_file(conn, key, path, content=b"%PDF-1.4"):
+    """Put an attachment's file where Zotero's storage folder keeps it."""
+    zotero_dir = os.path.dirname(conn.execute("PRAGMA database_list").fetchone()[2])
+    file_path = os.path.join(zotero_dir, "storage", key, path[len("storage:"):])
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, "wb") as f:
+        f.write(content)
+    return file_path
+
+def test_first_run_then_no_change_then_modified(tmp_path):
+    zotero_dir = str(tmp_path / "zotero")
+    conn = make_zotero_db(zotero_dir)
+    add_item(conn, 1, "PARENT1", "2024-01-01 00:00:00", title="A Paper")
+    add_attachment(conn, 2, "ATT1", "2024-01-02 10:00:00", "storage:a.pdf", parent_id=1)
+    add_attachment(conn, 3, "ATT2", "2024-01-03 10:00:00", "storage:b.pdf")
+    add_attachment(conn, 4, "NOTPDF", "2024-01-03 11:00:00", "storage:c.html", content_type="text/html")
+    add_attachment(conn, 5, "GONE", "2024-01-03 12:00:00", "storage:d.pdf")
+    conn.execute("INSERT INTO deletedItems VALUES (5)")
+    conn.commit()
+
+    attachments, entry = collect_zotero_attachments(zotero_dir, {})
+    assert [a["attachment_key"] for a in attachments] == ["ATT1", "ATT2"]
+    assert attachments[0]["item_key"] == "PARENT1"
+    assert attachments[0]["title"] == "A Paper"
+    assert attachments[0]["pdf_path"] == os.path.join(os.path.abspath(zotero_dir), "storage", "ATT1", "a.pdf")
+    assert attachments[1]["item_key"] == "ATT2"
+    state = {os.path.abspath(zotero_dir): entry}
+
+    attachments, unchanged = collect_zotero_attachments(zotero_dir, state)
+    assert attachments == []
+    assert unchanged == entry
+
+    conn.execute("UPDATE items SET dateModified = '2024-02-01 09:00:00' WHERE key = 'ATT1'")
+    conn.commit()
+    conn.close()
+    attachments, entry = collect_zotero_attachments(zotero_dir, state)
+    assert [a["attachment_key"] for a in attachments] == ["ATT1"]
+    assert entry == {"date_modified": "2024-02-01 09:00:00", "keys": ["ATT1"]}
+
+def test_same_second_modifications_are_not_missed(tmp_path):
+    zotero_dir = str(tmp_path / "zotero")
+    conn = make_zotero_db(zotero_dir)
+    add_attachment(conn, 1, "ATT1", "2024-01-01 10:00:00", "storage:a.pdf")
+    attachments, entry = collect_zotero_attachments(zotero_dir, {})
+    state = {os.path.abspath(zotero_dir): entry}
+
+    # Modified in the same second as the high-water mark
+    add_attachment(conn, 2, "ATT2", "2024-01-01 10:00:00", "storage:b.pdf")
+    conn.close()
+    attachments, entry = collect_zotero_attachments(zotero_dir, state)
+    assert [a["attachment_key"] for a in attachments] == ["ATT2"]
+    assert sorted(entry["keys"]) == ["ATT1", "ATT2"]
+
+def test_resolve_attachment_path(tmp_path):
+    zotero_dir = str(tmp_path)
+    assert resolve_attachment_path(zotero_dir, "KEY", "storage:x.pdf", LINK_MODE_IMPORTED_FILE) == \
+        os.path.join(zotero_dir, "storage", "KEY", "x.pdf")
+    assert resolve_attachment_path(zotero_dir, "KEY", "storage:x.pdf", LINK_MODE_IMPORTED_URL) == \
+        os.path.join(zotero_dir, "storage", "KEY", "x.pdf")
+    assert resolve_attachment_path(zotero_dir, "KEY", "storage:x.pdf", LINK_MODE_LINKED_FILE) is None
+
+    assert resolve_attachment_path(zotero_dir, "KEY", "attachments:papers/x.pdf", LINK_MODE_LINKED_FILE) is None
+    assert resolve_attachment_path(zotero_dir, "KEY", "attachments:papers/x.pdf", LINK_MODE_LINKED_FILE,
+                                   base_dir="/base") == os.path.join("/base", "papers/x.pdf")
+
+    assert resolve_attachment_path(zotero_dir, "KEY", "/home/me/x.pdf", LINK_MODE_LINKED_FILE) == "/home/me/x.pdf"
+    assert resolve_attachment_path(zotero_dir, "KEY", "/home/me/x.pdf", LINK_MODE_IMPORTED_FILE) is None
+
+def test_attachments_synced_before_their_file_are_retried(tmp_path):
+    zotero_dir = str(tmp_path / "zotero")
+    conn = make_zotero_db(zotero_dir)
+    add_attachment(conn, 1, "EARLY", "2024-01-01 10:00:00", "storage:early.pdf", on_disk=False)
+    add_attachment(conn, 2, "HERE", "2024-01-02 10:00:00", "storage:here.pdf")
+    attachments, entry = collect_zotero_attachments(zotero_dir, {})
+    assert [a["attachment_key"] for a in attachments] == ["HERE"]
+    assert entry == {"date_modified": "2024-01-02 10:00:00", "keys": ["HERE"], "missing": ["EARLY"]}
+    state = {os.path.abspath(zotero_dir): entry}
+
+    # Still not there: the mark stays put and the key stays listed
+    attachments, entry = collect_zotero_attachments(zotero_dir, state)
+    assert attachments == []
+    assert entry == state[os.path.abspath(zotero_dir)]
+
+    # The file arrives without the item being modified again
+    store_file(conn, "EARLY", "storage:early.pdf")
+    add_attachment(conn, 3, "LATER", "2024-01-03 10:00:00", "storage:later.pdf")
+    conn.close()
+    attachments, entry = collect_zotero_attachments(zotero_dir, state)
+    assert [a["attachment_key"] for a in attachments] == ["EARLY", "LATER"]
+    assert entry == {"date_modified": "2024-01-03 10:00:00", "keys": ["LATER"]}
+
+def make_pdf_bytes(colour):
+    pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 64, 64), False)
+    pix.set_rect(pix.irect, colour)
+    pix.set_rect(fitz.IRect(0, 0, 32, 32), (10, 10, 200))
+    doc = fitz.open()
+    page = doc.new_page()
+    page.insert_image(fitz.Rect(100, 100, 300, 300), stream=pix.tobytes("png"))
+    return doc.tobytes()
+
+def test_iter_images_from_zotero(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    zotero_dir = str(tmp_path / "zotero")
+    conn = make_zotero_db(zotero_dir)
+    add_item(conn, 1, "PARENT1", "2024-01-01 00:00:00", title="A Paper")
+    add_attachment(conn, 2, "ATT1", "2024-01-02 10:00:00", "storage:a.pdf", parent_id=1, on_disk=False)
+    store_file(conn, "ATT1", "storage:a.pdf", make_pdf_bytes((200, 120, 40)))
+    add_attachment(conn, 3, "ATT2", "2024-01-03 10:00:00", "storage:b.pdf", on_disk=False)
+
+    records = dict(iter_images_from_zotero(zotero_dir, "extracted_images", 0, 100))
+    assert [(r["zotero_attachment_key"], r["zotero_item_key"], r["zotero_title"]) for r in records.values()] == \
+        [("ATT1", "PARENT1", "A Paper")]
+    assert load_metadata() == records
+    state = load_sync_state()
+    assert state[os.path.abspath(zotero_dir)]["missing"] == ["ATT2"]
+
+    # The missing file arrives and the first attachment is modified: its
+    # images are replaced, and the other one is extracted at last
+    store_file(conn, "ATT2", "storage:b.pdf", make_pdf_bytes((40, 120, 200)))
+    conn.execute("UPDATE items SET dateModified = '2024-02-01 09:00:00' WHERE key = 'ATT1'")
+    conn.commit()
+    conn.close()
+    (old_id,) = records
+    records = dict(iter_images_from_zotero(zotero_dir, "extracted_images", 0, 100))
+    assert sorted(r["zotero_attachment_key"] for r in records.values()) == ["ATT1", "ATT2"]
+    saved = load_metadata()
+    assert set(saved) == set(records) and old_id not in saved
+    assert "missing" not in load_sync_state()[os.path.abspath(zotero_dir)]
+    assert list(iter_images_from_zotero(zotero_dir, "extracted_images", 0, 100)) == []
@@ -0,0 +1,162 @@
+import os
+import json
+import shutil
+import sqlite3
+import tempfile
+
+# Zotero keeps an exclusive lock on its database while running, so we always
+# read from a private copy. Only the following tables are used: items,
+# itemAttachments, itemData, itemDataValues, fields and deletedItems.
+ZOTERO_DB_NAME = "zotero.sqlite"
+SYNC_STATE_PATH = "zotero_sync_state.json"
+
+# itemAttachments.linkMode values
+LINK_MODE_IMPORTED_FILE = 0
+LINK_MODE_IMPORTED_URL = 1
+LINK_MODE_LINKED_FILE = 2
+
+ATTACHMENTS_QUERY = """
+    SELECT att.key, att.dateModified, ia.path, ia.linkMode, parent.key,
+           COALESCE(
+               (SELECT v.value FROM itemData d
+                JOIN itemDataValues v ON v.valueID = d.valueID
+                JOIN fields f ON f.fieldID = d.fieldID
+                WHERE d.itemID = parent.itemID AND f.fieldName = 'title'),
+               (SELECT v.value FROM itemData d
+                JOIN itemDataValues v ON v.valueID = d.valueID
+                JOIN fields f ON f.fieldID = d.fieldID
+                WHERE d.itemID = att.itemID AND f.fieldName = 'title')
+           ) AS title
+    FROM itemAttachments ia
+    JOIN items att ON att.itemID = ia.itemID
+    LEFT JOIN items parent ON parent.itemID = ia.parentItemID
+    WHERE ia.contentType = 'application/pdf'
+      AND ia.path IS NOT NULL
+      AND ia.itemID NOT IN (SELECT itemID FROM deletedItems)
+      AND (att.dateModified >= ? OR att.key IN (SELECT value FROM json_each(?)))
+    ORDER BY att.dateModified
+"""
+
+def copy_zotero_database(zotero_dir, dest_dir):
+    """Copy zotero.sqlite (and its WAL file, if any) into dest_dir."""
+    db_path = os.path.join(zotero_dir, ZOTERO_DB_NAME)
+    if not os.path.exists(db_path):
+        raise FileNotFoundError(f"No {ZOTERO_DB_NAME} found in {zotero_dir}")
+
+    copy_path = os.path.join(dest_dir, ZOTERO_DB_NAME)
+    shutil.copy2(db_path, copy_path)
+    if os.path.exists(db_path + "-wal"):
+        shutil.copy2(db_path + "-wal", copy_path + "-wal")
+    return copy_path
+
+def resolve_attachment_path(zotero_dir, attachment_key, path, link_mode, base_dir=None):
+    """Turn an itemAttachments.path value into an absolute file path, or None."""
+    if path.startswith("storage:"):
+        if link_mode not in (LINK_MODE_IMPORTED_FILE, LINK_MODE_IMPORTED_URL):
+            return None
+        return os.path.join(zotero_dir, "storage", attachment_key, path[len("storage:"):])
+    if path.startswith("attachments:"):
+        # Relative to the "Linked Attachment Base Directory", which lives in
+        # Zotero's prefs rather than in the database.
+        if base_dir is None:
+            return None
+        return os.path.join(base_dir, path[len("attachments:"):])
+    if link_mode == LINK_MODE_LINKED_FILE:
+        return path
+    return None
+
+def load_sync_state(state_path=SYNC_STATE_PATH):
+    """Load the per-database high-water marks of previous runs."""
+    if os.path.exists(state_path):
+        try:
+            with open(state_path, "r") as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"Error loading Zotero sync state: {str(e)}")
+    return {}
+
+def save_sync_state(state, state_path=SYNC_STATE_PATH):
+    """Save the per-database high-water marks."""
+    try:
+        with open(state_path, "w") as f:
+            json.dump(state, f, indent=4)
+    except Exception as e:
+        print(f"Error saving Zotero sync state: {str(e)}")
+
+def query_pdf_attachments(db_path, zotero_dir, since=None, skip_keys=(), base_dir=None, retry_keys=()):
+    """
+    List PDF attachments modified at or after `since` from a Zotero database,
+    plus those in `retry_keys` whenever they were modified.
+
+    Returns a list of dicts with the attachment key, parent item key, title,
+    dateModified and resolved pdf_path. Attachments in `skip_keys` (those
+    already seen at exactly `since`) are left out unless they are retried.
+    """
+    retry_keys = set(retry_keys)
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        rows = conn.execute(ATTACHMENTS_QUERY, (since or "", json.dumps(sorted(retry_keys)))).fetchall()
+    finally:
+        conn.close()
+
+    skip_keys = set(skip_keys) - retry_keys
+    attachments = []
+    for key, date_modified, path, link_mode, parent_key, title in rows:
+        if date_modified == since and key in skip_keys:
+            continue
+        pdf_path = resolve_attachment_path(zotero_dir, key, path, link_mode, base_dir)
+        if pdf_path is None:
+            continue
+        attachments.append({
+            "attachment_key": key,
+            "item_key": parent_key or key,
+            "title": title or "",
+            "date_modified": date_modified,
+            "pdf_path": pdf_path,
+        })
+    return attachments
+
+def collect_zotero_attachments(zotero_dir, state=None, base_dir=None):
+    """
+    Read the PDF attachments changed since the last run from a Zotero data directory.
+
+    Returns (attachments, new_state_entry). The caller should store
+    new_state_entry in the sync state once the attachments have been processed.
+
+    Zotero often syncs an item before its file. Attachments whose PDF is
+    not on disk yet are left out and listed under "missing" in the state
+    entry, and every later run tries them again until the file turns up.
+    """
+    zotero_dir = os.path.abspath(zotero_dir)
+    entry = (state or {}).get(zotero_dir, {})
+    since = entry.get("date_modified")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_copy = copy_zotero_database(zotero_dir, tmp_dir)
+        found = query_pdf_attachments(db_copy, zotero_dir, since, entry.get("keys", []), base_dir,
+                                      entry.get("missing", []))
+
+    attachments, missing = [], []
+    for attachment in found:
+        if os.path.exists(attachment["pdf_path"]):
+            attachments.append(attachment)
+        else:
+            print(f"Zotero attachment {attachment['pdf_path']} is not on disk yet, will retry next run")
+            missing.append(attachment["attachment_key"])
+
+    new_entry = {"date_modified": since, "keys": list(entry.get("keys", []))}
+    # Retried attachments can be older than the mark, which never moves back
+    newer = [a for a in found if since is None or a["date_modified"] >= since]
+    if newer:
+        # Remember every key at the newest timestamp so that attachments modified
+        # within the same second are neither missed nor processed twice.
+        newest = newer[-1]["date_modified"]
+        newest_keys = [a["attachment_key"] for a in newer if a["date_modified"] == newest]
+        if newest == since:
+            newest_keys = [key for key in entry.get("keys", []) if key not in newest_keys] + newest_keys
+        new_entry = {"date_modified": newest, "keys": newest_keys}
+    if missing:
+        new_entry["missing"] = missing
+    if not entry and not found:
+        return attachments, entry
+    return attachments, new_entry